@@ -15,6 +15,7 @@
 # limitations under the License.
 ## """Helper classes which help converting a url to a list of SB expressions."""
 
+import collections
 import re
 import urllib.parse
 import urllib
@@ -34,38 +35,43 @@ class ExpressionGenerator(object):
     OCT = re.compile(r'^0([0-7]+)$')
     DEC = re.compile(r'^(\d+)$')
     IP_WITH_TRAILING_SPACE = re.compile(r'^(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) ')
-    POSSIBLE_IP = re.compile(r'^(?i)((?:0x[0-9a-f]+|[0-9\\.])+)$')
+    POSSIBLE_IP = re.compile(r'(?i)^((?:0x[0-9a-f]+|[0-9\\.])+)$')
     FIND_BAD_OCTAL_REGEXP = re.compile(r'(^|\.)0\d*[89]')
     HOST_PORT_REGEXP = re.compile(r'^(?:.*@)?(?P<host>[^:]*)(:(?P<port>\d+))?$')
     SAFE_CHARS = GenerateSafeChars()
+    # string ที่ไม่มี '%' และมีแต่ SAFE_CHARS ผ่าน _Escape ออกมาเหมือนเดิม
+    UNSAFE_CHAR = re.compile('[^' + re.escape(SAFE_CHARS) + ']')
+    HEX_DIGITS = frozenset(string.hexdigits)
     DEFAULT_PORTS = {'http': '80', 'https': '443', 'ftp': '21'}
 
     def __init__(self, url):
         parse_exception = UrlParseError('failed to parse URL "%s"' % (url,))
-        canonical_url = ExpressionGenerator.CanonicalizeUrl(url)
-        if not canonical_url:
+        parts = ExpressionGenerator._CanonicalParts(url)
+        if not parts:
             raise parse_exception
 
-        self._host_lists = []
-        self._path_exprs = []
-        url_split = urllib.parse.urlsplit(canonical_url)
-        canonical_host, canonical_path = url_split[1], url_split[2]
-        self._MakeHostLists(canonical_host, parse_exception)
-        if url_split[3]:
-            self._path_exprs.append(canonical_path + '?' + url_split[3])
-        self._path_exprs.append(canonical_path)
-
-        path_parts = canonical_path.rstrip('/').lstrip('/').split('/')[:3]
-        if canonical_path.count('/') < 4:
-            path_parts.pop()
-        while path_parts:
-            self._path_exprs.append('/' + '/'.join(path_parts) + '/')
-            path_parts.pop()
-        if canonical_path != '/':
-            self._path_exprs.append('/')
+        _, canonical_host, canonical_path, query, _ = parts
+        self._host_lists = ExpressionGenerator._MakeHostLists(canonical_host, parse_exception)
+        self._path_exprs = ExpressionGenerator._MakePathExprs(canonical_path, query)
 
     @staticmethod
     def CanonicalizeUrl(url):
+        parts = ExpressionGenerator._CanonicalParts(url)
+        if not parts:
+            return None
+        scheme, canonical_host, canonical_path, query, has_query = parts
+        canonical_url = scheme + '://' + canonical_host + canonical_path
+        if has_query:
+            canonical_url += '?' + query
+        return canonical_url
+
+    @staticmethod
+    def _CanonicalParts(url):
+        """
+        (scheme, host[:port], path, query, has_query) of the canonical URL, or
+        None. Shared by CanonicalizeUrl() and __init__, so the canonical URL
+        is not built and split again to make the expressions.
+        """
         tmp_pos = url.find('#')
         if tmp_pos >= 0:
             url = url[:tmp_pos]
@@ -91,10 +97,8 @@ class ExpressionGenerator(object):
         if port and port != ExpressionGenerator.DEFAULT_PORTS[url_scheme]:
             canonical_host += ':' + port
         canonical_path = ExpressionGenerator.CanonicalizePath(url_split.path)
-        canonical_url = url_split.scheme + '://' + canonical_host + canonical_path
-        if url_split.query != '' or url.endswith('?'):
-            canonical_url += '?' + url_split.query
-        return canonical_url
+        has_query = url_split.query != '' or url.endswith('?')
+        return url_split.scheme, canonical_host, canonical_path, url_split.query, has_query
 
     @staticmethod
     def CanonicalizePath(path):
@@ -144,20 +148,18 @@ class ExpressionGenerator(object):
             return None
         ip = []
         for i in range(len(host_split)):
-            m = ExpressionGenerator.HEX.match(host_split[i])
-            if m:
-                base = 16
-            else:
-                m = ExpressionGenerator.OCT.match(host_split[i])
-                if m and allow_octal:
-                    base = 8
+            # เทียบเท่า HEX / OCT / DEC แต่ไม่ต้องรัน regex ทีละ octet
+            # (POSSIBLE_IP ให้ผ่านเฉพาะ ASCII จึงใช้ isdigit() ได้)
+            part = host_split[i]
+            if part.isdigit():
+                if allow_octal and len(part) > 1 and part[0] == '0':
+                    n = int(part, 8)
                 else:
-                    m = ExpressionGenerator.DEC.match(host_split[i])
-                    if m:
-                        base = 10
-                    else:
-                        return None
-            n = int(m.group(1), base)
+                    n = int(part, 10)
+            elif part.startswith('0x') and len(part) > 2 and ExpressionGenerator.HEX_DIGITS.issuperset(part[2:]):
+                n = int(part[2:], 16)
+            else:
+                return None
             if n > 255:
                 if i < len(host_split) - 1:
                     n &= 0xff
@@ -186,17 +188,22 @@ class ExpressionGenerator(object):
 
     @staticmethod
     def _Escape(unescaped_str):
+        if '%' not in unescaped_str:
+            # ไม่มีอะไรให้ unquote ถ้าไม่มีตัวอักษรที่ต้อง quote ก็ไม่ต้องสร้าง string ใหม่
+            if not ExpressionGenerator.UNSAFE_CHAR.search(unescaped_str):
+                return unescaped_str
+            return urllib.parse.quote(unescaped_str, ExpressionGenerator.SAFE_CHARS)
         unquoted = urllib.parse.unquote(unescaped_str)
         while unquoted != unescaped_str:
             unescaped_str = unquoted
             unquoted = urllib.parse.unquote(unquoted)
         return urllib.parse.quote(unquoted, ExpressionGenerator.SAFE_CHARS)
 
-    def _MakeHostLists(self, host, parse_exception):
+    @staticmethod
+    def _MakeHostLists(host, parse_exception):
         ip = ExpressionGenerator.CanonicalizeIp(host)
         if ip is not None:
-            self._host_lists.append([ip])
-            return
+            return [[ip]]
         host_split = [part for part in host.split('.') if part]
         if len(host_split) < 2:
             raise parse_exception
@@ -204,15 +211,31 @@ class ExpressionGenerator(object):
         stop = len(host_split) - 1
         if start <= 0:
             start = 1
-        self._host_lists.append(host_split)
+        host_lists = [host_split]
         for i in range(start, stop):
-            self._host_lists.append(host_split[i:])
+            host_lists.append(host_split[i:])
+        return host_lists
+
+    @staticmethod
+    def _MakePathExprs(canonical_path, query):
+        path_exprs = []
+        if query:
+            path_exprs.append(canonical_path + '?' + query)
+        path_exprs.append(canonical_path)
+
+        path_parts = canonical_path.rstrip('/').lstrip('/').split('/')[:3]
+        if canonical_path.count('/') < 4:
+            path_parts.pop()
+        while path_parts:
+            path_exprs.append('/' + '/'.join(path_parts) + '/')
+            path_parts.pop()
+        if canonical_path != '/':
+            path_exprs.append('/')
+        return path_exprs
 
-class Expression(object):
-    def __init__(self, host, path):
-        self._host = host
-        self._path = path
-        self._value = host + path
+class Expression(collections.namedtuple('Expression', ['host', 'path'])):
+    """A lookup expression as a (host, path) tuple; the string is only built by Value()."""
+    __slots__ = ()
 
     def __str__(self):
         return self.Value()
@@ -221,5 +244,35 @@ class Expression(object):
         return self.Value()
 
     def Value(self):
-        return self._value
+        return self.host + self.path
+
+def expressions_for(urls):
+    """
+    Yields (url, expressions) for each URL, where expressions is the list of
+    lookup strings (host + path) that ExpressionGenerator(url).Expressions()
+    would give, or an empty list if the URL cannot be parsed.
+
+    Meant for whole feeds: no Expression objects are created, and the host
+    expressions of a host are computed once and reused for its other URLs.
+    """
+    parse_exception = UrlParseError('failed to parse URL')
+    hosts = {}
+    for url in urls:
+        try:
+            parts = ExpressionGenerator._CanonicalParts(url)
+        except ValueError:
+            parts = None  # urlsplit() ปฏิเสธ netloc บางแบบ เช่น '[' ที่ไม่ปิด
+        if not parts:
+            yield url, []
+            continue
+        _, canonical_host, canonical_path, query, _ = parts
+        host_exprs = hosts.get(canonical_host)
+        if host_exprs is None:
+            try:
+                host_lists = ExpressionGenerator._MakeHostLists(canonical_host, parse_exception)
+            except UrlParseError:
+                host_lists = []
+            host_exprs = hosts[canonical_host] = ['.'.join(host_parts) for host_parts in host_lists]
+        path_exprs = ExpressionGenerator._MakePathExprs(canonical_path, query)
+        yield url, [host + path for host in host_exprs for path in path_exprs]
 
@@ -0,0 +1,91 @@
+# tools/web_scan/benchmarks/bench_blacklist_snapshot.py
+"""
+Load time, memory and lookup rate of BlacklistSnapshot on a synthetic
+blacklist, against the old one-query-per-URL check_blacklist().
+
+    python benchmarks/bench_blacklist_snapshot.py --rows 5000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from sqlalchemy import Boolean, Column, Date, Integer, String, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from blacklist_snapshot import BlacklistSnapshot
+
+Base = declarative_base()
+
+
+class BlacklistURL(Base):
+    __tablename__ = "url"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    url = Column(String, unique=True, index=True)
+    category = Column(String, default="phishing")
+    date_added = Column(Date)
+    reason = Column(String)
+    status = Column(Boolean, default=True)
+    source = Column(String, default="openphish")
+
+
+def synthetic_url(i):
+    return f"https://login-{i % 100000}.example{i // 100000}.com/secure/{i}/index.php"
+
+
+def seed(path, rows):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO url (url, category, reason, status, source) VALUES (?, 'phishing', 'benchmark', ?, 'openphish')",
+        ((synthetic_url(i), i % 50 != 0) for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+    return engine
+
+
+def set_size(urls):
+    return sys.getsizeof(urls) + sum(sys.getsizeof(url) for url in urls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = seed(os.path.join(tmp, "blacklist.db"), args.rows)
+        Session = sessionmaker(bind=engine)
+        snapshot = BlacklistSnapshot(Session, BlacklistURL)
+
+        active = snapshot.load()
+        print(f"rows: {args.rows}, active URLs: {active}")
+        print(f"load time: {snapshot.load_seconds:.1f} s")
+        print(f"set memory: {set_size(snapshot.urls) / 1024 / 1024:.0f} MiB ({set_size(snapshot.urls) / max(active, 1):.0f} bytes/URL)")
+
+        samples = [synthetic_url(random.randrange(args.rows * 2)) for _ in range(args.lookups)]
+        start = time.perf_counter()
+        for url in samples:
+            url in snapshot
+        snapshot_rate = args.lookups / (time.perf_counter() - start)
+
+        query_samples = samples[:2000]
+        start = time.perf_counter()
+        for url in query_samples:
+            with Session() as session:
+                session.query(BlacklistURL).filter_by(url=url, status=True).first()
+        query_rate = len(query_samples) / (time.perf_counter() - start)
+
+        print(f"snapshot lookups: {snapshot_rate:,.0f} /s")
+        print(f"per-URL query:    {query_rate:,.0f} /s")
+
+
+if __name__ == "__main__":
+    main()
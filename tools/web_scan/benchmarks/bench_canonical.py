@@ -0,0 +1,156 @@
+# tools/web_scan/benchmarks/bench_canonical.py
+"""
+Hit rates of the lookup structures with raw versus canonical URL keys, and
+the cost of canonicalize_url() with and without its memo.
+
+Builds --urls distinct URLs over --hosts hosts and a stream of --lookups
+requests for them, each written in one of the spellings seen in short
+links (upper-case host, no slash after the host, default port,
+fragment, percent-encoded or dot-segment path, surrounding spaces). Then:
+
+  - blacklist:    a --listed fraction of the URLs is listed in one spelling,
+                  every lookup of a listed URL should hit;
+  - scan_records / verdict cache: the first lookup of a URL stores it,
+                  every later lookup of the same URL should hit.
+
+Each structure is keyed by the raw string, by the trailing-slash
+normalization hybrid_scan used to do, and by canonicalize_url().
+
+    python benchmarks/bench_canonical.py --urls 20000 --lookups 200000
+    python benchmarks/bench_canonical.py --cache-size 1000 --output canonical.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def spell(url, rng):
+    """One of the ways the same URL shows up in short links."""
+    scheme, rest = url.split("://", 1)
+    host, path = rest.split("/", 1)
+    path = "/" + path
+    variant = rng.randrange(8)
+    if variant == 1:
+        host = host.upper()
+    elif variant == 2 and path == "/":
+        path = ""  # "/page/" กับ "/page" เป็นคนละ URL จึงตัดเฉพาะ "/" ของ host
+    elif variant == 3:
+        host = f"{host}:{80 if scheme == 'http' else 443}"
+    elif variant == 4:
+        path = path + "#top"
+    elif variant == 5:
+        path = path.replace("a", "%61", 1)
+    elif variant == 6:
+        path = "/." + path
+    elif variant == 7:
+        return f"  {scheme}://{host}{path} "
+    return f"{scheme}://{host}{path}"
+
+
+def make_urls(args, rng):
+    urls = []
+    for i in range(args.urls):
+        host = f"host{rng.randrange(args.hosts)}.example.com"
+        scheme = rng.choice(("http", "https"))
+        path = rng.choice(("/", f"/page{i}", f"/a/path{i}/", f"/login{i}?id={i}"))
+        urls.append(f"{scheme}://{host}{path}")
+    return urls
+
+
+def normalize_trailing_slash(url):
+    """What hybrid_scan/main.py:normalize_url() used to do."""
+    parsed_url = urllib.parse.urlparse(url.strip())
+    return parsed_url._replace(path=parsed_url.path.rstrip("/")).geturl()
+
+
+# canonical ถูกเพิ่มหลัง import canonical ใน main()
+KEYS = {"raw": str.strip, "trailing_slash": normalize_trailing_slash}
+
+
+def hit_rates(stream, listed, key):
+    """
+    stream is (url, spelling) pairs; listed maps a listed URL to the spelling
+    in the blacklist. A lookup should hit the blacklist if its URL is listed,
+    and scan_records if the same URL was looked up before in any spelling.
+    """
+    blacklist = {key(spelling) for spelling in listed.values()}
+    blacklist_hits = blacklist_lookups = 0
+    stored, scanned = set(), set()
+    records_hits = records_lookups = 0
+    for url, spelling in stream:
+        spelling_key = key(spelling)
+        if url in listed:
+            blacklist_lookups += 1
+            blacklist_hits += spelling_key in blacklist
+        if url in scanned:
+            records_lookups += 1
+            records_hits += spelling_key in stored
+        scanned.add(url)
+        stored.add(spelling_key)
+    return {
+        "blacklist": blacklist_hits / blacklist_lookups if blacklist_lookups else 0.0,
+        "scan_records": records_hits / records_lookups if records_lookups else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=20000)
+    parser.add_argument("--hosts", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--listed", type=float, default=0.1, help="fraction of the URLs in the blacklist")
+    parser.add_argument("--cache-size", type=int, help="CANONICAL_URL_CACHE_SIZE for this run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.cache_size is not None:
+        os.environ["CANONICAL_URL_CACHE_SIZE"] = str(args.cache_size)
+    import canonical
+
+    rng = random.Random(args.seed)
+    urls = make_urls(args, rng)
+    listed = {url: spell(url, rng) for url in rng.sample(urls, int(len(urls) * args.listed))}
+    KEYS["canonical"] = canonical.canonicalize_url
+    stream = []
+    for _ in range(args.lookups):
+        url = rng.choice(urls)
+        stream.append((url, spell(url, rng)))
+    spellings = [spelling for _, spelling in stream]
+
+    started = time.perf_counter()
+    canonical.canonicalize_urls(spellings, cache=False)
+    uncached_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    canonical.canonicalize_urls(spellings)
+    cached_seconds = time.perf_counter() - started
+
+    report = {
+        "config": vars(args),
+        "hit_rates": {name: hit_rates(stream, listed, key) for name, key in KEYS.items()},
+        "canonicalize_us_per_url": {
+            "uncached": uncached_seconds / len(spellings) * 1e6,
+            "memoized": cached_seconds / len(spellings) * 1e6,
+        },
+        "memo": canonical.cache_stats(),
+    }
+
+    print(f"{'key':<16} {'blacklist hit %':>16} {'scan_records hit %':>19}")
+    for name, rates in report["hit_rates"].items():
+        print(f"{name:<16} {rates['blacklist']:>16.1%} {rates['scan_records']:>19.1%}")
+    print(f"canonicalize_url: {report['canonicalize_us_per_url']['uncached']:.1f} us uncached, "
+          f"{report['canonicalize_us_per_url']['memoized']:.1f} us memoized "
+          f"(memo hit ratio {report['memo']['hit_ratio']:.1%}, {report['memo']['size']} URLs)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
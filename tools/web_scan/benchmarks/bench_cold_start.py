@@ -0,0 +1,137 @@
+# tools/web_scan/benchmarks/bench_cold_start.py
+"""
+Cold-start time of check_urls.py: each run is a fresh interpreter that
+imports check_urls, creates the tables (init_databases) and then loads every
+provider in CHECK_PLAN through provider_registry, one at a time, against a
+temporary SQLite database, blacklist and PhishTank CSV of the given sizes.
+
+Prints the median and minimum over --runs of the interpreter's total time,
+the import, init_databases() and each provider's load, and whether the Web
+Risk client library was imported before it was needed.
+
+    python benchmarks/bench_cold_start.py --runs 5 --phishtank-rows 100000 --blacklist-rows 500000
+    python benchmarks/bench_cold_start.py --check-plan "Blacklist,Phishtank;URLhaus" --output cold_start.json
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# รันใน interpreter ใหม่ทุกครั้ง เพื่อไม่ให้ module ที่ import แล้วถูกนับซ้ำ
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import check_urls
+imported = time.perf_counter()
+lazy_webrisk = "google.cloud.webrisk_v1" not in sys.modules
+check_urls.init_databases()
+initialised = time.perf_counter()
+providers = {}
+for tier in check_urls.check_plan:
+    for name in tier:
+        if name in check_urls.provider_registry:
+            check_urls.provider_registry.get(name)
+            providers[name] = check_urls.provider_registry.load_seconds[name]
+print(json.dumps({
+    "import_seconds": imported - started,
+    "init_databases_seconds": initialised - imported,
+    "providers": providers,
+    "webrisk_imported_lazily": lazy_webrisk,
+}))
+"""
+
+
+def seed(workdir, args):
+    phishtank_csv = os.path.join(workdir, "phishtank.csv")
+    with open(phishtank_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["phish_id", "url", "phish_detail_url", "submission_time", "verified", "verification_time", "online", "target"])
+        for i in range(args.phishtank_rows):
+            writer.writerow([i, f"http://phish{i}.example.com/login", f"http://phishtank.example.com/{i}", "", "yes", "", "yes", "Other"])
+
+    blacklist_db = os.path.join(workdir, "blacklist.db")
+    conn = sqlite3.connect(blacklist_db)
+    conn.execute(
+        "CREATE TABLE url (id INTEGER PRIMARY KEY AUTOINCREMENT, url VARCHAR UNIQUE, category VARCHAR, "
+        "date_added DATE, reason VARCHAR, status BOOLEAN, source VARCHAR)"
+    )
+    conn.executemany(
+        "INSERT INTO url (url, category, reason, status, source) VALUES (?, 'phishing', 'benchmark', 1, 'openphish')",
+        ((f"http://bad{i}.example.net/{i}",) for i in range(args.blacklist_rows))
+    )
+    conn.commit()
+    conn.close()
+
+    return {
+        "DATABASE_PATH": f"sqlite:///{os.path.join(workdir, 'shortener.db')}",
+        "BLACKLIST_DATABASE_PATH": f"sqlite:///{blacklist_db}",
+        "PHISHTANK_CSV": phishtank_csv,
+        "OPENPHISH_STATE_PATH": os.path.join(workdir, "openphish_state.json"),
+        "WEBRISK_API_ENDPOINT": "http://127.0.0.1:9",  # สร้าง client ได้โดยไม่ต้องมี credential และไม่มีการเชื่อมต่อ
+        "WEBRISK_MODE": "lookup",
+        "VIRUSTOTAL_API_KEY": "bench",
+        "CHECK_PLAN": args.check_plan,
+        "SCANNER_RATE_LIMIT_DB": "",
+        "METRICS_PORT": "0",
+    }
+
+
+def run_once(env):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=SOURCE_DIR, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_seconds"] = time.perf_counter() - started
+    return result
+
+
+def summarize(values):
+    return {"median": statistics.median(values), "min": min(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--phishtank-rows", type=int, default=50000)
+    parser.add_argument("--blacklist-rows", type=int, default=200000)
+    parser.add_argument("--check-plan", default="Blacklist,Phishtank;URLhaus,Google Web Risk;VirusTotal")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, **seed(workdir, args))
+        runs = [run_once(env) for _ in range(args.runs)]
+
+    report = {
+        "config": vars(args),
+        "process_seconds": summarize([run["process_seconds"] for run in runs]),
+        "import_seconds": summarize([run["import_seconds"] for run in runs]),
+        "init_databases_seconds": summarize([run["init_databases_seconds"] for run in runs]),
+        "providers": {
+            name: summarize([run["providers"][name] for run in runs]) for name in runs[0]["providers"]
+        },
+        "webrisk_imported_lazily": all(run["webrisk_imported_lazily"] for run in runs),
+    }
+
+    print(f"{'stage':<28} {'median s':>9} {'min s':>9}")
+    for stage in ("process_seconds", "import_seconds", "init_databases_seconds"):
+        print(f"{stage:<28} {report[stage]['median']:>9.3f} {report[stage]['min']:>9.3f}")
+    for name, stats in report["providers"].items():
+        print(f"{'load ' + name:<28} {stats['median']:>9.3f} {stats['min']:>9.3f}")
+    print(f"Web Risk imported only when loaded: {report['webrisk_imported_lazily']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
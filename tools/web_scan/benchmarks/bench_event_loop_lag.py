@@ -0,0 +1,213 @@
+# tools/web_scan/benchmarks/bench_event_loop_lag.py
+"""
+Event loop lag of check_urls.py's database work under load, with blocking
+(synchronous SQLAlchemy) and async (asyncpg / aiosqlite) access.
+
+--workers coroutines each take a URL, look up --providers verdicts in the
+verdict cache, wait --http-ms (a provider call stand-in), store the
+verdicts and queue the scan result, the database work check_url does per
+URL. The same statements run two ways:
+
+  - blocking: verdict_cache reads and writes, upsert_scan_records() and
+              UPDATEs through the synchronous engine, called from the
+              coroutines the way the scanner used to;
+  - async:    VerdictCache.aget()/queue() and ScanResultWriter through the
+              async engine, as the scanner does now.
+
+While it runs, a sampler measures how late a 10 ms sleep wakes up (loop
+lag), and every simulated provider call how late its response would be
+noticed (HTTP overshoot). The database is a temporary SQLite file unless
+--database points somewhere else, e.g. a PostgreSQL test database.
+
+    python benchmarks/bench_event_loop_lag.py --urls 3000 --workers 50
+    python benchmarks/bench_event_loop_lag.py --database postgresql://scanner@localhost/scanner_bench --output lag.json
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+sys.path.insert(0, BENCHMARKS_DIR)
+from bench_pipeline import LoopLagMonitor, percentile
+from scan_store import upsert_scan_records
+from sqlalchemy import update
+from sqlalchemy.orm import sessionmaker
+from canonical import canonicalize_url
+from verdict_cache import MISS, VerdictCacheEntry, result_to_str, str_to_result
+
+PROVIDERS = ("URLhaus", "Google Web Risk", "VirusTotal")
+
+
+def seed(check_urls, mode, count):
+    urls = [f"http://{mode}{i % 500}.lag.test/page/{i}" for i in range(count)]
+    with check_urls.engine_shortener.begin() as conn:
+        conn.execute(check_urls.URL.__table__.insert(), [
+            {"key": f"{mode}{i}", "secret_key": f"{mode}-secret{i}", "target_url": url, "is_active": True, "is_checked": False}
+            for i, url in enumerate(urls)
+        ])
+    return urls
+
+
+class BlockingCache:
+    """VerdictCache as it was: a session per lookup and per verdict through the synchronous engine."""
+
+    def __init__(self, check_urls):
+        self.ttl_for = check_urls.verdict_cache.ttl_for
+        self.Session = sessionmaker(bind=check_urls.engine_shortener)
+
+    def get(self, url, provider):
+        key = (canonicalize_url(url), provider)
+        with self.Session() as session:
+            record = session.get(VerdictCacheEntry, key)
+        if record is not None and record.expires_at > time.time():
+            return str_to_result(record.result)
+        return MISS
+
+    def set(self, url, provider, result):
+        result_str = result_to_str(result)
+        ttl = self.ttl_for(provider, result_str)
+        if ttl <= 0:
+            return
+        with self.Session() as session:
+            session.merge(VerdictCacheEntry(url=canonicalize_url(url), provider=provider, result=result_str, expires_at=time.time() + ttl))
+            session.commit()
+
+
+class BlockingWriter:
+    """ScanResultWriter as it was: every write runs on the event loop through the synchronous engine."""
+
+    def __init__(self, check_urls, batch_size):
+        self.check_urls = check_urls
+        self.batch_size = batch_size
+        self.records, self.statuses = {}, {}
+
+    def add(self, url, results, status=None):
+        for scan_type, result_str in results.items():
+            self.records[(url, scan_type)] = {"url": url, "scan_type": scan_type, "result": result_str, "scan_id": None}
+        self.statuses[url] = status
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        c = self.check_urls
+        records, statuses = list(self.records.values()), self.statuses
+        self.records, self.statuses = {}, {}
+        upsert_scan_records(c.engine_shortener, c.scan_records.__table__, records)
+        with c.SessionShortener() as session:
+            for status in set(statuses.values()):
+                urls = [url for url, url_status in statuses.items() if url_status == status]
+                session.execute(update(c.URL).where(c.URL.target_url.in_(urls)).values(status=status))
+            session.execute(update(c.URL).where(c.URL.target_url.in_(list(statuses))).values(is_checked=True))
+            session.commit()
+
+
+async def run(check_urls, mode, urls, args):
+    queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+    overshoots = []
+    cache = BlockingCache(check_urls) if mode == "blocking" else check_urls.verdict_cache
+    writer = BlockingWriter(check_urls, args.batch_size) if mode == "blocking" else check_urls.scan_result_writer
+
+    async def worker():
+        while not queue.empty():
+            url = queue.get_nowait()
+            results = {}
+            for provider in PROVIDERS[:args.providers]:
+                cached = cache.get(url, provider) if mode == "blocking" else await cache.aget(url, provider)
+                if cached is not check_urls.MISS:
+                    continue
+                started = time.perf_counter()
+                await asyncio.sleep(args.http_ms / 1000)
+                overshoots.append(time.perf_counter() - started - args.http_ms / 1000)
+                if mode == "blocking":
+                    cache.set(url, provider, False)
+                else:
+                    cache.queue(url, provider, False)
+                results[provider] = "SAFE"
+            writer.add(url, results, status="SAFE")
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.workers)])
+    if mode == "blocking":
+        writer.flush()
+    else:
+        await writer.flush()
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    overshoots_ms = [overshoot * 1000 for overshoot in overshoots]
+    return {
+        "seconds": elapsed,
+        "urls_per_second": len(urls) / elapsed,
+        "loop_lag_ms": monitor.report(),
+        "http_overshoot_ms": {
+            "p50": percentile(overshoots_ms, 0.50),
+            "p99": percentile(overshoots_ms, 0.99),
+            "max": max(overshoots_ms, default=None),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=2000, help="URLs per mode")
+    parser.add_argument("--workers", type=int, default=50, help="concurrent check_url coroutines (SCANNER_WORKERS)")
+    parser.add_argument("--providers", type=int, default=3, choices=range(1, len(PROVIDERS) + 1))
+    parser.add_argument("--http-ms", type=float, default=50, help="simulated provider latency")
+    parser.add_argument("--batch-size", type=int, default=500, help="SCAN_RECORDS_BATCH_SIZE")
+    parser.add_argument("--database", help="SQLAlchemy URL of the database to use instead of a temporary SQLite file")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-lag-")
+    os.environ.update({
+        "DATABASE_PATH": args.database or f"sqlite:///{os.path.join(workdir, 'shortener.db')}",
+        "BLACKLIST_DATABASE_PATH": f"sqlite:///{os.path.join(workdir, 'blacklist.db')}",
+        "SCANNER_WORKERS": str(args.workers),
+        "SCAN_RECORDS_BATCH_SIZE": str(args.batch_size),
+        "METRICS_PORT": "0",
+    })
+    try:
+        # check_urls พิมพ์ค่าที่อ่านได้ตอน import
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            check_urls = importlib.import_module("check_urls")
+            check_urls.init_databases()
+
+        async def run_all():
+            report = {}
+            for mode in ("blocking", "async"):
+                urls = seed(check_urls, mode, args.urls)
+                report[mode] = await run(check_urls, mode, urls, args)
+            await check_urls.close_databases()
+            return report
+
+        report = {"config": vars(args), "database": check_urls.engine_shortener.dialect.name, **asyncio.run(run_all())}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.urls} URLs per mode, {args.workers} workers, {args.providers} providers at {args.http_ms:.0f} ms, {report['database']}")
+    print(f"{'mode':<9} {'URLs/s':>7} {'lag p50':>8} {'lag p99':>8} {'lag max':>8} {'>50ms':>6} {'http p99 late':>14}")
+    for mode in ("blocking", "async"):
+        stats = report[mode]
+        lag = stats["loop_lag_ms"]
+        print(f"{mode:<9} {stats['urls_per_second']:>7.1f} {lag['p50']:>8.2f} {lag['p99']:>8.2f} {lag['max']:>8.2f} "
+              f"{lag['over_50ms']:>6} {stats['http_overshoot_ms']['p99']:>13.2f}")
+    print("lag and lateness are in milliseconds")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# tools/web_scan/benchmarks/bench_expressions.py
+"""
+Speed of Safe Browsing lookup-expression generation over a whole feed.
+
+Reads the URLs of a feed (OpenPhish feed.txt, a PhishTank CSV or a URLhaus
+CSV dump, as a file or an http(s) URL) and times, over --rounds rounds:
+
+  - class:           [e.Value() for e in ExpressionGenerator(url).Expressions()]
+  - expressions_for: the bulk generator in expression_generator.py
+  - reference:       the class API of another expression_generator.py given
+                     with --reference, e.g. the version before the fast path:
+                     git show <rev>:tools/expression_generator.py > /tmp/expression_generator_ref.py
+
+and checks that all of them give the same expressions for every URL.
+
+    python benchmarks/bench_expressions.py --feed https://openphish.com/feed.txt
+    python benchmarks/bench_expressions.py --feed verified_online.csv --reference /tmp/expression_generator_ref.py --output expressions.json
+"""
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from expression_generator import ExpressionGenerator, UrlParseError, expressions_for
+
+
+def read_feed(feed):
+    if feed.startswith(("http://", "https://")):
+        with urllib.request.urlopen(feed, timeout=120) as response:
+            text = response.read().decode("utf-8", errors="replace")
+    else:
+        with open(feed, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    lines = text.splitlines()
+    header = next((line for line in lines if line.strip()), "")
+    if header.startswith("#"):
+        # URLhaus: header อยู่ในคอมเมนต์ "# id,dateadded,url,..."
+        columns = next((line.lstrip("#").strip().replace(" ", "") for line in lines
+                        if line.lstrip("#").strip().startswith("id,")), "")
+        rows = csv.DictReader(io.StringIO("\n".join(line for line in lines if not line.startswith("#"))),
+                              fieldnames=columns.split(","))
+        return [row["url"] for row in rows if row.get("url")]
+    if "," in header and "url" in header.split(","):
+        return [row["url"] for row in csv.DictReader(io.StringIO(text)) if row.get("url")]
+    return [line.strip() for line in lines if line.strip()]
+
+
+def class_expressions(generator_class, parse_error, urls):
+    results = []
+    for url in urls:
+        try:
+            results.append([expression.Value() for expression in generator_class(url).Expressions()])
+        except (parse_error, ValueError):
+            results.append([])
+    return results
+
+
+def bulk_expressions(urls):
+    return [expressions for _, expressions in expressions_for(urls)]
+
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("expression_generator_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def best_time(rounds, function):
+    best, result = None, None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--feed", default="https://openphish.com/feed.txt", help="feed file or URL")
+    parser.add_argument("--reference", help="another expression_generator.py to compare against")
+    parser.add_argument("--repeat", type=int, default=1, help="repeat the feed's URLs this many times")
+    parser.add_argument("--rounds", type=int, default=3, help="report the best of this many rounds")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    urls = read_feed(args.feed) * args.repeat
+    print(f"{len(urls)} URLs from {args.feed}")
+
+    runs = {
+        "class": lambda: class_expressions(ExpressionGenerator, UrlParseError, urls),
+        "expressions_for": lambda: bulk_expressions(urls),
+    }
+    if args.reference:
+        reference = load_reference(args.reference)
+        runs["reference"] = lambda: class_expressions(reference.ExpressionGenerator, reference.UrlParseError, urls)
+
+    report = {"config": vars(args), "urls": len(urls), "runs": {}}
+    outputs = {}
+    for name, function in runs.items():
+        seconds, outputs[name] = best_time(args.rounds, function)
+        report["runs"][name] = {
+            "seconds": seconds,
+            "urls_per_second": len(urls) / seconds if seconds else 0.0,
+            "expressions": sum(len(expressions) for expressions in outputs[name]),
+        }
+    baseline = outputs.get("reference", outputs["class"])
+    report["identical"] = all(output == baseline for output in outputs.values())
+
+    slowest = max(run["seconds"] for run in report["runs"].values())
+    print(f"{'run':<16} {'seconds':>9} {'URLs/s':>11} {'speedup':>8}")
+    for name, run in report["runs"].items():
+        print(f"{name:<16} {run['seconds']:>9.3f} {run['urls_per_second']:>11.0f} {slowest / run['seconds']:>7.2f}x")
+    print(f"Same expressions for every URL: {report['identical']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+# tools/web_scan/benchmarks/bench_pipeline.py
+"""
+End-to-end throughput of check_urls.py without API keys or quota.
+
+Starts local aiohttp stand-ins for VirusTotal, URLhaus (API and CSV dump),
+the OpenPhish feed and the Web Risk REST API, lookup or Update API
+(webrisk_stand_in.py) (each with its own latency, a
+shared error rate and a danger rate), points check_urls at them and at a temporary SQLite
+database seeded with --urls synthetic `urls` / `urls_to_check` rows, then
+drains the queue through ScanPipeline the way check_urls_task does.
+
+Reports URLs/sec, p50/p90/p99 per-URL latency (check_url from dequeue to
+verdict), per-provider latency, database write time by operation, event
+loop lag and the number of stand-in requests, and writes it all to
+--output as JSON so runs can be compared. The scanner's own output goes to --log.
+
+    python benchmarks/bench_pipeline.py --urls 2000 --workers 20 --output bench_pipeline.json
+    python benchmarks/bench_pipeline.py --urls 500 --error-rate 0.05 --virustotal-ms 400 --hosts 50
+    python benchmarks/bench_pipeline.py --urls 2000 --urlhaus-mode mirror
+    python benchmarks/bench_pipeline.py --urls 2000 --webrisk-mode mirror
+
+The stand-ins run in a thread of the same process, so very low latencies
+partly measure the stand-ins themselves.
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import csv
+import hashlib
+import importlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from canonical import ExpressionGenerator, canonicalize_url
+from webrisk_stand_in import WebRiskStandIn
+
+
+def is_danger(provider, url, rate):
+    """Deterministic per provider and URL, so every run gets the same verdicts."""
+    digest = hashlib.blake2b(f"{provider}:{url}".encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "big") / 2 ** 32 < rate
+
+
+class MockProviders:
+    """aiohttp stand-ins for the provider endpoints, served from their own event loop thread."""
+
+    def __init__(self, args, urls, feed):
+        self.args = args
+        self.urls = urls
+        self.feed = feed
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+        self.random = random.Random(args.seed)
+        # Update API ของ WEBRISK_MODE=mirror: list มีเฉพาะ expression เต็มของ URL ที่อันตราย
+        self.webrisk_lists = WebRiskStandIn()
+        self.webrisk_lists.publish("MALWARE", [
+            next(ExpressionGenerator(url).Expressions()).Value()
+            for url in urls if is_danger("webrisk", canonicalize_url(url), args.danger_rate)
+        ])
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.base_url = None
+        self._thread = None
+
+    async def _respond(self, provider, latency_ms):
+        self.requests[provider] += 1
+        jitter = self.args.jitter
+        await asyncio.sleep(latency_ms / 1000 * self.random.uniform(1 - jitter, 1 + jitter))
+        if self.random.random() < self.args.error_rate:
+            self.errors[provider] += 1
+            return web.json_response({"error": "unavailable"}, status=503)
+        return None
+
+    async def virustotal_report(self, request):
+        url_id = request.match_info["url_id"]
+        error = await self._respond("virustotal", self.args.virustotal_ms)
+        if error is not None:
+            return error
+        if self.random.random() >= self.args.virustotal_known_rate:
+            return web.json_response({"error": {"code": "NotFoundError"}}, status=404)
+        malicious = int(is_danger("virustotal", url_id, self.args.danger_rate))
+        return web.json_response({"data": {"attributes": {
+            "last_analysis_date": int(time.time()),
+            "last_analysis_stats": {"malicious": malicious},
+        }}})
+
+    async def virustotal_submit(self, request):
+        form = await request.post()
+        error = await self._respond("virustotal", self.args.virustotal_ms)
+        if error is not None:
+            return error
+        url_id = hashlib.sha256(form["url"].encode("utf-8")).hexdigest()
+        return web.json_response({"data": {"id": f"u-{url_id}"}})
+
+    async def virustotal_analysis(self, request):
+        analysis_id = request.match_info["analysis_id"]
+        error = await self._respond("virustotal", self.args.virustotal_ms)
+        if error is not None:
+            return error
+        malicious = int(is_danger("virustotal", analysis_id, self.args.danger_rate))
+        return web.json_response({"data": {"attributes": {"status": "completed", "stats": {"malicious": malicious}}}})
+
+    async def urlhaus(self, request):
+        form = await request.post()
+        error = await self._respond("urlhaus", self.args.urlhaus_ms)
+        if error is not None:
+            return error
+        found = is_danger("urlhaus", form["url"], self.args.danger_rate)
+        return web.json_response({"query_status": "ok" if found else "no_results"})
+
+    async def webrisk(self, request):
+        error = await self._respond("webrisk", self.args.webrisk_ms)
+        if error is not None:
+            return error
+        if is_danger("webrisk", request.query.get("uri", ""), self.args.danger_rate):
+            return web.json_response({"threat": {"threatTypes": ["MALWARE"]}})
+        return web.json_response({})
+
+    async def urlhaus_dump(self, request):
+        self.requests["urlhaus_dump"] += 1
+        lines = ["# URLhaus stand-in", "# id,dateadded,url,url_status,last_online,threat,tags,urlhaus_link,reporter"]
+        for i, url in enumerate(self.urls):
+            if is_danger("urlhaus", url, self.args.danger_rate):
+                lines.append(f'"{i}","2024-01-01 00:00:00","{url}","online","2024-01-01 00:00:00","malware_download","exe","https://urlhaus.bench.test/{i}/","bench"')
+        return web.Response(text="\n".join(lines) + "\n")
+
+    async def openphish(self, request):
+        self.requests["openphish"] += 1
+        return web.Response(text="\n".join(self.feed) + "\n")
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/virustotal/urls/{url_id}", self.virustotal_report)
+        app.router.add_post("/virustotal/urls", self.virustotal_submit)
+        app.router.add_get("/virustotal/analyses/{analysis_id}", self.virustotal_analysis)
+        app.router.add_post("/urlhaus", self.urlhaus)
+        app.router.add_get("/urlhaus/csv_online/", self.urlhaus_dump)
+        app.router.add_get("/v1/uris:search", self.webrisk)
+        app.router.add_get("/openphish/feed.txt", self.openphish)
+        self.webrisk_lists.add_routes(app)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+
+    def start(self):
+        ready = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start())
+            ready.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name="mock-providers", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.base_url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+def synthetic_urls(args):
+    return [f"http://site{i % args.hosts}.bench.test/page/{i}?ref={i % 7}" for i in range(args.urls)]
+
+
+def write_phishtank_csv(path, urls, danger_rate):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["phish_id", "url", "phish_detail_url", "submission_time", "verified", "verification_time", "online", "target"])
+        for i, url in enumerate(urls):
+            if is_danger("phishtank", url, danger_rate):
+                writer.writerow([i, url, f"http://phishtank.bench.test/{i}", "", "yes", "", "yes", "Other"])
+
+
+def scanner_environment(args, workdir, base_url):
+    """Every setting check_urls reads from config.env that could reach a real service or database."""
+    return {
+        "DATABASE_PATH": f"sqlite:///{os.path.join(workdir, 'shortener.db')}",
+        "BLACKLIST_DATABASE_PATH": f"sqlite:///{os.path.join(workdir, 'blacklist.db')}",
+        "PHISHTANK_CSV": os.path.join(workdir, "phishtank.csv"),
+        "URLHAUS_API": f"{base_url}/urlhaus",
+        "URLHAUS_AUTH_KEY": "bench",
+        "URLHAUS_MODE": args.urlhaus_mode,
+        "URLHAUS_MIRROR_URL": f"{base_url}/urlhaus/csv_online/",
+        "URLHAUS_MIRROR_PATH": os.path.join(workdir, "urlhaus_mirror.csv"),
+        "VIRUSTOTAL_API_KEY": "bench",
+        "VIRUSTOTAL_URLS_URL": f"{base_url}/virustotal/urls",
+        "VIRUSTOTAL_ANALYSIS_URL": f"{base_url}/virustotal/analyses/",
+        "VIRUSTOTAL_POLL_SECONDS": "1",
+        "OPENPHISH_FEED_URL": f"{base_url}/openphish/feed.txt",
+        "OPENPHISH_STATE_PATH": os.path.join(workdir, "openphish_state.json"),
+        "WEBRISK_MODE": args.webrisk_mode,
+        "WEBRISK_MIRROR_PATH": os.path.join(workdir, "webrisk_mirror.json"),
+        "WEBRISK_API_ENDPOINT": base_url,
+        "SCANNER_WORKERS": str(args.workers),
+        "SCANNER_SHARD": "0",
+        "SCANNER_SHARDS": "1",
+        "SCANNER_RATE_LIMIT_DB": "",
+        "METRICS_PORT": "0",
+        # วัด pipeline ไม่ใช่โควตา API
+        "VIRUSTOTAL_REQUESTS_PER_MINUTE": str(args.requests_per_minute),
+        "VIRUSTOTAL_BURST": str(args.workers),
+        "VIRUSTOTAL_CONCURRENCY": str(args.workers),
+        "URLHAUS_REQUESTS_PER_MINUTE": str(args.requests_per_minute),
+        "URLHAUS_BURST": str(args.workers),
+        "URLHAUS_CONCURRENCY": str(args.workers),
+        "WEBRISK_REQUESTS_PER_MINUTE": str(args.requests_per_minute),
+        "WEBRISK_BURST": str(args.workers),
+        "WEBRISK_CONCURRENCY": str(args.workers),
+    }
+
+
+def seed_database(check_urls, urls):
+    check_urls.init_databases()
+    rows = [
+        {"key": f"bench{i}", "secret_key": f"bench-secret{i}", "target_url": url, "is_active": True, "clicks": i % 100, "is_checked": False}
+        for i, url in enumerate(urls)
+    ]
+    with check_urls.engine_shortener.begin() as conn:
+        conn.execute(check_urls.URL.__table__.insert(), rows)
+        conn.execute(check_urls.URLsToCheck.__table__.insert(), [{"url": url} for url in urls])
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LoopLagMonitor:
+    """
+    Samples event loop lag: how much later than asked a sleep of `interval`
+    seconds wakes up. Anything that blocks the loop (a synchronous query, a
+    long computation) shows up as lag, and delays every coroutine by as much.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def report(self):
+        lags_ms = [lag * 1000 for lag in self.lags]
+        return {
+            "samples": len(lags_ms),
+            "p50": percentile(lags_ms, 0.50),
+            "p99": percentile(lags_ms, 0.99),
+            "max": max(lags_ms, default=None),
+            "over_50ms": sum(lag > 50 for lag in lags_ms),
+        }
+
+
+async def run_pipeline(check_urls, args):
+    latencies = []
+    check_url = check_urls.check_url
+
+    async def timed_check_url(url, session, **kwargs):
+        started = time.perf_counter()
+        try:
+            await check_url(url, session, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    check_urls.check_url = timed_check_url  # ScanPipeline เรียกผ่านชื่อใน module
+
+    async with ClientSession() as session:
+        started = time.perf_counter()
+        await check_urls.update_openphish_blacklist(session)
+        check_urls.refresh_blacklist_snapshot()
+        openphish_seconds = time.perf_counter() - started
+        if args.urlhaus_mode == "mirror":
+            await (await check_urls.provider_registry.aget("URLhaus")).update(session)
+        if args.webrisk_mode == "mirror":
+            _, webrisk_mirror = await check_urls.provider_registry.aget("Google Web Risk")
+            await asyncio.get_running_loop().run_in_executor(check_urls.webrisk_executor, webrisk_mirror.update)
+
+        pipeline = check_urls.ScanPipeline(session, workers=args.workers)
+        pipeline.start()
+        poller_task = asyncio.create_task(check_urls.virustotal_poller.run(session))
+        lag_monitor = LoopLagMonitor()
+        lag_monitor.start()
+        try:
+            started = time.perf_counter()
+            while True:
+                claims = await check_urls.claim_urls(limit=max(1, min(check_urls.URLS_TO_CHECK_CLAIM_SIZE, pipeline.free_slots)))
+                if not claims:
+                    break
+                await pipeline.put(list(claims), claims=claims)
+            await pipeline.join()
+            elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            await check_urls.virustotal_poller.join()
+            await check_urls.scan_result_writer.flush()
+            poller_seconds = time.perf_counter() - started
+        finally:
+            await lag_monitor.stop()
+            await pipeline.stop()
+            poller_task.cancel()
+            await check_urls.close_databases()
+
+    return {
+        "scanned": pipeline.scanned,
+        "elapsed_seconds": elapsed,
+        "latencies": latencies,
+        "openphish_sync_seconds": openphish_seconds,
+        "virustotal_poll_drain_seconds": poller_seconds,
+        "event_loop_lag_ms": lag_monitor.report(),
+        "left_in_urls_to_check": check_urls.count_urls_to_check(),
+    }
+
+
+def build_report(args, result, check_urls, providers):
+    latencies_ms = [latency * 1000 for latency in result.pop("latencies")]
+    db_writes = {
+        operation: {"count": count, "total_seconds": total, "mean_ms": total / count * 1000 if count else None}
+        for (operation, ), (count, total) in sorted(check_urls.db_write_latency.totals().items())
+    }
+    provider_latency = {
+        provider: {"count": count, "mean_ms": total / count * 1000 if count else None}
+        for (provider, ), (count, total) in sorted(check_urls.provider_latency.totals().items())
+    }
+    return {
+        "config": vars(args),
+        **result,
+        "urls_per_second": result["scanned"] / result["elapsed_seconds"] if result["elapsed_seconds"] else None,
+        "latency_ms": {
+            "p50": percentile(latencies_ms, 0.50),
+            "p90": percentile(latencies_ms, 0.90),
+            "p99": percentile(latencies_ms, 0.99),
+            "max": max(latencies_ms, default=None),
+        },
+        "provider_latency": provider_latency,
+        "db_write": db_writes,
+        "db_write_seconds": sum(item["total_seconds"] for item in db_writes.values()),
+        "stand_in_requests": {**providers.requests, **{f"webrisk_{name}": count for name, count in providers.webrisk_lists.requests.items()}},
+        "stand_in_errors": dict(providers.errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=1000)
+    parser.add_argument("--hosts", type=int, default=200, help="distinct hosts among the synthetic URLs")
+    parser.add_argument("--workers", type=int, default=10, help="ScanPipeline workers (SCANNER_WORKERS)")
+    parser.add_argument("--virustotal-ms", type=float, default=150)
+    parser.add_argument("--urlhaus-ms", type=float, default=60)
+    parser.add_argument("--webrisk-ms", type=float, default=40)
+    parser.add_argument("--urlhaus-mode", choices=["api", "mirror"], default="api", help="URLHAUS_MODE of the scanner")
+    parser.add_argument("--webrisk-mode", choices=["lookup", "mirror"], default="lookup", help="WEBRISK_MODE of the scanner")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies uniformly by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stand-in responses that are 503")
+    parser.add_argument("--danger-rate", type=float, default=0.02, help="fraction of URLs each provider reports as dangerous")
+    parser.add_argument("--virustotal-known-rate", type=float, default=0.8, help="fraction of URLs with an existing VirusTotal report")
+    parser.add_argument("--requests-per-minute", type=float, default=600000, help="rate limit of every provider")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--log", default=os.devnull, help="where the scanner's own output goes")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary databases")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    urls = synthetic_urls(args)
+    write_phishtank_csv(os.path.join(workdir, "phishtank.csv"), urls, args.danger_rate)
+    feed = [url for url in urls if is_danger("openphish", url, args.danger_rate)]
+    providers = MockProviders(args, urls, feed)
+    base_url = providers.start()
+    os.environ.update(scanner_environment(args, workdir, base_url))
+
+    try:
+        with open(args.log, "w") as log, contextlib.redirect_stdout(log):
+            check_urls = importlib.import_module("check_urls")
+            seed_database(check_urls, urls)
+            result = asyncio.run(run_pipeline(check_urls, args))
+        report = build_report(args, result, check_urls, providers)
+    finally:
+        providers.stop()
+        if args.keep:
+            print(f"Databases kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = report["latency_ms"]
+    print(f"{report['scanned']} URLs in {report['elapsed_seconds']:.2f}s = {report['urls_per_second']:.1f} URLs/s")
+    print(f"per-URL latency p50 {latency['p50']:.1f} ms, p90 {latency['p90']:.1f} ms, p99 {latency['p99']:.1f} ms")
+    lag = report["event_loop_lag_ms"]
+    print(f"event loop lag p50 {lag['p50']:.1f} ms, p99 {lag['p99']:.1f} ms, max {lag['max']:.1f} ms")
+    print(f"database writes {report['db_write_seconds']:.3f}s: " + ", ".join(
+        f"{operation} {item['total_seconds']:.3f}s/{item['count']}" for operation, item in report["db_write"].items()))
+    print(f"stand-in requests {report['stand_in_requests']}, errors {report['stand_in_errors']}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
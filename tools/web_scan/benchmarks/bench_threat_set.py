@@ -0,0 +1,141 @@
+# tools/web_scan/benchmarks/bench_threat_set.py
+"""
+Memory and lookup cost of the mmap'd threat set (threat_set.py) against the
+in-memory set of canonical URLs that BlacklistSnapshot keeps.
+
+Writes --entries synthetic URLs to a threat set file, then starts
+--processes fresh interpreters that each load the list one way, look up
+--lookups URLs (half listed, half not) and report their memory. On Linux
+the proportional set size (PSS) is used, which splits pages shared between
+processes, so N scanners mapping one file are charged about one copy.
+
+    python benchmarks/bench_threat_set.py --entries 1000000 --processes 4
+    python benchmarks/bench_threat_set.py --entries 10000000 --processes 8 --output threat_set.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SOURCE_DIR)
+
+CHILD = """
+import json, sys, time
+kind, path, entries, lookups = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+
+def memory_kb():
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+import bench_urls
+from canonical import canonicalize_urls
+from threat_set import ThreatSet
+urls = [bench_urls.url(i % (entries * 2)) for i in range(lookups)]
+before = memory_kb()
+started = time.perf_counter()
+if kind == "mmap":
+    listed = ThreatSet(path)
+    len(listed)
+else:
+    listed = set(canonicalize_urls(bench_urls.urls(entries), cache=False))
+load_seconds = time.perf_counter() - started
+if kind != "mmap":
+    from canonical import canonicalize_url as key
+else:
+    key = lambda url: url
+started = time.perf_counter()
+hits = sum(key(url) in listed for url in urls)
+lookup_seconds = time.perf_counter() - started
+print(json.dumps({
+    "load_seconds": load_seconds,
+    "memory_kb": memory_kb() - before,
+    "lookup_us": lookup_seconds / lookups * 1e6,
+    "hits": hits,
+}))
+"""
+
+# URL สังเคราะห์ที่ child สร้างซ้ำได้เองโดยไม่ต้องส่งข้ามมา: index คู่อยู่ใน list, index คี่ไม่อยู่
+BENCH_URLS = """
+def url(i):
+    return f"http://host{i % 50000}.example.com/path/{i}/login.php?id={i}"
+
+def urls(entries):
+    return (url(i * 2) for i in range(entries))
+"""
+
+
+def run_children(kind, path, args, workdir):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([workdir, SOURCE_DIR]))
+    processes = [
+        subprocess.Popen([sys.executable, "-c", CHILD, kind, path, str(args.entries), str(args.lookups)],
+                         cwd=SOURCE_DIR, env=env, stdout=subprocess.PIPE, text=True)
+        for _ in range(args.processes)
+    ]
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        if process.returncode:
+            raise SystemExit(f"bench_threat_set.py, {kind} child failed")
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "load_seconds": statistics.median(result["load_seconds"] for result in results),
+        "memory_mb_per_process": statistics.median(result["memory_kb"] for result in results) / 1024,
+        "memory_mb_total": sum(result["memory_kb"] for result in results) / 1024,
+        "lookup_us": statistics.median(result["lookup_us"] for result in results),
+        "hit_ratio": results[0]["hits"] / args.lookups,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "bench_urls.py"), "w") as f:
+            f.write(BENCH_URLS)
+        sys.path.insert(0, workdir)
+        import bench_urls
+        from threat_set import write_threat_set
+
+        path = os.path.join(workdir, "bench.tset")
+        started = time.perf_counter()
+        write_threat_set(path, bench_urls.urls(args.entries))
+        build_seconds = time.perf_counter() - started
+
+        report = {
+            "config": vars(args),
+            "build_seconds": build_seconds,
+            "file_mb": os.path.getsize(path) / 2 ** 20,
+            "set": run_children("set", path, args, workdir),
+            "mmap": run_children("mmap", path, args, workdir),
+        }
+
+    print(f"threat set file: {report['file_mb']:.1f} MB, built in {report['build_seconds']:.1f}s")
+    print(f"{'kind':<6} {'load s':>7} {'MB/process':>11} {'MB total':>9} {'lookup us':>10} {'hit %':>6}")
+    for kind in ("set", "mmap"):
+        stats = report[kind]
+        print(f"{kind:<6} {stats['load_seconds']:>7.2f} {stats['memory_mb_per_process']:>11.1f} "
+              f"{stats['memory_mb_total']:>9.1f} {stats['lookup_us']:>10.2f} {stats['hit_ratio']:>6.1%}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# tools/web_scan/benchmarks/bench_webrisk_offload.py
+"""
+Compares URLs/sec when the Web Risk RPC runs inline on the event loop versus
+in a bounded thread pool, as check_google_web_risk() does now.
+
+Each simulated URL does one blocking Web Risk call (time.sleep) and one
+non-blocking provider call (asyncio.sleep), the same mix as check_url().
+
+    python benchmarks/bench_webrisk_offload.py --urls 200 --webrisk-ms 50 --http-ms 200
+"""
+import argparse
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def blocking_search_uris(latency):
+    time.sleep(latency)
+    return None
+
+
+async def check_inline(args):
+    blocking_search_uris(args.webrisk_ms / 1000)
+    await asyncio.sleep(args.http_ms / 1000)
+
+
+async def check_offloaded(args, executor):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, functools.partial(blocking_search_uris, args.webrisk_ms / 1000))
+    await asyncio.sleep(args.http_ms / 1000)
+
+
+async def run(args, concurrency, check):
+    queue = asyncio.Queue()
+    for i in range(args.urls):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            await check()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return args.urls / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=200)
+    parser.add_argument("--webrisk-ms", type=float, default=50)
+    parser.add_argument("--http-ms", type=float, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 20, 40])
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'inline URLs/s':>14} {'offloaded URLs/s':>17}")
+    for concurrency in args.concurrency:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            inline = await run(args, concurrency, lambda: check_inline(args))
+            offloaded = await run(args, concurrency, lambda: check_offloaded(args, executor))
+        print(f"{concurrency:>11} {inline:>14.1f} {offloaded:>17.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
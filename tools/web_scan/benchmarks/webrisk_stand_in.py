@@ -0,0 +1,152 @@
+# tools/web_scan/benchmarks/webrisk_stand_in.py
+"""
+Stand-in for the Web Risk Update API (threatLists:computeDiff and
+hashes:search), served over REST so a WebRiskServiceClient created with
+transport="rest" and WEBRISK_API_ENDPOINT pointing here drives
+WebRiskMirror exactly as it drives the real service.
+
+Each threat list is a set of lookup expressions (e.g. "evil.test/"), and
+every publish() makes a new version of it. A client sending the token of an
+older version gets a DIFF against that version, removal indices into its
+sorted prefix list plus the added prefixes; a client with no token, or a
+token this stand-in does not know, gets a RESET. corrupt_next_checksum()
+makes the next response of a list carry a wrong checksum.
+"""
+import asyncio
+import base64
+import collections
+import datetime
+import hashlib
+import threading
+
+from aiohttp import web
+from google.cloud import webrisk_v1
+
+DIFF = webrisk_v1.ComputeThreatListDiffResponse.ResponseType.DIFF
+RESET = webrisk_v1.ComputeThreatListDiffResponse.ResponseType.RESET
+
+
+def full_hash(expression):
+    return hashlib.sha256(expression.encode("utf-8")).digest()
+
+
+class WebRiskStandIn:
+    def __init__(self, prefix_size=4, next_diff_seconds=1800):
+        self.prefix_size = prefix_size
+        self.next_diff_seconds = next_diff_seconds
+        self.versions = {}      # threat type -> [{prefix: [full hash]}], index = version token
+        self.requests = collections.Counter()
+        self.responses = []     # (threat type, DIFF/RESET) ของ computeDiff ทุกครั้ง
+        self._corrupt = set()
+        self.loop = None
+        self.runner = None
+        self.base_url = None
+        self._thread = None
+
+    def publish(self, threat_type, expressions):
+        """Makes `expressions` the new version of the threat list."""
+        version = {}
+        for expression in expressions:
+            digest = full_hash(expression)
+            version.setdefault(digest[:self.prefix_size], []).append(digest)
+        self.versions.setdefault(threat_type, []).append(version)
+
+    def corrupt_next_checksum(self, threat_type):
+        self._corrupt.add(threat_type)
+
+    def compute_diff(self, threat_type, version_token):
+        versions = self.versions.get(threat_type) or [{}]
+        current = sorted(versions[-1])
+        try:
+            old = sorted(versions[int(version_token.decode())]) if version_token else None
+        except (ValueError, IndexError):
+            old = None
+        if old is None:
+            response_type, removals, additions = RESET, [], current
+        else:
+            kept = set(current)
+            response_type = DIFF
+            removals = [i for i, prefix in enumerate(old) if prefix not in kept]
+            additions = sorted(kept.difference(old))
+        checksum = hashlib.sha256(b"".join(current)).digest()
+        if threat_type in self._corrupt:
+            self._corrupt.discard(threat_type)
+            checksum = hashlib.sha256(checksum).digest()
+        self.responses.append((threat_type, response_type.name))
+        return webrisk_v1.ComputeThreatListDiffResponse(
+            response_type=response_type,
+            additions={"raw_hashes": [{"prefix_size": self.prefix_size, "raw_hashes": b"".join(additions)}] if additions else []},
+            removals={"raw_indices": {"indices": removals}},
+            new_version_token=str(len(versions) - 1).encode(),
+            checksum={"sha256": checksum},
+            recommended_next_diff=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.next_diff_seconds),
+        )
+
+    def search_hashes(self, hash_prefix, threat_types):
+        threats = []
+        for threat_type in threat_types:
+            versions = self.versions.get(threat_type) or [{}]
+            for digest in versions[-1].get(hash_prefix, []):
+                threats.append({"threat_types": [threat_type], "hash_": digest})
+        return webrisk_v1.SearchHashesResponse(
+            threats=threats,
+            negative_expire_time=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5),
+        )
+
+    # REST transport ส่ง enum เป็นตัวเลขและ bytes เป็น base64 ใน query string
+    async def _compute_diff(self, request):
+        self.requests["computeDiff"] += 1
+        threat_type = webrisk_v1.ThreatType(int(request.query["threatType"])).name
+        version_token = base64.b64decode(request.query.get("versionToken", ""))
+        response = self.compute_diff(threat_type, version_token)
+        return web.Response(text=type(response).to_json(response), content_type="application/json")
+
+    async def _search_hashes(self, request):
+        self.requests["searchHashes"] += 1
+        threat_types = [webrisk_v1.ThreatType(int(value)).name for value in request.query.getall("threatTypes", [])]
+        response = self.search_hashes(base64.b64decode(request.query["hashPrefix"]), threat_types)
+        return web.Response(text=type(response).to_json(response), content_type="application/json")
+
+    def add_routes(self, app):
+        app.router.add_get("/v1/threatLists:computeDiff", self._compute_diff)
+        app.router.add_get("/v1/hashes:search", self._search_hashes)
+
+    def client(self, base_url=None):
+        """A WebRiskServiceClient talking to this stand-in."""
+        from google.auth.credentials import AnonymousCredentials
+        return webrisk_v1.WebRiskServiceClient(
+            transport="rest",
+            credentials=AnonymousCredentials(),
+            client_options={"api_endpoint": base_url or self.base_url}
+        )
+
+    async def _start(self):
+        app = web.Application()
+        self.add_routes(app)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+
+    def start(self):
+        """Serves the stand-in from its own event loop thread. Returns its base URL."""
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start())
+            ready.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name="webrisk-stand-in", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.base_url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -0,0 +1,82 @@
+# tools/web_scan/blacklist_snapshot.py
+import time
+
+from canonical import canonicalize_url, canonicalize_urls
+
+# จำนวน row ที่ดึงจากฐานข้อมูลต่อรอบตอนโหลด
+LOAD_CHUNK_SIZE = 50000
+
+
+class BlacklistSnapshot:
+    """
+    In-memory set of the canonical URLs of active blacklist rows.
+
+    load() reads the whole table once; refresh() only reads rows whose id is
+    above the highest id seen so far, so it is cheap to call after every
+    blacklist update. Rows deactivated or reactivated in place keep their id
+    and must be passed to discard() or add() by whoever changes them.
+    Lookups never touch the database; load() and refresh() block, so run them
+    off the event loop.
+    """
+
+    def __init__(self, session_factory, model):
+        self.Session = session_factory
+        self.model = model
+        self.urls = set()
+        self.watermark = 0     # id สูงสุดที่โหลดแล้ว
+        self.loaded = False
+        self.load_seconds = 0.0
+
+    def load(self):
+        """Reads the whole table into a new set, then swaps it in; lookups meanwhile use the old set."""
+        start = time.perf_counter()
+        active = []
+        watermark = 0
+        with self.Session() as session:
+            query = session.query(self.model.id, self.model.url, self.model.status).order_by(self.model.id)
+            for row_id, url, status in query.yield_per(LOAD_CHUNK_SIZE):
+                if status and url:
+                    active.append(url)
+                watermark = row_id
+        urls = set(canonicalize_urls(active, cache=False))
+        self.urls, self.watermark = urls, watermark
+        self.loaded = True
+        self.load_seconds = time.perf_counter() - start
+        return len(urls)
+
+    def refresh(self):
+        """Adds rows inserted since the last load/refresh. Returns the number of new rows."""
+        if not self.loaded:
+            return self.load()
+        count = 0
+        with self.Session() as session:
+            rows = (
+                session.query(self.model.id, self.model.url, self.model.status)
+                .filter(self.model.id > self.watermark)
+                .order_by(self.model.id)
+            )
+            for row_id, url, status in rows.yield_per(LOAD_CHUNK_SIZE):
+                if url:
+                    if status:
+                        self.urls.add(canonicalize_url(url))
+                    else:
+                        self.urls.discard(canonicalize_url(url))
+                self.watermark = row_id
+                count += 1
+        return count
+
+    def add(self, urls):
+        if self.loaded:
+            self.urls.update(canonicalize_url(url) for url in urls)
+
+    def discard(self, urls):
+        for url in urls:
+            self.urls.discard(canonicalize_url(url))
+
+    def __contains__(self, url):
+        if not self.loaded:
+            raise RuntimeError("BlacklistSnapshot is not loaded")
+        return canonicalize_url(url) in self.urls
+
+    def __len__(self):
+        return len(self.urls)
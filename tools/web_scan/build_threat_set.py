@@ -0,0 +1,60 @@
+# tools/web_scan/build_threat_set.py
+"""
+Builds a threat set file (threat_set.py) from the blacklist database or a feed.
+
+    python build_threat_set.py blacklist threat_sets/blacklist.tset
+    python build_threat_set.py phishtank threat_sets/phishtank.tset --input verified_online.csv
+    python build_threat_set.py urlhaus threat_sets/urlhaus.tset --input urlhaus_mirror.csv
+    python build_threat_set.py urls threat_sets/openphish.tset --input feed.txt
+
+Without --input, blacklist reads BLACKLIST_DATABASE_PATH, phishtank reads
+PHISHTANK_CSV and urlhaus reads URLHAUS_MIRROR_PATH.
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+from threat_set import read_blacklist, read_phishtank_csv, read_url_lines, write_threat_set
+from urlhaus_mirror import parse_urlhaus_csv
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(SOURCE_DIR, 'config.env'))
+
+
+def read_urlhaus_csv(path):
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        return list(parse_urlhaus_csv(f))
+
+
+def source_urls(source, path):
+    if source == "blacklist":
+        engine = create_engine(path or os.getenv("BLACKLIST_DATABASE_PATH"))
+        return read_blacklist(engine)
+    # ค่าเริ่มต้นเหมือนใน check_urls.py: path เทียบกับโฟลเดอร์นี้
+    if source == "phishtank":
+        return read_phishtank_csv(path or os.path.join(SOURCE_DIR, str(os.getenv("PHISHTANK_CSV"))))
+    if source == "urlhaus":
+        return read_urlhaus_csv(path or os.getenv("URLHAUS_MIRROR_PATH", os.path.join(SOURCE_DIR, "urlhaus_mirror.csv")))
+    if not path:
+        raise SystemExit("build_threat_set.py, urls needs --input")
+    return read_url_lines(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", choices=("blacklist", "phishtank", "urlhaus", "urls"))
+    parser.add_argument("output", help="threat set file to write")
+    parser.add_argument("--input", help="database URL (blacklist) or file (the others)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = write_threat_set(args.output, source_urls(args.source, args.input))
+    print(f"Wrote {count} hashes ({os.path.getsize(args.output)} bytes) to {args.output} "
+          f"in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
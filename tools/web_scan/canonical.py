@@ -0,0 +1,55 @@
+# tools/web_scan/canonical.py
+import functools
+import os
+import sys
+
+# expression_generator.py อยู่ใน tools/ (โฟลเดอร์แม่ของ web_scan)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from expression_generator import ExpressionGenerator, UrlParseError, expressions_for
+
+# จำนวน URL ที่จำผลไว้ (LRU), 0 = ไม่จำ
+CANONICAL_URL_CACHE_SIZE = int(os.getenv("CANONICAL_URL_CACHE_SIZE", 100000))
+
+
+def _canonicalize_url(url):
+    canonical_url = ExpressionGenerator.CanonicalizeUrl(url)
+    if not canonical_url:
+        return url.strip()
+    return canonical_url
+
+
+_canonicalize_url_uncached = _canonicalize_url
+if CANONICAL_URL_CACHE_SIZE > 0:
+    _canonicalize_url = functools.lru_cache(maxsize=CANONICAL_URL_CACHE_SIZE)(_canonicalize_url)
+
+
+def canonicalize_url(url):
+    """
+    Returns the Safe Browsing canonical form of a URL.
+
+    URLs that ExpressionGenerator cannot parse (unsupported scheme, single-label
+    host, ...) are returned stripped but otherwise unchanged, so the result can
+    always be used as a lookup key. The last CANONICAL_URL_CACHE_SIZE results
+    are memoized, since the same URL is looked up by every provider, the
+    verdict cache and the result writer.
+    """
+    return _canonicalize_url(url)
+
+
+def canonicalize_urls(urls, cache=True):
+    """
+    Canonical forms of a batch of URLs, in the same order. Loaders of a whole
+    list (blacklist, PhishTank, URLhaus dump) pass cache=False, so the list
+    does not push the URLs being scanned out of the memo.
+    """
+    canonicalize = _canonicalize_url if cache else _canonicalize_url_uncached
+    return [canonicalize(url) for url in urls]
+
+
+def cache_stats():
+    """Hits, misses and size of the memo, as a dict."""
+    if not hasattr(_canonicalize_url, "cache_info"):
+        return {"hits": 0, "misses": 0, "size": 0, "hit_ratio": 0.0}
+    info = _canonicalize_url.cache_info()
+    total = info.hits + info.misses
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "hit_ratio": info.hits / total if total else 0.0}
@@ -2,27 +2,42 @@
 import os
 from dotenv import load_dotenv
 
+import argparse
 import asyncio
+import csv
+import datetime
+import functools
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from aiohttp import ClientSession
 import time  # Import time for sleep functionality
+import uuid
 
-# Google Web Risk
 import json
-from google.api_core.exceptions import PermissionDenied
-from google.cloud import webrisk_v1
-from google.cloud.webrisk_v1 import ThreatType
 
-from sqlalchemy import create_engine, Boolean, Column, Integer, String, Date, DateTime, func, Enum, text
+from sqlalchemy import create_engine, make_url, Boolean, Column, Integer, Float, String, Date, DateTime, func, Enum, Index, text, delete, or_, select, update
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import declarative_base
 
-
-# VirusTotal
-import vt
+from blacklist_snapshot import BlacklistSnapshot
+from canonical import UrlParseError, cache_stats as canonical_cache_stats, canonicalize_url, canonicalize_urls
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ProviderUnavailable
+from host_reputation import HostReputation
+from metrics import RateMeter, Registry, start_metrics_server
+from provider_registry import ProviderRegistry
+from rate_limiter import RateLimiter, SharedRateLimiter
+from rescan_scheduler import RescanScheduler
+from sharding import shard_of, supervise
+from scan_store import SCAN_RECORDS_UNIQUE_INDEX, aupsert_scan_records, ensure_columns, ensure_scan_records_unique_index
+from url_notifier import PollingNotifier, create_notifier
+from urlhaus_mirror import URLhausMirror
+from verdict_cache import MISS, VerdictCache
 
 # เน้นไปที่ phishing: phishtank
-import pandas as pd
+from phishtank_index import PhishTankIndex
+from threat_set import ThreatSet, blacklist_watermark, read_blacklist, read_phishtank_csv, write_threat_set
 
 # เน้นไปที่ malware: urlhaus
 import sys
@@ -38,12 +53,101 @@ DATABASE_PATH = os.getenv("DATABASE_PATH")
 URLHAUS_API = os.getenv("URLHAUS_API")
 URLHAUS_AUTH_KEY = os.getenv("URLHAUS_AUTH_KEY")
 PHISHTANK_CSV = os.getenv("PHISHTANK_CSV")
+PHISHTANK_RELOAD_SECONDS = int(os.getenv("PHISHTANK_RELOAD_SECONDS", 30))  # ตรวจ mtime ของ PHISHTANK_CSV ทุกกี่วินาที
 VIRUSTOTAL_ANALYSIS_URL = os.getenv("VIRUSTOTAL_ANALYSIS_URL")
 VIRUSTOTAL_URLS_URL = os.getenv("VIRUSTOTAL_URLS_URL")
 OPENPHISH_FEED_URL = os.getenv("OPENPHISH_FEED_URL", "https://raw.githubusercontent.com/openphish/public_feed/refs/heads/main/feed.txt")
 OPENPHISH_UPDATE_INTERVAL_HOURS = int(os.getenv("OPENPHISH_UPDATE_INTERVAL_HOURS", 12))
 OPENPHISH_REQUEST_TIMEOUT = int(os.getenv("OPENPHISH_REQUEST_TIMEOUT", 30))
+OPENPHISH_SYNC_CHUNK_SIZE = int(os.getenv("OPENPHISH_SYNC_CHUNK_SIZE", 500))  # จำนวน URL ต่อ query ตอนเทียบ feed กับฐานข้อมูล
+# ETag/Last-Modified ของ feed ครั้งล่าสุด ใช้ทำ conditional GET
+OPENPHISH_STATE_PATH = os.getenv("OPENPHISH_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "openphish_state.json"))
 BLACKLIST_DATABASE_PATH = os.getenv("BLACKLIST_DATABASE_PATH")
+SCANNER_WORKERS = int(os.getenv("SCANNER_WORKERS", 10))  # จำนวน worker ที่รัน check_url พร้อมกัน
+# ตั้งโดย supervisor เมื่อรันด้วย --workers N: process นี้ดูแลเฉพาะ URL ที่ shard_of(url) == SCANNER_SHARD
+SCANNER_SHARD = int(os.getenv("SCANNER_SHARD", 0))
+SCANNER_SHARDS = int(os.getenv("SCANNER_SHARDS", 1))
+SCANNER_RATE_LIMIT_DB = os.getenv("SCANNER_RATE_LIMIT_DB")  # ไฟล์ SQLite ของ token bucket ที่ใช้ร่วมกันทุก shard
+BLACKLIST_REFRESH_MINUTES = int(os.getenv("BLACKLIST_REFRESH_MINUTES", 5))  # shard อื่นอ่าน row ใหม่ของ blacklist ทุกกี่นาที
+SCANNER_QUEUE_SIZE = int(os.getenv("SCANNER_QUEUE_SIZE", 100))  # ขนาดคิวสูงสุด เมื่อเต็ม producer จะรอ (backpressure)
+SCAN_RECORDS_BATCH_SIZE = int(os.getenv("SCAN_RECORDS_BATCH_SIZE", 500))  # จำนวน row ของ scan_records ที่สะสมก่อนเขียนลงฐานข้อมูล
+SCAN_RECORDS_FLUSH_SECONDS = float(os.getenv("SCAN_RECORDS_FLUSH_SECONDS", 2))  # เขียนผลที่ค้างอยู่อย่างน้อยทุกกี่วินาที
+URLS_TO_CHECK_CLAIM_SIZE = int(os.getenv("URLS_TO_CHECK_CLAIM_SIZE", 50))  # จำนวน row ที่ claim จาก urls_to_check ต่อครั้ง
+URLS_TO_CHECK_LEASE_SECONDS = int(os.getenv("URLS_TO_CHECK_LEASE_SECONDS", 300))  # lease หมดอายุแล้ว row จะกลับเข้าคิว
+# claim token ของ process นี้ lease ของ row ที่ยังรอในคิวหรือกำลัง scan ถูกต่ออายุทุก 1/3 ของ URLS_TO_CHECK_LEASE_SECONDS
+CLAIM_TOKEN = uuid.uuid4().hex
+URLS_TO_CHECK_CHANNEL = os.getenv("URLS_TO_CHECK_CHANNEL", "urls_to_check")  # ช่อง LISTEN/NOTIFY ของ PostgreSQL
+URLS_TO_CHECK_IDLE_SECONDS = int(os.getenv("URLS_TO_CHECK_IDLE_SECONDS", 30))  # ตรวจคิวอย่างน้อยทุกกี่วินาที แม้ไม่มีการแจ้งเตือน (lease ที่หมดอายุ)
+SQLITE_DATA_VERSION_POLL_SECONDS = float(os.getenv("SQLITE_DATA_VERSION_POLL_SECONDS", 0.2))
+# connection pool ของ async engine: worker ทุกตัวอ่าน verdict cache พร้อมกันได้ บวก claim loop และ flusher
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", min(SCANNER_WORKERS + 2, 20)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 60))  # วินาทีที่รอ connection ว่างก่อน error
+# ลำดับการตรวจสอบ แต่ละ tier คั่นด้วย ; และ provider ภายใน tier เดียวกันคั่นด้วย , (ทำงานพร้อมกัน)
+# tier ถัดไปจะทำงานก็ต่อเมื่อ tier ก่อนหน้าไม่พบ DANGER, provider ที่ไม่อยู่ในแผนจะไม่ถูกเรียก
+CHECK_PLAN = os.getenv("CHECK_PLAN", "Blacklist,Phishtank;URLhaus,Google Web Risk;VirusTotal")
+# ตอบ DANGER โดยไม่เรียก provider ภายนอก ให้ URL บน host ที่มี URL อื่นอย่างน้อยกี่ URL ถูกพบว่าอันตรายแล้ว, 0 = ปิด
+HOST_REPUTATION_MIN_DANGER = int(os.getenv("HOST_REPUTATION_MIN_DANGER", 2))
+HOST_REPUTATION_TTL_SECONDS = int(os.getenv("HOST_REPUTATION_TTL_SECONDS", 3600))  # จำผลระดับ host ไว้กี่วินาที
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", 10000))  # จำนวน verdict สูงสุดใน LRU ในหน่วยความจำ
+# อัตราการเรียก API ของแต่ละ provider (ครั้ง/นาที), burst และจำนวน request พร้อมกันสูงสุด
+VIRUSTOTAL_REQUESTS_PER_MINUTE = float(os.getenv("VIRUSTOTAL_REQUESTS_PER_MINUTE", 4))  # public API = 4 ครั้ง/นาที
+VIRUSTOTAL_BURST = int(os.getenv("VIRUSTOTAL_BURST", 4))
+VIRUSTOTAL_CONCURRENCY = int(os.getenv("VIRUSTOTAL_CONCURRENCY", 4))
+VIRUSTOTAL_MAX_REPORT_AGE_HOURS = int(os.getenv("VIRUSTOTAL_MAX_REPORT_AGE_HOURS", 24))  # ใช้รายงานเดิมถ้าวิเคราะห์ไม่เกินกี่ชั่วโมง
+VIRUSTOTAL_POLL_SECONDS = int(os.getenv("VIRUSTOTAL_POLL_SECONDS", 15))  # รอบการตรวจสถานะ analysis ที่ยังไม่เสร็จ
+VIRUSTOTAL_POLL_MAX_ATTEMPTS = int(os.getenv("VIRUSTOTAL_POLL_MAX_ATTEMPTS", 20))
+URLHAUS_REQUESTS_PER_MINUTE = float(os.getenv("URLHAUS_REQUESTS_PER_MINUTE", 600))
+URLHAUS_BURST = int(os.getenv("URLHAUS_BURST", 10))
+URLHAUS_CONCURRENCY = int(os.getenv("URLHAUS_CONCURRENCY", 10))
+# URLHAUS_MODE=api เรียก URLHAUS_API ทุก URL, URLHAUS_MODE=mirror ค้นจาก dump ของ URLhaus ในเครื่อง (urlhaus_mirror.py)
+URLHAUS_MODE = os.getenv("URLHAUS_MODE", "api")
+URLHAUS_MIRROR_URL = os.getenv("URLHAUS_MIRROR_URL", "https://urlhaus.abuse.ch/downloads/csv_online/")
+URLHAUS_MIRROR_PATH = os.getenv("URLHAUS_MIRROR_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "urlhaus_mirror.csv"))
+URLHAUS_MIRROR_UPDATE_MINUTES = int(os.getenv("URLHAUS_MIRROR_UPDATE_MINUTES", 30))
+URLHAUS_ENRICH = int(os.getenv("URLHAUS_ENRICH", 0))  # 1 = URL ที่พบใน mirror ขอรายละเอียดเพิ่มจาก URLHAUS_API
+# ถ้ากำหนด blacklist และ PhishTank ใช้ไฟล์ hash ที่ mmap ร่วมกันทุก process (threat_set.py) แทน snapshot/index ในหน่วยความจำ
+THREAT_SET_DIR = os.getenv("THREAT_SET_DIR", "")
+THREAT_SET_REBUILD_MINUTES = int(os.getenv("THREAT_SET_REBUILD_MINUTES", 10))  # shard 0 สร้างไฟล์ของ blacklist ใหม่ทุกกี่นาที
+WEBRISK_REQUESTS_PER_MINUTE = float(os.getenv("WEBRISK_REQUESTS_PER_MINUTE", 3000))
+WEBRISK_BURST = int(os.getenv("WEBRISK_BURST", 50))
+WEBRISK_CONCURRENCY = int(os.getenv("WEBRISK_CONCURRENCY", 10))
+WEBRISK_THREADS = int(os.getenv("WEBRISK_THREADS", WEBRISK_CONCURRENCY))  # thread pool สำหรับ search_uris ซึ่งเป็น blocking call
+# WEBRISK_MODE=lookup เรียก search_uris ทุก URL, WEBRISK_MODE=mirror ใช้ hash prefix ในเครื่อง (webrisk_mirror.py)
+WEBRISK_MODE = os.getenv("WEBRISK_MODE", "lookup")
+WEBRISK_MIRROR_PATH = os.getenv("WEBRISK_MIRROR_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "webrisk_mirror.json"))
+WEBRISK_MIRROR_UPDATE_MINUTES = int(os.getenv("WEBRISK_MIRROR_UPDATE_MINUTES", 30))
+WEBRISK_API_ENDPOINT = os.getenv("WEBRISK_API_ENDPOINT")  # REST endpoint แทน webrisk.googleapis.com เช่น stand-in ของ benchmarks/bench_pipeline.py
+# TTL (วินาที) ของ verdict cache แยกตาม provider และผลลัพธ์ ค่าที่ไม่ได้กำหนดใช้ DEFAULT_TTLS ใน verdict_cache.py
+# Blacklist, Phishtank และ URLhaus/Web Risk แบบ mirror เป็นข้อมูลในเครื่องอยู่แล้วจึงไม่ cache
+# (ผลที่ cache ไว้จะไม่เปลี่ยนตาม mirror ที่อัปเดต)
+VERDICT_CACHE_TTLS = {
+    "Blacklist": {"DANGER": 0, "SAFE": 0},
+    "Phishtank": {"DANGER": 0, "SAFE": 0},
+}
+if URLHAUS_MODE == "mirror":
+    VERDICT_CACHE_TTLS["URLhaus"] = {"DANGER": 0, "SAFE": 0}
+if WEBRISK_MODE == "mirror":
+    VERDICT_CACHE_TTLS["Google Web Risk"] = {"DANGER": 0, "SAFE": 0}
+VERDICT_CACHE_TTLS.update(json.loads(os.getenv("VERDICT_CACHE_TTLS", "{}")))  # เช่น {"VirusTotal": {"SAFE": 86400}}
+# circuit breaker ของ provider ภายนอก: เปิดเมื่อล้มเหลวติดกัน CIRCUIT_FAILURE_THRESHOLD ครั้ง และลองใหม่หลัง CIRCUIT_RESET_SECONDS
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_SECONDS = int(os.getenv("CIRCUIT_RESET_SECONDS", 60))
+# timeout ต่อ request = PROVIDER_TIMEOUT_MULTIPLIER x percentile ของ latency ล่าสุด อยู่ในช่วง MIN ถึง MAX วินาที
+PROVIDER_TIMEOUT_PERCENTILE = float(os.getenv("PROVIDER_TIMEOUT_PERCENTILE", 0.99))
+PROVIDER_TIMEOUT_MULTIPLIER = float(os.getenv("PROVIDER_TIMEOUT_MULTIPLIER", 3))
+PROVIDER_TIMEOUT_MIN_SECONDS = float(os.getenv("PROVIDER_TIMEOUT_MIN_SECONDS", 2))
+PROVIDER_TIMEOUT_MAX_SECONDS = float(os.getenv("PROVIDER_TIMEOUT_MAX_SECONDS", 30))
+# เปิด endpoint /metrics (Prometheus) เมื่อกำหนด METRICS_PORT ค่า 0 หรือไม่กำหนด = ปิด
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+RESCAN_DELAY_SECONDS = int(os.getenv("RESCAN_DELAY_SECONDS", 600))  # URL ที่ provider ไม่พร้อมจะถูก scan ใหม่หลังกี่วินาที
+# scan ใหม่ได้ไม่เกินกี่ครั้ง ครั้งสุดท้ายบันทึก provider ที่ยังไม่พร้อมเป็น INCONCLUSIVE แล้วเลิก
+RESCAN_MAX_ATTEMPTS = int(os.getenv("RESCAN_MAX_ATTEMPTS", 5))
+# scan URL ที่ตรวจแล้วซ้ำตามลำดับความสำคัญ (clicks, อายุของผล, ผลครั้งก่อน) ไม่เกินกี่ URL ต่อชั่วโมง, 0 = ปิด
+RESCAN_BUDGET_PER_HOUR = int(os.getenv("RESCAN_BUDGET_PER_HOUR", 100))
+RESCAN_MIN_AGE_HOURS = float(os.getenv("RESCAN_MIN_AGE_HOURS", 24))  # ไม่ scan ซ้ำ URL ที่เพิ่ง scan ไม่ถึงกี่ชั่วโมง
+RESCAN_PAGE_SIZE = int(os.getenv("RESCAN_PAGE_SIZE", 1000))  # จำนวน row ต่อ query ตอนอ่าน candidate ของ rescan
 
 # ตรวจสอบว่าอ่านค่าได้ถูกต้อง
 print(f"Database Path: {DATABASE_PATH}")
@@ -59,19 +163,64 @@ if not BLACKLIST_DATABASE_PATH:
 # Base.metadata.create_all(engine)
 # Session = sessionmaker(bind=engine)
 
+# driver แบบ async ของแต่ละฐานข้อมูล ใช้กับ query ที่รันใน coroutine
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def create_async_database_engine(database_url, pool_size=None, max_overflow=None):
+    """
+    AsyncEngine on the same database as `database_url`, with asyncpg for
+    PostgreSQL and aiosqlite for SQLite.
+
+    SQLite gets one connection: it has a single writer, and a second
+    connection that reads and then writes inside one transaction fails with
+    "database is locked" instead of waiting. Statements still never block
+    the event loop; they queue for the connection. An in-memory SQLite
+    database keeps SQLAlchemy's StaticPool, and pool_size/max_overflow
+    apply to PostgreSQL only.
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"create_async_database_engine(), No async driver for {backend}")
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    if backend == "sqlite":
+        if url.database in (None, "", ":memory:") or url.query.get("mode") == "memory":
+            # ฐานข้อมูลในหน่วยความจำใช้ StaticPool (connection เดียวอยู่แล้ว) ซึ่งไม่รับ pool_size/max_overflow
+            return create_async_engine(url, echo=False, poolclass=StaticPool)
+        return create_async_engine(url, echo=False, pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT)
+    if "sslmode" in url.query:
+        # asyncpg รับ ssl= แทน sslmode= ของ psycopg2
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": url.query["sslmode"]})
+    return create_async_engine(
+        url,
+        echo=False,
+        pool_size=DB_POOL_SIZE if pool_size is None else pool_size,
+        max_overflow=DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+    )
+
 # Setup สำหรับ Database หลัก (shortener)
+# engine แบบ sync ใช้กับงานตอนเริ่ม (สร้างตาราง, trigger), LISTEN และงานที่รันใน thread เท่านั้น
 BaseShortener = declarative_base()
 engine_shortener = create_engine(DATABASE_PATH, echo=False)
 SessionShortener = sessionmaker(bind=engine_shortener)
+async_engine_shortener = create_async_database_engine(DATABASE_PATH)
+AsyncSessionShortener = async_sessionmaker(async_engine_shortener, expire_on_commit=False)
 
 # Setup สำหรับ Database ที่สอง (blacklist)
 BaseBlacklist = declarative_base()
 engine_blacklist = create_engine(BLACKLIST_DATABASE_PATH, echo=False)
 SessionBlacklist = sessionmaker(bind=engine_blacklist)
+async_engine_blacklist = create_async_database_engine(BLACKLIST_DATABASE_PATH, pool_size=1, max_overflow=1)  # ใช้เฉพาะ sync_openphish_urls()
+AsyncSessionBlacklist = async_sessionmaker(async_engine_blacklist, expire_on_commit=False)
 
 # กำหนด class scan_records ภายในโปรแกรม
 class scan_records(BaseShortener):
     __tablename__ = "scan_records"  # เก็บข้อมูลการ scan 
+    __table_args__ = (
+        Index(SCAN_RECORDS_UNIQUE_INDEX, "url", "scan_type", unique=True),  # หนึ่ง record ต่อ url และ scan_type
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     timestamp = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())  
     url = Column(String)
@@ -116,8 +265,16 @@ class URL(BaseShortener):
 # กำหนด class URLsToCheck สำหรับ urls_to_check table
 class URLsToCheck(BaseShortener):
     __tablename__ = 'urls_to_check'
+    __table_args__ = (
+        Index("ix_urls_to_check_shard", "shard_count", "shard", "id"),  # ให้ shard claim เฉพาะ row ของตัวเองใน SQL
+    )
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)    
     url = Column(String)
+    claim_token = Column(String, nullable=True)  # scanner ที่ถือ lease ของ row นี้อยู่
+    claimed_at = Column(Float, nullable=True)    # epoch seconds ที่ claim
+    shard = Column(Integer, nullable=True)        # shard_of(url, shard_count), NULL = ยังไม่ได้กำหนด
+    shard_count = Column(Integer, nullable=True)  # จำนวน shard ตอนกำหนด shard
+    attempts = Column(Integer, nullable=True)     # จำนวนครั้งที่ถูก scan ใหม่เพราะ provider ไม่พร้อม
 class BlacklistURL(BaseBlacklist):
     __tablename__ = "url"
     
@@ -130,32 +287,147 @@ class BlacklistURL(BaseBlacklist):
     status = Column(Boolean, default=True)  # true = active, false = inactive
     source = Column(String, default="openphish")
 
-# สั่งสร้างตารางในแต่ละ Database
-BaseShortener.metadata.create_all(engine_shortener)
-BaseBlacklist.metadata.create_all(engine_blacklist)
-
-# Path to the credentials file
-# ไฟล์ JSON Credential จาก Google Cloud
-credentials_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api-project-744419703652-f520f5308dff.json")
+# cache ผลการตรวจของแต่ละ provider (LRU ในหน่วยความจำ + ตาราง verdict_cache)
+verdict_cache = VerdictCache(engine_shortener, max_entries=VERDICT_CACHE_SIZE, ttls=VERDICT_CACHE_TTLS, async_engine=async_engine_shortener)
 
-# Set the environment variable for authentication
-if os.path.exists(credentials_path):
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
-else:
-    print("Google Credential file not found.")
-
-# Create the client
-webrisk_client = webrisk_v1.WebRiskServiceClient()
+def init_databases():
+    """
+    Creates missing tables, indexes and columns in both databases. Called
+    once at startup (main(), the __main__ block) rather than on import.
+    """
+    BaseShortener.metadata.create_all(engine_shortener)
+    BaseBlacklist.metadata.create_all(engine_blacklist)
+    ensure_scan_records_unique_index(engine_shortener)  # สำหรับตาราง scan_records ที่สร้างไว้ก่อนมี unique index
+    ensure_columns(engine_shortener, "urls_to_check", {"claim_token": "VARCHAR", "claimed_at": "FLOAT", "shard": "INTEGER", "shard_count": "INTEGER", "attempts": "INTEGER"})  # ตารางเดิมที่ยังไม่มีคอลัมน์ lease/shard/attempts
+    for index in URLsToCheck.__table__.indexes:
+        index.create(engine_shortener, checkfirst=True)  # create_all() ไม่เพิ่ม index ให้ตารางที่มีอยู่แล้ว
+    verdict_cache.create_table()
+
+async def close_databases():
+    """Closes the async engines' connections; call it before the event loop ends."""
+    await async_engine_shortener.dispose()
+    await async_engine_blacklist.dispose()
+
+# client library และข้อมูลของแต่ละ provider ถูก import/โหลดเมื่อใช้ครั้งแรกเท่านั้น
+provider_registry = ProviderRegistry()
+
+# search_uris เป็น synchronous RPC จึงรันใน thread pool แยก เพื่อไม่ให้ event loop ค้าง
+webrisk_executor = ThreadPoolExecutor(max_workers=WEBRISK_THREADS, thread_name_prefix="webrisk")
+
+def load_google_web_risk():
+    """Imports the Web Risk client library and returns (client, mirror); mirror is None unless WEBRISK_MODE=mirror."""
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import webrisk_v1
+    from webrisk_mirror import WebRiskMirror
+
+    # Path to the credentials file
+    # ไฟล์ JSON Credential จาก Google Cloud
+    credentials_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api-project-744419703652-f520f5308dff.json")
+
+    # Set the environment variable for authentication
+    if os.path.exists(credentials_path):
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+    else:
+        print("Google Credential file not found.")
+
+    # Create the client
+    if WEBRISK_API_ENDPOINT:
+        # endpoint ในเครื่องใช้ REST แบบไม่มี credential
+        client = webrisk_v1.WebRiskServiceClient(
+            transport="rest",
+            credentials=AnonymousCredentials(),
+            client_options={"api_endpoint": WEBRISK_API_ENDPOINT}
+        )
+    else:
+        client = webrisk_v1.WebRiskServiceClient()
+
+    # mirror ของ threat list ในเครื่อง (โหลดไฟล์ mirror ที่บันทึกไว้ทันที)
+    mirror = WebRiskMirror(client, path=WEBRISK_MIRROR_PATH) if WEBRISK_MODE == "mirror" else None
+    return client, mirror
+
+def is_permission_denied(exc):
+    from google.api_core.exceptions import PermissionDenied  # ถูก import แล้วพร้อม client ของ Web Risk
+    return isinstance(exc, PermissionDenied) or isinstance(exc.__cause__, PermissionDenied)
+
+def load_virustotal():
+    import vt
+    return vt
+
+provider_registry.register("Google Web Risk", load_google_web_risk)
+provider_registry.register("VirusTotal", load_virustotal)
 
 # กำหนด API Key ของ VirusTotal
 VIRUSTOTAL_API_KEY = os.getenv("VIRUSTOTAL_API_KEY")
 
+# rate limiter แยกตาม provider แทนการ sleep รวมทั้ง pipeline
+def make_rate_limiter(name, requests_per_minute, burst, concurrency):
+    """Per-process RateLimiter, or one token bucket shared by every shard when run with --workers N."""
+    if SCANNER_RATE_LIMIT_DB:
+        # แบ่ง concurrency ให้แต่ละ process ส่วนอัตราใช้ bucket เดียวกัน
+        concurrency = max(1, -(-concurrency // SCANNER_SHARDS))
+        return SharedRateLimiter(SCANNER_RATE_LIMIT_DB, name, requests_per_minute / 60, burst, concurrency)
+    return RateLimiter(requests_per_minute / 60, burst, concurrency)
+
+virustotal_limiter = make_rate_limiter("VirusTotal", VIRUSTOTAL_REQUESTS_PER_MINUTE, VIRUSTOTAL_BURST, VIRUSTOTAL_CONCURRENCY)
+urlhaus_limiter = make_rate_limiter("URLhaus", URLHAUS_REQUESTS_PER_MINUTE, URLHAUS_BURST, URLHAUS_CONCURRENCY)
+webrisk_limiter = make_rate_limiter("Google Web Risk", WEBRISK_REQUESTS_PER_MINUTE, WEBRISK_BURST, WEBRISK_CONCURRENCY)
+
+def owns_url(url):
+    """True if this process is responsible for the URL (always, unless run with --workers N)."""
+    return SCANNER_SHARDS <= 1 or shard_of(url, SCANNER_SHARDS) == SCANNER_SHARD
+
+# circuit breaker และ timeout ตาม latency ของแต่ละ provider ภายนอก
+def make_circuit_breaker(name):
+    return CircuitBreaker(
+        name,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds=CIRCUIT_RESET_SECONDS,
+        percentile=PROVIDER_TIMEOUT_PERCENTILE,
+        multiplier=PROVIDER_TIMEOUT_MULTIPLIER,
+        min_timeout=PROVIDER_TIMEOUT_MIN_SECONDS,
+        max_timeout=PROVIDER_TIMEOUT_MAX_SECONDS
+    )
+
+virustotal_breaker = make_circuit_breaker("VirusTotal")
+urlhaus_breaker = make_circuit_breaker("URLhaus")
+webrisk_breaker = make_circuit_breaker("Google Web Risk")
+circuit_breakers = {breaker.name: breaker for breaker in (virustotal_breaker, urlhaus_breaker, webrisk_breaker)}
+
+# metrics ของ pipeline เก็บเสมอ แต่ให้บริการผ่าน HTTP เฉพาะเมื่อกำหนด METRICS_PORT
+metrics_registry = Registry()
+provider_latency = metrics_registry.histogram(
+    "scanner_provider_latency_seconds", "Time to get a verdict from a provider on a cache miss, including rate limiter waits.", ["provider"])
+provider_in_flight = metrics_registry.gauge(
+    "scanner_provider_in_flight", "Provider checks currently running.", ["provider"])
+provider_results = metrics_registry.counter(
+    "scanner_provider_results_total", "Provider verdicts by result (DANGER, SAFE, INCONCLUSIVE, UNAVAILABLE, PENDING).", ["provider", "result"])
+metrics_registry.gauge(
+    "scanner_verdict_cache_hit_ratio", "Verdict cache hit ratio since start.", ["provider"],
+    callback=lambda: {(provider, ): stats["hit_ratio"] for provider, stats in verdict_cache.stats().items()})
+metrics_registry.gauge(
+    "scanner_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).", ["provider"],
+    callback=lambda: {(name, ): {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[breaker.state] for name, breaker in circuit_breakers.items()})
+pipeline_queue_size = metrics_registry.gauge(
+    "scanner_pipeline_queue_size", "URLs waiting in the in-memory ScanPipeline queue.")
+metrics_registry.gauge(
+    "scanner_urls_to_check_backlog", "Rows in urls_to_check, including claimed ones.",
+    callback=lambda: count_urls_to_check())
+urls_scanned = metrics_registry.counter(
+    "scanner_urls_scanned_total", "URLs whose scan finished.")
+urls_scanned_rate = RateMeter(window=60)
+metrics_registry.gauge(
+    "scanner_urls_per_second", "URLs scanned per second over the last minute.",
+    callback=urls_scanned_rate.rate)
+db_write_latency = metrics_registry.histogram(
+    "scanner_db_write_seconds", "Duration of database writes and commits by operation.", ["operation"])
+
 
 # Database Trigger Function
 def create_database_trigger(db_type):
     if db_type == "sqlite":
+        conn = None
         try:
-            conn = sqlite3.connect(DATABASE_PATH)
+            conn = sqlite3.connect(engine_shortener.url.database)  # DATABASE_PATH เป็น URL ของ SQLAlchemy ไม่ใช่ path ของไฟล์
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TRIGGER IF NOT EXISTS check_new_url AFTER INSERT ON urls
@@ -173,28 +445,32 @@ def create_database_trigger(db_type):
 
     elif db_type == "postgresql":
         try:
-            with engine_shortener.connect() as conn:
+            with engine_shortener.begin() as conn:
                 # ลบ Trigger เดิมถ้ามีอยู่แล้ว
                 conn.execute(text("DROP TRIGGER IF EXISTS check_new_url ON urls;"))
                 conn.execute(text("DROP FUNCTION IF EXISTS insert_url_to_check();"))
 
                 # สร้างฟังก์ชันใหม่
+                # pg_notify ปลุก scanner ที่ LISTEN อยู่ทันทีที่มี URL ใหม่ โดยไม่ส่ง URL ไปด้วย
+                # (payload ต้องสั้นกว่า 8000 byte และ listener ไม่ได้อ่าน) ชื่อช่องมาจาก argument ของ trigger
                 conn.execute(text("""
                     CREATE OR REPLACE FUNCTION insert_url_to_check()
                     RETURNS TRIGGER AS $$
                     BEGIN
                         INSERT INTO urls_to_check (url) VALUES (NEW.target_url);
+                        PERFORM pg_notify(TG_ARGV[0], '');
                         RETURN NEW;
                     END;
                     $$ LANGUAGE plpgsql;
                 """))
 
                 # สร้าง Trigger ใหม่
-                conn.execute(text("""
+                channel = URLS_TO_CHECK_CHANNEL.replace("'", "''").replace(":", "\\:")  # string literal ของ SQL, \: ไม่ให้ text() มองเป็น bind parameter
+                conn.execute(text(f"""
                     CREATE TRIGGER check_new_url
                     AFTER INSERT ON urls
                     FOR EACH ROW
-                    EXECUTE FUNCTION insert_url_to_check();
+                    EXECUTE FUNCTION insert_url_to_check('{channel}');
                 """))
             print("Trigger and function created successfully in PostgreSQL.")
         except Exception as e:
@@ -203,82 +479,249 @@ def create_database_trigger(db_type):
 
 
 # Asynchronous Function for Periodic Full Checks
-async def periodic_full_check(interval_hours=1):
+async def periodic_full_check(pipeline, interval_hours=1):
     while True:
-        urls_to_check = get_new_urls_from_database()  # Change function to get new URLs
+        urls_to_check = [url for url in await get_new_urls_from_database() if owns_url(url)]  # Change function to get new URLs
         if urls_to_check:
-            await main(urls_to_check)
+            await pipeline.put(urls_to_check)
+        print_cache_stats()
+        print_check_plan_stats()
+        print_circuit_stats()
         await asyncio.sleep(interval_hours * 3600)  # Sleep for the specified interval
 
+# ค่า status แบบเก่า (-1/1) ที่ scanner รุ่นก่อนเขียนลง urls.status
+LEGACY_URL_STATUSES = {"-1": "DANGER", "1": "SAFE"}
+
+async def keyset_pages(query, key_column, page_size=None):
+    """
+    Yields the rows of `query` a page at a time, ordered by `key_column`
+    (which must be unique in the result, e.g. the GROUP BY column and the
+    first column selected). Each page is its own short query and session,
+    so the connection goes back to the pool between pages; on SQLite's
+    single connection the claim and result writes are not held up behind a
+    long scan. Rows whose key is NULL are skipped.
+    """
+    page_size = page_size or RESCAN_PAGE_SIZE
+    query = query.where(key_column != None).order_by(key_column).limit(page_size)
+    last_key = None
+    while True:
+        page = query if last_key is None else query.where(key_column > last_key)
+        async with AsyncSessionShortener() as session:
+            rows = (await session.execute(page)).all()
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][0]
+
+async def get_rescan_candidates():
+    """
+    Yields (target_url, clicks, status, last_scan) for active URLs that were
+    checked before. Clicks are summed over every short link to the same
+    target; last_scan is the newest scan_records.timestamp.
+
+    scan_records stores canonical URLs and urls.target_url the URL as it was
+    shortened, so the two are matched by canonical form here instead of by
+    a SQL join. Both tables are read with keyset_pages().
+    """
+    last_scans = {}
+    query = (
+        select(
+            URL.target_url,
+            func.sum(URL.clicks),
+            func.min(URL.status)  # 'DANGER' < 'SAFE' จึงได้ DANGER ถ้ามี link ใดเป็น DANGER
+        )
+        .where(URL.is_active == True, URL.is_checked == True)
+        .group_by(URL.target_url)
+    )
+    scans = select(scan_records.url, func.max(scan_records.timestamp)).group_by(scan_records.url)
+    async for page in keyset_pages(scans, scan_records.url):
+        for url, scanned_at in page:
+            if isinstance(scanned_at, str):
+                scanned_at = datetime.datetime.fromisoformat(scanned_at)  # ผลของ max() บน SQLite เป็น string
+            key = canonicalize_url(url)  # row เก่าอาจเก็บ URL แบบที่ยังไม่ canonical
+            if scanned_at is not None and (key not in last_scans or last_scans[key] < scanned_at):
+                last_scans[key] = scanned_at
+    async for page in keyset_pages(query, URL.target_url):
+        for target_url, clicks, status in page:
+            status = LEGACY_URL_STATUSES.get(str(status), status)
+            status = status.upper() if isinstance(status, str) and status.upper() in ("DANGER", "SAFE") else None
+            yield target_url, clicks, status, last_scans.get(canonicalize_url(target_url))
+
+async def periodic_rescan(pipeline, budget_per_hour=None):
+    """Every hour, queues the `budget_per_hour` most urgent already-checked URLs for a new scan."""
+    budget_per_hour = RESCAN_BUDGET_PER_HOUR if budget_per_hour is None else budget_per_hour
+    if budget_per_hour <= 0:
+        return
+    # budget รวมของทุก shard
+    scheduler = RescanScheduler(max(1, budget_per_hour // SCANNER_SHARDS), min_age_hours=RESCAN_MIN_AGE_HOURS)
+    while True:
+        try:
+            urls = await scheduler.aselect(candidate async for candidate in get_rescan_candidates() if owns_url(candidate[0]))
+            print(f"periodic_rescan(), Rescanning {len(urls)} URLs.")
+            if urls:
+                await pipeline.put(urls)
+        except Exception as e:
+            print(f"periodic_rescan(), Unexpected error: {e}")
+        await asyncio.sleep(3600)
+
 
 # ฟังก์ชันจาก google_web_risk.py
 async def check_google_web_risk(url):
     # print("Google Web Risk: ", end="")
+    webrisk_client, webrisk_mirror = await provider_registry.aget("Google Web Risk")
+    if webrisk_mirror is not None and webrisk_mirror.ready:
+        return await check_google_web_risk_mirror(url, webrisk_mirror)
     try:
-        # The URL to be checked
-        uri = url
+        # The URL to be checked, in the same canonical form as the mirror and the verdict cache
+        uri = canonicalize_url(url)
         threat_types = ["MALWARE", "SOCIAL_ENGINEERING"]
 
         # Search the URI
-        response = webrisk_client.search_uris(uri=uri, threat_types=threat_types)
+        async with webrisk_limiter, webrisk_breaker.guard():
+            loop = asyncio.get_running_loop()
+            response = await asyncio.wait_for(
+                loop.run_in_executor(
+                    webrisk_executor,
+                    functools.partial(webrisk_client.search_uris, uri=uri, threat_types=threat_types)
+                ),
+                webrisk_breaker.timeout()
+            )
 
         # Check the response
         if response.threat:
             #print(f"The URL {url} is not safe.")
             for threat in response.threat.threat_types:
-                #print(f"Threat type: {threat} {ThreatType(threat).name}")
+                #print(f"Threat type: {threat} {threat.name}")
                 pass
             return True
         else:
             # print(f"The URL {url} is safe.")
             return False
 
-    except PermissionDenied as exc:
-        print("check_google_web_risk(), Permission denied: ", exc)
-        print("check_google_web_risk(), Please ensure the service account has the correct permissions and the Web Risk API is enabled.")
-    
+    except ProviderUnavailable:
+        raise
+    except Exception as exc:
+        # 4xx (เช่น InvalidArgument, PermissionDenied) ไม่ใช่ outage ให้ผลเป็น INCONCLUSIVE โดยไม่เปิด circuit
+        if is_permission_denied(exc):
+            print("check_google_web_risk(), Permission denied: ", exc)
+            print("check_google_web_risk(), Please ensure the service account has the correct permissions and the Web Risk API is enabled.")
+        else:
+            print(f"check_google_web_risk(), Error: {exc}")
+        return None
+
+# ตรวจกับ hash prefix ในเครื่องก่อน เรียก search_hashes เฉพาะเมื่อ prefix ตรง
+async def check_google_web_risk_mirror(url, webrisk_mirror):
+    try:
+        hits = webrisk_mirror.match_prefixes(url)
+        if not hits:
+            return False
+        async with webrisk_limiter, webrisk_breaker.guard():
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(
+                loop.run_in_executor(webrisk_executor, webrisk_mirror.confirm, hits),
+                webrisk_breaker.timeout()
+            )
+    except ProviderUnavailable:
+        raise
+    except UrlParseError as exc:
+        print(f"check_google_web_risk_mirror(), {exc}")
+    except Exception as e:
+        if is_permission_denied(e):
+            print("check_google_web_risk_mirror(), Permission denied: ", e)
+        else:
+            print(f"check_google_web_risk_mirror(), Unexpected error: {e}")
     return None
 
+async def periodic_webrisk_mirror_update(interval_minutes=None):
+    """
+    Pulls Web Risk threat-list diffs into the local mirror periodically.
+    """
+    if interval_minutes is None:
+        interval_minutes = WEBRISK_MIRROR_UPDATE_MINUTES
+
+    while True:
+        wait_seconds = interval_minutes * 60
+        try:
+            _, webrisk_mirror = await provider_registry.aget("Google Web Risk")
+            loop = asyncio.get_running_loop()
+            count = await loop.run_in_executor(webrisk_executor, webrisk_mirror.update)
+            print(f"Web Risk mirror updated: {count} hash prefixes.")
+            # ไม่ขอ diff เร็วกว่าที่ Web Risk แนะนำ (recommended_next_diff)
+            wait_seconds = max(wait_seconds, webrisk_mirror.next_update - time.time())
+        except Exception as e:
+            print(f"Error in periodic Web Risk mirror update: {e}")
+
+        await asyncio.sleep(wait_seconds)
+
+async def periodic_webrisk_mirror_reload(interval_minutes=None):
+    """For shards other than 0: re-reads the mirror file that shard 0 saves after each update."""
+    interval_minutes = interval_minutes or WEBRISK_MIRROR_UPDATE_MINUTES
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            _, webrisk_mirror = await provider_registry.aget("Google Web Risk")
+            await asyncio.get_running_loop().run_in_executor(webrisk_executor, webrisk_mirror.load)
+        except Exception as e:
+            print(f"Error in periodic Web Risk mirror reload: {e}")
+
 async def check_virustotal(url, session):  # Pass the aiohttp session
     """Asynchronously checks the reputation of a URL using the VirusTotal API.
 
+    The existing report (/urls/{id}) is used when its last analysis is newer
+    than VIRUSTOTAL_MAX_REPORT_AGE_HOURS. Otherwise the URL is submitted and
+    the analysis is handed to virustotal_poller, which writes the verdict to
+    scan_records once it completes.
+
     Args:
         url: The URL to check.
         session: An aiohttp ClientSession for making asynchronous requests.
 
     Returns:
-        True if the URL is considered malicious, False if safe, or None if the analysis is inconclusive.
+        True if the URL is considered malicious, False if safe, None if inconclusive, or PENDING if the analysis was submitted.
     """
+    vt = await provider_registry.aget("VirusTotal")
+    if virustotal_poller.is_pending(url):
+        return PENDING  # ส่งไปวิเคราะห์แล้ว (เช่น periodic_full_check อ่าน URL ที่ยังไม่ checked ซ้ำ) ไม่ต้องส่งอีก
     try:
-        # Use the session for the VirusTotal request
-        payload = { "url": url }
         headers = {
             "accept": "application/json",
-            "x-apikey": VIRUSTOTAL_API_KEY,
-            "content-type": "application/x-www-form-urlencoded"
-}
-        async with session.post(VIRUSTOTAL_URLS_URL, data = payload, headers = headers) as response:
-            result = await response.json()  # Get the JSON response
-            scan_id = result["data"]["id"]  # Extract the scan ID
-
-        # Poll for results (replace 10 with the desired number of retries)
-        for _ in range(10):
-            async with session.get(f"{VIRUSTOTAL_ANALYSIS_URL}{scan_id}", headers={"x-apikey": VIRUSTOTAL_API_KEY}) as response:
-                analysis = await response.json()
-                if analysis["data"]["attributes"]["status"] == "completed":
-                    break   # Stop polling if analysis is complete
-            await asyncio.sleep(5)  # Wait for 5 seconds before retrying
-
-        # Check analysis results
-        if analysis["data"]["attributes"]["status"] == "completed":
-            stats = analysis["data"]["attributes"]["stats"]
-            if stats["malicious"] > 0:
-                return True  # Malicious
-            else:
-                return False  # Not malicious
-        else:
-            return None  # Inconclusive
+            "x-apikey": VIRUSTOTAL_API_KEY
+        }
+        # ดูรายงานเดิมก่อน ถ้ายังใหม่พอไม่ต้องส่ง URL ไปวิเคราะห์ซ้ำ
+        async with virustotal_limiter, virustotal_breaker.guard():
+            async with session.get(f"{VIRUSTOTAL_URLS_URL}/{vt.url_id(canonicalize_url(url))}", headers=headers, timeout=aiohttp.ClientTimeout(total=virustotal_breaker.timeout())) as response:
+                if response.status == 200:
+                    report = await response.json()
+                elif response.status == 404:
+                    report = None  # VirusTotal ยังไม่รู้จัก URL นี้
+                elif response.status == 429 or response.status >= 500:
+                    raise ProviderUnavailable(f"VirusTotal report returned status {response.status}")
+                else:
+                    print(f"VirusTotal report returned status {response.status}")
+                    return None
+
+        if report:
+            attributes = report["data"]["attributes"]
+            last_analysis_date = attributes.get("last_analysis_date")
+            if last_analysis_date and time.time() - last_analysis_date <= VIRUSTOTAL_MAX_REPORT_AGE_HOURS * 3600:
+                return attributes["last_analysis_stats"]["malicious"] > 0
 
+        # Use the session for the VirusTotal request
+        payload = { "url": canonicalize_url(url) }  # ทุกรูปแบบของ URL เดียวกันได้รายงานเดียวกัน
+        async with virustotal_limiter, virustotal_breaker.guard():
+            async with session.post(VIRUSTOTAL_URLS_URL, data = payload, headers = {**headers, "content-type": "application/x-www-form-urlencoded"}, timeout=aiohttp.ClientTimeout(total=virustotal_breaker.timeout())) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise ProviderUnavailable(f"VirusTotal submit returned status {response.status}")
+                result = await response.json()  # Get the JSON response
+                scan_id = result["data"]["id"]  # Extract the scan ID
+
+        # ไม่รอผลใน coroutine นี้ ให้ poller กลางตรวจสถานะแทน
+        virustotal_poller.add(scan_id, url)
+        return PENDING
+
+    except ProviderUnavailable:
+        raise  # ให้ cached_check ตอบ INCONCLUSIVE และนัด scan ใหม่
     except vt.error.APIError as e:
         print(f"VirusTotal Error: {e}")
         return None
@@ -287,27 +730,131 @@ async def check_virustotal(url, session):  # Pass the aiohttp session
         return None
 
 
+class VirusTotalPoller:
+    """
+    Background poller shared by all URLs for submitted VirusTotal analyses.
+
+    Every VIRUSTOTAL_POLL_SECONDS it checks all pending analyses in one sweep
+    (each request still goes through virustotal_limiter). Completed analyses
+    are written to scan_records, the verdict cache and, when malicious, the
+    urls table. A clean analysis marks the URL SAFE only if check_url found
+    every other provider SAFE (safe_when_completed()). An analysis is
+    dropped after max_attempts sweeps and recorded as INCONCLUSIVE.
+
+    Pending analyses live only in memory. check_url leaves their URLs
+    unchecked (urls.is_checked) until the poller writes the verdict, so
+    after a restart periodic_full_check scans them again and
+    check_virustotal finds the finished report instead of losing it.
+    """
+
+    def __init__(self, interval=None, max_attempts=None):
+        self.interval = interval or VIRUSTOTAL_POLL_SECONDS
+        self.max_attempts = max_attempts or VIRUSTOTAL_POLL_MAX_ATTEMPTS
+        self.pending = {}  # analysis id -> [url, attempts]
+        self._safe_urls = set()  # URL ที่ provider อื่นตอบ SAFE หมดแล้ว รอแค่ผลของ VirusTotal
+
+    def add(self, analysis_id, url):
+        self.pending.setdefault(analysis_id, [url, 0])
+
+    def is_pending(self, url):
+        return any(pending_url == url for pending_url, _ in self.pending.values())
+
+    def safe_when_completed(self, url):
+        if self.is_pending(url):
+            self._safe_urls.add(url)
+
+    async def run(self, session):
+        while True:
+            await asyncio.sleep(self.interval)
+            # ไม่นับรอบที่ VirusTotal ไม่พร้อม เป็นจำนวนครั้งที่รอ
+            if self.pending and virustotal_breaker.available():
+                await self.poll(session)
+
+    async def join(self):
+        """Waits until every pending analysis has completed or been dropped."""
+        while self.pending:
+            await asyncio.sleep(1)
+
+    async def poll(self, session):
+        analysis_ids = list(self.pending)
+        results = await asyncio.gather(
+            *[self._fetch(session, analysis_id) for analysis_id in analysis_ids],
+            return_exceptions=True
+        )
+        for analysis_id, analysis in zip(analysis_ids, results):
+            url, attempts = self.pending[analysis_id]
+            if isinstance(analysis, Exception):
+                print(f"VirusTotalPoller, Error polling {analysis_id}: {analysis}")
+                analysis = None
+
+            if analysis and analysis["data"]["attributes"]["status"] == "completed":
+                del self.pending[analysis_id]
+                malicious = analysis["data"]["attributes"]["stats"]["malicious"] > 0
+                save_virustotal_result(url, malicious, analysis_id, safe=url in self._safe_urls)
+                self._safe_urls.discard(url)
+            elif attempts + 1 >= self.max_attempts:
+                del self.pending[analysis_id]
+                self._safe_urls.discard(url)
+                print(f"VirusTotalPoller, Gave up waiting for the analysis of {url}.")
+                # ให้ URL เป็น checked ไม่ให้ periodic_full_check ส่งไปวิเคราะห์ซ้ำไม่รู้จบ
+                scan_result_writer.add(url, {"VirusTotal": "INCONCLUSIVE"}, scan_id=analysis_id)
+            else:
+                self.pending[analysis_id][1] = attempts + 1
+
+    async def _fetch(self, session, analysis_id):
+        async with virustotal_limiter, virustotal_breaker.guard():
+            async with session.get(f"{VIRUSTOTAL_ANALYSIS_URL}{analysis_id}", headers={"x-apikey": VIRUSTOTAL_API_KEY}, timeout=aiohttp.ClientTimeout(total=virustotal_breaker.timeout())) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise ProviderUnavailable(f"VirusTotal analysis returned status {response.status}")
+                return await response.json()
+
+virustotal_poller = VirusTotalPoller()
+
+def save_virustotal_result(url, result, analysis_id, safe=False):
+    """Queues a completed VirusTotal analysis for scan_records and urls; `safe` allows status SAFE. Marks the URL checked."""
+    verdict_cache.queue(url, "VirusTotal", result)
+    if result:
+        print(f"The URL {url} is dangerous according to VirusTotal.")
+    scan_result_writer.add(
+        url,
+        {"VirusTotal": "DANGER" if result else "SAFE"},
+        status="DANGER" if result else ("SAFE" if safe else None),
+        scan_id=analysis_id
+    )
+
+
 # ฟังก์ชันจาก check_url_with_phishtank.py
 # file จาก phishtank
 csv_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), str(PHISHTANK_CSV))
-# อ่านไฟล์ CSV
-data_phishtank = pd.read_csv(csv_file)
+
+def load_phishtank():
+    """Index of the CSV (dict by canonical URL), reloaded automatically when the file changes."""
+    if THREAT_SET_DIR:
+        return load_threat_set("phishtank")
+    phishtank_index = PhishTankIndex(csv_file)
+    phishtank_index.load()  # อ่านทั้งไฟล์ตอนนี้ (ใน thread ของ provider_registry) ไม่ใช่ตอนตรวจ URL แรก
+    return phishtank_index
+
+async def periodic_phishtank_reload(interval_seconds=None):
+    """Rebuilds the PhishTank index in a thread when the CSV has been replaced; lookups keep using the old one until then."""
+    interval_seconds = interval_seconds or PHISHTANK_RELOAD_SECONDS
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            phishtank_index = await provider_registry.aget("Phishtank")
+            if await asyncio.get_running_loop().run_in_executor(None, phishtank_index.reload_if_changed):
+                print(f"PhishTank index reloaded: {len(phishtank_index)} URLs.")
+        except Exception as e:
+            print(f"Error in periodic PhishTank reload: {e}")
+
+provider_registry.register("Phishtank", load_phishtank)
 
 async def check_phishtank(url):
     # print("PhishTank: ", end="")
     try:
-        # ตรวจสอบว่ามี URL ในไฟล์ CSV หรือไม่
-        if url in data_phishtank['url'].values:
-            # ค้นหาข้อมูลของ URL ที่ตรงกัน
-            phish_info = data_phishtank[data_phishtank['url'] == url].iloc[0]
-            '''
-            print(f"The URL {url} is a phishing site.")
-            print(f"Phish ID: {phish_info['phish_id']}")
-            print(f"Phish detail URL: {phish_info['phish_detail_url']}")
-            print(f"Submission time: {phish_info['submission_time']}")
-            print(f"Verification time: {phish_info['verification_time']}")
-            print(f"Target: {phish_info['target']}")
-            '''
+        phishtank_index = await provider_registry.aget("Phishtank")
+        # ค้นหาข้อมูลของ URL ที่ตรงกัน (ThreatSet ไม่มีรายละเอียดของ row)
+        if url in phishtank_index:
             return True
         else:
             # print(f"The URL {url} is not in the PhishTank CSV database.")
@@ -315,8 +862,8 @@ async def check_phishtank(url):
     except FileNotFoundError:
         print(f"PhishTank Error: The file {csv_file} was not found.")
         
-    except pd.errors.EmptyDataError:
-        print(f"PhishTank Error: The file {csv_file} is empty.")
+    except csv.Error as e:
+        print(f"PhishTank Error: Cannot parse {csv_file}: {e}")
         
     except Exception as e:
         print(f"PhishTank An unexpected error occurred: {e}")
@@ -324,16 +871,117 @@ async def check_phishtank(url):
 
     return None
 
+def load_openphish_state():
+    try:
+        with open(OPENPHISH_STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"load_openphish_state(), Cannot read {OPENPHISH_STATE_PATH}: {e}")
+        return {}
+
+def save_openphish_state(state):
+    try:
+        tmp_path = OPENPHISH_STATE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, OPENPHISH_STATE_PATH)
+    except OSError as e:
+        print(f"save_openphish_state(), Cannot write {OPENPHISH_STATE_PATH}: {e}")
+
+async def sync_openphish_urls(urls_from_feed):
+    """
+    Makes the active openphish rows of the blacklist match the feed, in one transaction.
+
+    Feed URLs are looked up in chunks of OPENPHISH_SYNC_CHUNK_SIZE, so no
+    query has more bound parameters than SQLite allows. URLs not in the
+    table are inserted, inactive openphish rows that are back in the feed
+    are reactivated, and active openphish rows that left the feed get
+    status=False. Rows from other sources are never changed.
+
+    New rows store the canonical form of the URL (canonical.py), so spelling
+    variants of one URL in the feed become one row. Rows written before that
+    are still matched by the URL exactly as the feed writes it.
+
+    Returns (added, reactivated, deactivated) lists of URLs.
+    """
+    feed = list(dict.fromkeys(canonicalize_urls(urls_from_feed)))
+    feed_urls = set(feed)
+    lookup = list(feed_urls.union(urls_from_feed))
+    known = set()
+    reactivate_ids, reactivated = [], []
+    deactivate_ids, deactivated = [], []
+    async with AsyncSessionBlacklist() as db_session:
+        try:
+            for i in range(0, len(lookup), OPENPHISH_SYNC_CHUNK_SIZE):
+                rows = await db_session.execute(
+                    select(BlacklistURL.id, BlacklistURL.url, BlacklistURL.status, BlacklistURL.source)
+                    .where(BlacklistURL.url.in_(lookup[i:i + OPENPHISH_SYNC_CHUNK_SIZE]))
+                )
+                for row_id, url, status, source in rows:
+                    known.add(canonicalize_url(url))
+                    if not status and source == 'openphish':
+                        reactivate_ids.append(row_id)
+                        reactivated.append(url)
+
+            # row ของ openphish ที่ active แต่ไม่อยู่ใน feed แล้ว
+            active_rows = await db_session.execute(
+                select(BlacklistURL.id, BlacklistURL.url)
+                .where(BlacklistURL.source == 'openphish', BlacklistURL.status == True)
+            )
+            for row_id, url in active_rows:
+                if canonicalize_url(url) not in feed_urls:
+                    deactivate_ids.append(row_id)
+                    deactivated.append(url)
+
+            added = [url for url in feed if url not in known]
+            for i in range(0, len(added), OPENPHISH_SYNC_CHUNK_SIZE):
+                await db_session.execute(BlacklistURL.__table__.insert(), [
+                    {
+                        "url": url,
+                        "source": 'openphish',
+                        "category": 'phishing',
+                        "status": True,
+                        "reason": 'OpenPhish public feed'
+                    }
+                    for url in added[i:i + OPENPHISH_SYNC_CHUNK_SIZE]
+                ])
+            for ids, status in ((reactivate_ids, True), (deactivate_ids, False)):
+                for i in range(0, len(ids), OPENPHISH_SYNC_CHUNK_SIZE):
+                    await db_session.execute(
+                        update(BlacklistURL)
+                        .where(BlacklistURL.id.in_(ids[i:i + OPENPHISH_SYNC_CHUNK_SIZE]))
+                        .values(status=status)
+                    )
+            await db_session.commit()
+        except Exception:
+            await db_session.rollback()
+            raise
+    return added, reactivated, deactivated
+
 async def update_openphish_blacklist(session: aiohttp.ClientSession):
     """
     Fetches the OpenPhish feed and updates the local blacklist database.
+
+    Sends If-None-Match/If-Modified-Since from the previous successful
+    update, so an unchanged feed costs one 304 response and no database work.
     """
     print("Starting OpenPhish blacklist update...")
     try:
+        state = load_openphish_state()
+        headers = {}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
         # เพิ่ม timeout
         timeout = aiohttp.ClientTimeout(total=OPENPHISH_REQUEST_TIMEOUT)
-        async with session.get(OPENPHISH_FEED_URL, timeout=timeout) as response:
-            if response.status == 200:
+        async with session.get(OPENPHISH_FEED_URL, timeout=timeout, headers=headers) as response:
+            if response.status == 304:
+                print("OpenPhish feed has not changed since the last update.")
+            elif response.status == 200:
                 text_data = await response.text()
                 
                 # ปรับปรุงการ filter URLs
@@ -343,41 +991,26 @@ async def update_openphish_blacklist(session: aiohttp.ClientSession):
                 }
                 
                 if not urls_from_feed:
+                    # ไม่ปิด URL ทั้งหมดเพราะ feed ว่าง ซึ่งมักเป็นความผิดพลาดฝั่งผู้ให้บริการ
                     print("OpenPhish feed is empty. No updates to process.")
                     return
                     
                 print(f"Fetched {len(urls_from_feed)} valid URLs from OpenPhish feed.")
                 
-                with SessionBlacklist() as db_session:
-                    try:
-                        # ค้นหา URL ที่มีอยู่แล้วในฐานข้อมูล
-                        existing_urls_query = db_session.query(BlacklistURL.url).filter(
-                            BlacklistURL.url.in_(urls_from_feed)
-                        )
-                        existing_urls = {url[0] for url in existing_urls_query}
-                        new_urls = urls_from_feed - existing_urls
-                        
-                        if new_urls:
-                            new_records = [
-                                BlacklistURL(
-                                    url=url, 
-                                    source='openphish', 
-                                    category='phishing', 
-                                    status=True,
-                                    reason='OpenPhish public feed'
-                                ) 
-                                for url in new_urls
-                            ]
-                            db_session.bulk_save_objects(new_records)
-                            db_session.commit()
-                            print(f"Added {len(new_urls)} new URLs to the blacklist.")
-                        else:
-                            print("No new URLs to add. Blacklist is up-to-date.")
-                            
-                    except Exception as db_error:
-                        db_session.rollback()
-                        print(f"Database error during blacklist update: {db_error}")
-                        
+                try:
+                    added, reactivated, deactivated = await sync_openphish_urls(urls_from_feed)
+                except Exception as db_error:
+                    print(f"Database error during blacklist update: {db_error}")
+                    return
+
+                print(f"Added {len(added)} new URLs, reactivated {len(reactivated)}, deactivated {len(deactivated)} URLs that left the feed.")
+                # row ที่เปลี่ยน status ไม่ได้ id ใหม่ refresh() จึงมองไม่เห็น ต้องแก้ snapshot เอง
+                blacklist_snapshot.discard(deactivated)
+                blacklist_snapshot.add(reactivated)
+                save_openphish_state({
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                })
             else:
                 print(f"Error fetching OpenPhish feed. Status: {response.status}")
                 
@@ -399,30 +1032,193 @@ async def periodic_openphish_update(interval_hours=None):
         try:
             async with aiohttp.ClientSession() as session:
                 await update_openphish_blacklist(session)
+            await provider_registry.aget("Blacklist")  # ไม่ refresh ซ้อนกับการโหลดครั้งแรกที่ยังไม่เสร็จ
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(rebuild_threat_set_if_changed, "blacklist") if THREAT_SET_DIR else refresh_blacklist_snapshot)
         except Exception as e:
             print(f"Error in periodic OpenPhish update: {e}")
             
         print(f"OpenPhish update finished. Waiting for {interval_hours} hours...")
         await asyncio.sleep(interval_hours * 3600)
 
-# เพิ่มฟังก์ชันตรวจสอบ blacklist (ยังคงใช้วิธีเดิม)
+async def periodic_blacklist_refresh(refresh_minutes=None, reload_hours=None):
+    """
+    For shards other than 0, which do not fetch OpenPhish themselves: picks
+    up rows shard 0 inserted every `refresh_minutes`, and reloads the whole
+    snapshot every `reload_hours` to drop rows it deactivated.
+    """
+    refresh_minutes = refresh_minutes or BLACKLIST_REFRESH_MINUTES
+    reload_hours = reload_hours or OPENPHISH_UPDATE_INTERVAL_HOURS
+    last_reload = time.monotonic()
+    while True:
+        await asyncio.sleep(refresh_minutes * 60)
+        reload = time.monotonic() - last_reload >= reload_hours * 3600
+        if reload:
+            last_reload = time.monotonic()
+        # โหลดใหม่ทั้งหมดใน thread แล้วสลับ set ทีเดียว ระหว่างนั้น check_blacklist() ใช้ set เดิม
+        await asyncio.get_running_loop().run_in_executor(None, refresh_blacklist_snapshot, reload)
+
+def threat_set_path(name):
+    return os.path.join(THREAT_SET_DIR, f"{name}.tset")
+
+# blacklist_watermark() ตอนสร้างไฟล์ blacklist ล่าสุด
+blacklist_threat_set_watermark = None
+
+def build_threat_set(name):
+    """Writes the threat set file of the blacklist or the PhishTank CSV. Blocking: run it off the event loop."""
+    global blacklist_threat_set_watermark
+    if name == "blacklist":
+        watermark = blacklist_watermark(engine_blacklist)  # อ่านก่อน row ที่เปลี่ยนระหว่างสร้างจะทำให้รอบถัดไปสร้างใหม่
+        urls = read_blacklist(engine_blacklist)
+    else:
+        urls = read_phishtank_csv(csv_file)
+    started = time.perf_counter()
+    count = write_threat_set(threat_set_path(name), urls)
+    print(f"Threat set {name}: {count} URLs written in {time.perf_counter() - started:.1f}s.")
+    if name == "blacklist":
+        blacklist_threat_set_watermark = watermark
+    return count
+
+def rebuild_threat_set_if_changed(name):
+    """
+    Rebuilds the threat set file if its source changed since the last build:
+    the blacklist by blacklist_watermark(), the PhishTank file by the CSV's
+    mtime. Returns the number of URLs written, or None when nothing changed.
+    Blocking: run it off the event loop.
+    """
+    if name == "blacklist":
+        if blacklist_watermark(engine_blacklist) == blacklist_threat_set_watermark:
+            return None
+    elif os.path.getmtime(csv_file) <= os.path.getmtime(threat_set_path(name)):
+        return None
+    return build_threat_set(name)
+
+def load_threat_set(name):
+    """Maps the threat set file, building it first if it does not exist (or the PhishTank CSV is newer)."""
+    path = threat_set_path(name)
+    if not os.path.exists(path) or (name == "phishtank" and os.path.getmtime(csv_file) > os.path.getmtime(path)):
+        os.makedirs(THREAT_SET_DIR, exist_ok=True)
+        build_threat_set(name)
+    return ThreatSet(path)
+
+async def periodic_threat_set_rebuild(interval_minutes=None):
+    """
+    Shard 0 only: every `interval_minutes`, rebuilds the blacklist file if
+    the table changed and the PhishTank file if the CSV changed. The other
+    shards' ThreatSet objects map the new files on their own.
+    """
+    interval_minutes = interval_minutes or THREAT_SET_REBUILD_MINUTES
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        for name in ("blacklist", "phishtank"):
+            try:
+                await loop.run_in_executor(None, rebuild_threat_set_if_changed, name)
+            except Exception as e:
+                print(f"Error rebuilding the {name} threat set: {e}")
+
+# snapshot ของ blacklist ที่ active ในหน่วยความจำ ไม่ต้อง query ฐานข้อมูลทุก URL
+blacklist_snapshot = BlacklistSnapshot(SessionBlacklist, BlacklistURL)
+
+def refresh_blacklist_snapshot(reload=False):
+    """Loads the blacklist snapshot, or adds the rows inserted since the last refresh. Blocking: run it off the event loop."""
+    try:
+        if blacklist_snapshot.loaded and not reload:
+            added = blacklist_snapshot.refresh()
+            print(f"Blacklist snapshot refreshed: {added} new rows, {len(blacklist_snapshot)} active URLs.")
+        else:
+            blacklist_snapshot.load()
+            print(f"Blacklist snapshot loaded: {len(blacklist_snapshot)} active URLs in {blacklist_snapshot.load_seconds:.1f}s.")
+    except Exception as e:
+        print(f"refresh_blacklist_snapshot(), Database error: {e}")
+
+def load_blacklist():
+    if THREAT_SET_DIR:
+        return load_threat_set("blacklist")
+    refresh_blacklist_snapshot()
+    return blacklist_snapshot
+
+provider_registry.register("Blacklist", load_blacklist)
+
+# เพิ่มฟังก์ชันตรวจสอบ blacklist
 async def check_blacklist(url):
     """Check if URL exists in local blacklist"""
     try:
-        with SessionBlacklist() as session:
-            existing_record = session.query(BlacklistURL).filter_by(
-                url=url, 
-                status=True
-            ).first()
-            
-            return existing_record is not None
-                
+        blacklist = await provider_registry.aget("Blacklist")
+        return url in blacklist
     except Exception as e:
         print(f"Error checking blacklist: {e}")
         return None
 
-# ฟังก์ชันจาก urlhaus_lookup_url.py
+def load_urlhaus():
+    """The local URLhaus mirror, loaded from URLHAUS_MIRROR_PATH if an earlier run saved it."""
+    return URLhausMirror(URLHAUS_MIRROR_PATH, URLHAUS_MIRROR_URL, auth_key=URLHAUS_AUTH_KEY)
+
+if URLHAUS_MODE == "mirror":
+    provider_registry.register("URLhaus", load_urlhaus)
+
 async def check_urlhaus(url, session):
+    """
+    Looks the URL up in the local URLhaus mirror when URLHAUS_MODE=mirror,
+    otherwise (or until the first dump has been downloaded) asks URLHAUS_API.
+    """
+    if URLHAUS_MODE != "mirror":
+        return await check_urlhaus_api(url, session)
+    urlhaus_mirror = await provider_registry.aget("URLhaus")
+    if not urlhaus_mirror.ready:
+        return await check_urlhaus_api(url, session)
+    entry = urlhaus_mirror.get(url)
+    if entry is None:
+        return False
+    if URLHAUS_ENRICH:
+        await enrich_urlhaus(url, entry, session)
+    return True
+
+async def enrich_urlhaus(url, entry, session):
+    """Prints the URLhaus API details of a URL found in the mirror; failures are only logged."""
+    threat, tags, urlhaus_link = entry
+    try:
+        async with urlhaus_limiter, urlhaus_breaker.guard(), session.post(URLHAUS_API, data={"url": url}, headers={"Auth-Key": URLHAUS_AUTH_KEY or ""}, timeout=aiohttp.ClientTimeout(total=urlhaus_breaker.timeout())) as response:
+            if response.status == 429 or response.status >= 500:
+                raise ProviderUnavailable(f"URLhaus API returned status {response.status}")
+            if response.status != 200:
+                print(f"enrich_urlhaus(), URLhaus API returned status {response.status} for {url}")
+                return
+            details = await response.json()
+        print(f"URLhaus: {url} is {details.get('url_status')} ({details.get('threat')}, tags {details.get('tags')}), "
+              f"{len(details.get('payloads') or [])} payloads, {details.get('urlhaus_reference')}")
+    except Exception as e:
+        print(f"enrich_urlhaus(), Cannot get details of {url} ({threat}, {urlhaus_link}): {e}")
+
+async def periodic_urlhaus_mirror_update(interval_minutes=None):
+    """Downloads the URLhaus dump into the local mirror periodically (shard 0 only)."""
+    interval_minutes = interval_minutes or URLHAUS_MIRROR_UPDATE_MINUTES
+    while True:
+        try:
+            urlhaus_mirror = await provider_registry.aget("URLhaus")
+            async with aiohttp.ClientSession() as session:
+                count = await urlhaus_mirror.update(session)
+            if count is None:
+                print("URLhaus dump has not changed since the last update.")
+            else:
+                print(f"URLhaus mirror updated: {count} URLs.")
+        except Exception as e:
+            print(f"Error in periodic URLhaus mirror update: {e}")
+        await asyncio.sleep(interval_minutes * 60)
+
+async def periodic_urlhaus_mirror_reload(interval_minutes=None):
+    """For shards other than 0: re-reads the dump file once shard 0 has replaced it."""
+    interval_minutes = interval_minutes or URLHAUS_MIRROR_UPDATE_MINUTES
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            urlhaus_mirror = await provider_registry.aget("URLhaus")
+            await asyncio.get_running_loop().run_in_executor(None, urlhaus_mirror.load_if_changed)
+        except Exception as e:
+            print(f"Error in periodic URLhaus mirror reload: {e}")
+
+# ฟังก์ชันจาก urlhaus_lookup_url.py
+async def check_urlhaus_api(url, session):
     # print("URLHaus: ", end="")
     try:
         # ตรวจสอบว่ามี Auth-Key หรือไม่
@@ -437,7 +1233,9 @@ async def check_urlhaus(url, session):
         }
         
         # Use aiohttp.ClientSession for asynchronous POST request
-        async with session.post(URLHAUS_API, data=data_urlhaus, headers=headers) as response:
+        async with urlhaus_limiter, urlhaus_breaker.guard(), session.post(URLHAUS_API, data=data_urlhaus, headers=headers, timeout=aiohttp.ClientTimeout(total=urlhaus_breaker.timeout())) as response:
+            if response.status == 429 or response.status >= 500:
+                raise ProviderUnavailable(f"URLhaus API returned status {response.status}")
             # Check if the response status is OK
             if response.status != 200:
                 print(f"URLhaus API returned status {response.status}")
@@ -472,6 +1270,8 @@ async def check_urlhaus(url, session):
                 print(f"URLhaus unexpected query_status: {json_response.get('query_status', 'unknown')}")
                 return None
                 
+    except ProviderUnavailable:
+        raise  # ให้ cached_check ตอบ INCONCLUSIVE และนัด scan ใหม่
     except aiohttp.ClientError as e:
         print(f"URLhaus Client Error: {e}")
         return None
@@ -488,62 +1288,324 @@ async def check_urlhaus(url, session):
         print(f"URLhaus Unexpected Error: {e}")
         return None    
 
-# ฟังก์ชันในการอัพเดตฐานข้อมูล
-def update_database(url, status):
-    """Update the status of a URL in the database."""
-    with SessionShortener() as session:
-        try:
-            session.query(URL).filter(URL.target_url == url).update({URL.status: status})
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            print(f"update_database(), Unexpected error: {e}")
-
-
 # ฟังก์ชันในการอ่านข้อมูลจากฐานข้อมูล อ่านเฉพาะที่ยังไม่เคย scan
-def get_new_urls_from_database():
+async def get_new_urls_from_database():
     # session = Session()
-    with SessionShortener() as session:  # ใช้ context manager เพื่อสร้าง session
+    async with AsyncSessionShortener() as session:  # ใช้ context manager เพื่อสร้าง session
         try:
-            urls = session.query(URL.target_url).filter(
+            urls = await session.scalars(select(URL.target_url).where(
                 (URL.is_checked == None) | (URL.is_checked == False)
-            ).all()
-            return [url[0] for url in urls]
+            ))
+            return urls.all()
         except Exception as e:
             print(f"get_new_urls_from_database(), Unexpected error: {e}")
             return []  # Return an empty list if there is an error
 
-# ฟังก์ชันในการอ่านข้อมูลจาก urls_to_check table ซึ่งข้อมูลจะเพิ่มเข้ามาเมื่อมีการทำ shorten url ใหม่ 
-def get_urls_from_database():
+# claim row จาก urls_to_check แบบมี lease เพื่อให้รัน scanner หลาย process พร้อมกันได้
+async def assign_shards(session, limit):
+    """
+    Sets shard and shard_count of up to `limit` urls_to_check rows that have
+    no shard for SCANNER_SHARDS shards (inserted by the trigger, or by a run
+    with another --workers). Every shard may do this for any row: the values
+    only depend on the URL.
+    """
+    unassigned = (
+        select(URLsToCheck.id, URLsToCheck.url)
+        .where(or_(URLsToCheck.shard_count == None, URLsToCheck.shard_count != SCANNER_SHARDS))
+        .order_by(URLsToCheck.id)
+        .limit(limit)
+    )
+    if async_engine_shortener.dialect.name == "postgresql":
+        unassigned = unassigned.with_for_update(skip_locked=True)
+    rows = (await session.execute(unassigned)).all()
+    if rows:
+        await session.execute(
+            update(URLsToCheck),
+            [{"id": row_id, "shard": shard_of(url, SCANNER_SHARDS), "shard_count": SCANNER_SHARDS} for row_id, url in rows]
+        )
+    return len(rows)
+
+async def claim_urls(limit=None, lease_seconds=None, attempts=None):
+    """
+    Claims up to `limit` rows of urls_to_check for this scanner.
+
+    Unclaimed rows and rows whose lease is older than `lease_seconds` are
+    claimable. PostgreSQL uses SELECT ... FOR UPDATE SKIP LOCKED so
+    concurrent scanners never claim the same row; SQLite relies on the
+    UPDATE being atomic and reads the rows back by claim token and time.
+    Rows are claimed with this process's CLAIM_TOKEN, and ScanPipeline
+    renews their leases with renew_claims() until they are completed.
+
+    With --workers N, only rows whose URL belongs to this shard are claimed.
+    The trigger cannot compute shard_of(), so assign_shards() first fills in
+    the shard of rows that have none for N shards, and the claim then filters
+    on the indexed (shard_count, shard) columns; a slow shard's rows never
+    crowd out the others'.
+
+    Returns {url: [row ids]}. Rows are deleted with complete_claims() once
+    the URL has been scanned. If an `attempts` dict is given, it receives
+    {url: rescans so far} for URLs claimed from schedule_rescans() rows.
+    """
+    limit = limit or URLS_TO_CHECK_CLAIM_SIZE
+    lease_seconds = lease_seconds or URLS_TO_CHECK_LEASE_SECONDS
+    token = CLAIM_TOKEN
+    now = time.time()
+    is_claimable = or_(URLsToCheck.claim_token == None, URLsToCheck.claimed_at < now - lease_seconds)
+
+    claims = {}
+    async with AsyncSessionShortener() as session:
+        with db_write_latency.time(operation="claim_urls"):
+            try:
+                conditions = [is_claimable]
+                if SCANNER_SHARDS > 1:
+                    await assign_shards(session, limit * SCANNER_SHARDS)
+                    conditions += [URLsToCheck.shard_count == SCANNER_SHARDS, URLsToCheck.shard == SCANNER_SHARD]
+                claimable = select(URLsToCheck.id).where(*conditions).order_by(URLsToCheck.id).limit(limit)
+                if async_engine_shortener.dialect.name == "postgresql":
+                    claimable = claimable.with_for_update(skip_locked=True)
+                claimable = claimable.scalar_subquery()
+                claim = (
+                    update(URLsToCheck)
+                    .where(URLsToCheck.id.in_(claimable), is_claimable)
+                    .values(claim_token=token, claimed_at=now)
+                )
+                await session.execute(claim, execution_options={"synchronize_session": False})
+                rows = (await session.execute(
+                    select(URLsToCheck.id, URLsToCheck.url, URLsToCheck.attempts).where(URLsToCheck.claim_token == token, URLsToCheck.claimed_at == now)
+                )).all()
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                print(f"claim_urls(), Database error: {e}")
+                return claims
+    for row_id, url, row_attempts in rows:
+        claims.setdefault(url, []).append(row_id)
+        if attempts is not None and row_attempts:
+            attempts[url] = max(attempts.get(url, 0), row_attempts)
+    return claims
+
+async def complete_claims(ids):
+    """Deletes claimed urls_to_check rows after their URL has been scanned. Returns False on a database error."""
+    async with AsyncSessionShortener() as session:
+        try:
+            for i in range(0, len(ids), 500):
+                await session.execute(delete(URLsToCheck).where(URLsToCheck.id.in_(ids[i:i + 500])))
+            await session.commit()
+            return True
+        except Exception as e:
+            await session.rollback()
+            print(f"complete_claims(), Database error: {e}")
+            return False
+
+async def renew_claims(ids):
+    """Extends the leases this process holds on urls_to_check rows. Returns False on a database error."""
+    now = time.time()
+    async with AsyncSessionShortener() as session:
+        try:
+            for i in range(0, len(ids), 500):
+                await session.execute(
+                    update(URLsToCheck)
+                    .where(URLsToCheck.id.in_(ids[i:i + 500]), URLsToCheck.claim_token == CLAIM_TOKEN)
+                    .values(claimed_at=now),
+                    execution_options={"synchronize_session": False}
+                )
+            await session.commit()
+            return True
+        except Exception as e:
+            await session.rollback()
+            print(f"renew_claims(), Database error: {e}")
+            return False
 
+def count_urls_to_check():
+    """Blocking: for the metrics gauge, which is collected in a thread."""
     with SessionShortener() as session:
-        urls = []
+        return session.query(func.count(URLsToCheck.id)).scalar()
+
+async def schedule_rescans(urls, delay_seconds=None):
+    """
+    Puts URLs back into urls_to_check, claimable after `delay_seconds`.
+
+    `urls` maps each URL to the rescans it has had so far; the new row
+    counts one more, and check_url() stops after RESCAN_MAX_ATTEMPTS.
+    The rows are inserted as already leased, with claimed_at set so that the
+    lease expires `delay_seconds` from now. Returns False on a database error.
+    """
+    delay_seconds = RESCAN_DELAY_SECONDS if delay_seconds is None else delay_seconds
+    claimed_at = time.time() - URLS_TO_CHECK_LEASE_SECONDS + delay_seconds
+    async with AsyncSessionShortener() as session:
         try:
-            # อ่าน URL จาก urls_to_check โดยการใช้ SQLAlchemy query
-            urls = session.query(URLsToCheck.url).distinct().all()
-            urls = [url[0] for url in urls]
+            await session.execute(
+                URLsToCheck.__table__.insert(),
+                [{"url": url, "claim_token": "rescan", "claimed_at": claimed_at, "attempts": attempts + 1,
+                  "shard": shard_of(url, SCANNER_SHARDS), "shard_count": SCANNER_SHARDS} for url, attempts in urls.items()]
+            )
+            await session.commit()
+            return True
+        except Exception as e:
+            await session.rollback()
+            print(f"schedule_rescans(), Database error: {e}")
+            return False
 
-            # ลบ URL ที่อ่านแล้วออกจากคิว
-            session.query(URLsToCheck).delete()
-            session.commit()
+async def update_urls_status(urls, status):
+    """Update the status of many URLs with one statement. Returns False on a database error."""
+    async with AsyncSessionShortener() as session:
+        try:
+            await session.execute(
+                update(URL).where(URL.target_url.in_(urls)).values(status=status),
+                execution_options={"synchronize_session": False}
+            )
+            await session.commit()
+            return True
         except Exception as e:
-            session.rollback()
-            print(f"get_urls_from_database(), Database error: {e}")
-        return urls
+            await session.rollback()
+            print(f"update_urls_status(), Database error: {e}")
+            return False
 
-def mark_urls_as_checked(urls):
-    with SessionShortener() as session:
+async def mark_urls_as_checked(urls):
+    async with AsyncSessionShortener() as session:
         try:
-            session.query(URL).filter(URL.target_url.in_(urls)).update({URL.is_checked: True}, synchronize_session=False)
-            session.commit()
+            await session.execute(
+                update(URL).where(URL.target_url.in_(urls)).values(is_checked=True),
+                execution_options={"synchronize_session": False}
+            )
+            await session.commit()
+            return True
         except Exception as e:
-            session.rollback()
+            await session.rollback()
             print(f"mark_urls_as_checked(), Database error: {e}")
-        finally:
-            session.close()
+            return False
+
+# ผลของ provider ที่ circuit เปิดอยู่หรือเรียกไม่สำเร็จ นัด scan ใหม่ และไม่เขียนทับผลเดิมของ provider นั้น
+UNAVAILABLE = object()
+# ส่ง URL ไปวิเคราะห์แล้ว virustotal_poller จะเขียนผลเมื่อเสร็จ
+PENDING = object()
+
+# เรียก provider เฉพาะเมื่อไม่มีผลใน verdict cache
+async def cached_check(provider, url, check):
+    caches = verdict_cache.caches(provider)
+    if caches:
+        cached = await verdict_cache.aget(url, provider)
+        if cached is not MISS:
+            return cached
+    breaker = None if provider in LOCAL_PROVIDERS else circuit_breakers.get(provider)  # provider ในเครื่องไม่ขึ้นกับ API
+    if breaker is not None and not breaker.available():
+        breaker.rejected += 1
+        return UNAVAILABLE  # ไม่ต้องรอ rate limiter ของ provider ที่ circuit เปิดอยู่
+    provider_in_flight.inc(provider=provider)
+    started = time.perf_counter()
+    try:
+        result = await check()
+    except ProviderUnavailable as e:
+        print(f"cached_check(), {provider} unavailable for {url}: {e}")
+        provider_results.inc(provider=provider, result="UNAVAILABLE")
+        return UNAVAILABLE
+    finally:
+        provider_in_flight.dec(provider=provider)
+    if result is PENDING:
+        provider_results.inc(provider=provider, result="PENDING")
+        return PENDING
+    provider_latency.observe(time.perf_counter() - started, provider=provider)
+    provider_results.inc(provider=provider, result={True: "DANGER", False: "SAFE"}.get(result, "INCONCLUSIVE"))
+    if caches:
+        verdict_cache.queue(url, provider, result)
+    return result
+
+def print_circuit_stats():
+    for name, stats in sorted((name, breaker.stats()) for name, breaker in circuit_breakers.items()):
+        print(f"Circuit {name}: {stats['state']}, opened {stats['opened']} times, "
+              f"{stats['rejected']} calls rejected, timeout {stats['timeout']:.1f}s")
+
+def print_cache_stats():
+    for provider, stats in sorted(verdict_cache.stats().items()):
+        print(f"Verdict cache {provider}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_ratio']:.1%})")
+    stats = canonical_cache_stats()
+    print(f"Canonical URL cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_ratio']:.1%}), {stats['size']} URLs")
+
+def parse_check_plan(plan):
+    """Parses CHECK_PLAN ("a,b;c;d") into a list of tiers, each a list of provider names."""
+    tiers = []
+    for tier in plan.split(";"):
+        names = [name.strip() for name in tier.split(",") if name.strip()]
+        for name in names:
+            if name not in CHECK_PROVIDERS:
+                raise ValueError(f"CHECK_PLAN, Unknown provider {name!r}, expected one of {', '.join(CHECK_PROVIDERS)}")
+        if names:
+            tiers.append(names)
+    if not tiers:
+        raise ValueError("CHECK_PLAN is empty.")
+    return tiers
+
+CHECK_PROVIDERS = ("Blacklist", "Phishtank", "URLhaus", "Google Web Risk", "VirusTotal")
+check_plan = parse_check_plan(CHECK_PLAN)
+# reached = จำนวน URL ที่ตรวจถึง tier นี้, danger = จำนวน URL ที่จบด้วย DANGER ใน tier นี้,
+# cancelled = จำนวน provider ที่ถูกยกเลิกกลางคันเพราะ provider อื่นใน tier เดียวกันพบ DANGER แล้ว
+check_plan_stats = [{"reached": 0, "danger": 0, "cancelled": 0} for _ in check_plan]
+
+# ผลระดับ host ที่ได้จาก URL อื่นบน host เดียวกัน และจากข้อมูลในเครื่องเท่านั้น
+HOST_REPUTATION = "Host reputation"  # scan_type ใน scan_records ของ URL ที่ตอบจากผลระดับ host
+host_reputation = HostReputation(min_danger=HOST_REPUTATION_MIN_DANGER, ttl=HOST_REPUTATION_TTL_SECONDS)
+
+def print_check_plan_stats():
+    for tier, (names, stats) in enumerate(zip(check_plan, check_plan_stats), start=1):
+        print(f"Check plan tier {tier} ({', '.join(names)}): {stats['reached']} reached, "
+              f"{stats['danger']} DANGER, {stats['cancelled']} cancelled")
+    if host_reputation.enabled:
+        stats = host_reputation.stats()
+        print(f"Host reputation: {stats['answered']} URLs answered DANGER without remote providers, "
+              f"{stats['dangerous_hosts']} dangerous hosts of {stats['hosts']} tracked")
+
+# รัน provider ของ tier เดียวกันพร้อมกัน และยกเลิกตัวที่เหลือทันทีที่มีตัวใดตอบ DANGER
+async def run_tier(url, names, checks):
+    tasks = {asyncio.ensure_future(cached_check(name, url, checks[name])): name for name in names}
+    results = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    results[tasks[task]] = task.result()
+                except Exception as e:
+                    print(f"run_tier(), Error in {tasks[task]} for {url}: {e}")
+                    results[tasks[task]] = None
+            if any(result is True for result in results.values()):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    return results, len(pending)
+
+def provider_checks(url, session):
+    return {
+        "Blacklist": lambda: check_blacklist(url),
+        "Google Web Risk": lambda: check_google_web_risk(url),
+        "VirusTotal": lambda: check_virustotal(url, session),
+        "Phishtank": lambda: check_phishtank(url),
+        "URLhaus": lambda: check_urlhaus(url, session)
+    }  # Use a dictionary to map functions to their names
+
+LOCAL_PROVIDERS = ("Blacklist", "Phishtank") + (("URLhaus", ) if URLHAUS_MODE == "mirror" else ())  # provider ที่ใช้ข้อมูลในเครื่อง
+
+async def lookup_urlhaus_mirror(url):
+    """The URLhaus mirror alone: no API fallback and no enrichment."""
+    urlhaus_mirror = await provider_registry.aget("URLhaus")
+    return urlhaus_mirror.ready and urlhaus_mirror.get(url) is not None
+
+async def check_host_root(root_url):
+    """True if a local provider in the check plan lists a host's root URL. Never calls a remote provider."""
+    checks = {
+        "Blacklist": lambda: check_blacklist(root_url),
+        "Phishtank": lambda: check_phishtank(root_url),
+        "URLhaus": lambda: lookup_urlhaus_mirror(root_url),
+    }
+    names = [name for tier in check_plan for name in tier if name in LOCAL_PROVIDERS]
+    results = await asyncio.gather(*(checks[name]() for name in names), return_exceptions=True)
+    return any(result is True for result in results)
 
 # ฟังก์ชันหลักในการตรวจสอบ URL
-async def check_url(url, session):
+async def check_url(url, session, attempts=0):
     '''
     tasks = [
         check_google_web_risk(url),
@@ -553,72 +1615,327 @@ async def check_url(url, session):
     ]
     results = await asyncio.gather(*tasks)
     '''
-    tasks = {
-        "Blacklist": check_blacklist(url),
-        "Google Web Risk": check_google_web_risk(url),
-        "VirusTotal": check_virustotal(url, session),
-        "Phishtank": check_phishtank(url),
-        "URLhaus": check_urlhaus(url, session)
-    }  # Use a dictionary to map functions to their names
-    results = await asyncio.gather(*tasks.values())  # Gather results
+    checks = provider_checks(url, session)
+    results = {}
+    host_checked = False
+    for names, stats in zip(check_plan, check_plan_stats):
+        if not host_checked and any(name not in LOCAL_PROVIDERS for name in names):
+            # ก่อนเรียก provider ภายนอกครั้งแรก ใช้ผลที่มีอยู่แล้วของ host นี้ ถ้า host อันตรายไม่ต้องเรียก
+            host_checked = True
+            if await host_reputation.dangerous(url, check_host_root):
+                results[HOST_REPUTATION] = True
+                provider_results.inc(provider=HOST_REPUTATION, result="DANGER")
+                break
+        stats["reached"] += 1
+        tier_results, cancelled = await run_tier(url, names, checks)
+        results.update(tier_results)
+        stats["cancelled"] += cancelled
+        if any(result is True for result in tier_results.values()):
+            stats["danger"] += 1
+            break  # ไม่ต้องเรียก provider ใน tier ที่แพงกว่า
     is_dangerous = False  # Flag to track if the URL is marked dangerous
+    rescan = False
+    result_strs = {}
+
+    # provider ที่ถูกข้ามหรือยกเลิกจะไม่มีผล และไม่ถูกเขียนลง scan_records
+    for function_name, result in results.items():
+        # Determine the result string
+        if result is True:
+            result_strs[function_name] = "DANGER"
+            is_dangerous = True
+            print(f"The URL {url} is dangerous according to {function_name}.")
+        elif result is False:
+            result_strs[function_name] = "SAFE"
+            print(f"The URL {url} is safe according to {function_name}.")
+        elif result is UNAVAILABLE and attempts >= RESCAN_MAX_ATTEMPTS:
+            # scan ใหม่ครบจำนวนครั้งแล้ว provider ยังไม่พร้อม บันทึกเป็น INCONCLUSIVE แล้วเลิก
+            result_strs[function_name] = "INCONCLUSIVE"
+            print(f"{function_name} is still unavailable after {attempts} rescans of the URL {url}, giving up.")
+        elif result is UNAVAILABLE:
+            # ไม่เขียนทับผลครั้งก่อนของ provider นี้ใน scan_records
+            rescan = True
+            print(f"{function_name} is unavailable, the URL {url} will be scanned again later.")
+        elif result is PENDING:
+            print(f"The {function_name} analysis of {url} is pending.")
+        else:
+            result_strs[function_name] = "INCONCLUSIVE"
+            print(f"No conclusive information for the URL {url} in {function_name}.")
 
-    with SessionShortener() as db_session:  # Proper session handling
-        # db_session = Session()  # Create a database session
-
-        for function_name, result in zip(tasks.keys(), results):
-            # Determine the result string
-            if result is True:
-                result_str = "DANGER"
-                is_dangerous = True
-                print(f"The URL {url} is dangerous according to {function_name}.")
-            elif result is False:
-                result_str = "SAFE"
-                print(f"The URL {url} is safe according to {function_name}.")
-            else:
-                result_str = "INCONCLUSIVE"
-                print(f"No conclusive information for the URL {url} in {function_name}.")
-
-            # ตรวจสอบว่ามี record ของ URL นี้และ scan_type นี้อยู่แล้วหรือไม่
-            with db_session.no_autoflush:  # Disable autoflush temporarily
-                existing_record = db_session.query(scan_records).filter_by(url=url, scan_type=function_name).first()
-
-            # ถ้ามี record อยู่แล้ว ให้อัพเดตเฉพาะ timestamp และ result
-            if existing_record:
-                existing_record.timestamp = func.now()
-                existing_record.result = result_str 
-            else:  # ถ้ายังไม่มี record ให้สร้างใหม่
-                # Create a new scan record
-                new_record = scan_records(
-                    url=url,
-                    scan_type=function_name,
-                    result=result_str  # You can add more details here if needed
-                )
-                db_session.add(new_record)
+    # SAFE ต่อเมื่อทุก provider ที่ตรวจตอบ SAFE ถ้ามี provider ที่ไม่พร้อม ยังไม่เสร็จ หรือไม่มีข้อมูล
+    # สถานะใน urls คงเดิม (เช่น DANGER จาก scan ครั้งก่อน) จนกว่าจะได้ผลครบ
+    if is_dangerous:
+        status = "DANGER"
+    elif all(result is False for result in results.values()):
+        status = "SAFE"
+    else:
+        status = None
+        if all(result is False or result is PENDING for result in results.values()):
+            virustotal_poller.safe_when_completed(url)  # เหลือเพียงผลของ VirusTotal
 
-        db_session.commit()  # Commit the changes to the database
-        # db_session.close()
+    if HOST_REPUTATION not in results:
+        host_reputation.record(url, is_dangerous, status == "SAFE")
 
-    # Update the main 'urls' table only once
-    if is_dangerous:
-        update_database(url, "DANGER")
-    else:  # Update to SAFE only if all results are False or None
-        if all(result is False or result is None for result in results):
-            update_database(url, "SAFE")
+    # analysis ที่ค้างอยู่มีแค่ในหน่วยความจำ จึงยังไม่ mark checked จน poller เขียนผล ถ้า process ล้ม URL จะถูก scan ใหม่
+    checked = not any(result is PENDING for result in results.values())
+
+    # scan_records และสถานะใน urls ถูกเขียนรวมกันเป็นชุดโดย scan_result_writer
+    # ถ้าพบ DANGER แล้วไม่ต้อง scan ใหม่ เพราะ provider อื่นเปลี่ยนผลไม่ได้
+    scan_result_writer.add(url, result_strs, status=status, checked=checked, rescan=rescan and not is_dangerous, attempts=attempts)
+
+class ScanResultWriter:
+    """
+    Buffers scan results and writes them to the shortener database in bulk.
+    scan_records rows are keyed by the canonical URL, urls rows by target_url.
+
+    scan_records rows go out in one INSERT ... ON CONFLICT DO UPDATE per
+    flush, urls.status changes in one UPDATE per status and is_checked in
+    one UPDATE. Verdicts queued in verdict_cache are written with them. A
+    flush starts in the background when SCAN_RECORDS_BATCH_SIZE rows are
+    buffered and runs periodically from ScanPipeline; flushes never
+    overlap, so writes keep the order in which results were added.
+
+    urls_to_check rows are deleted only after every write of the batch
+    succeeded. A batch that failed stays buffered, its rows still leased,
+    and is written again by the next flush; if the process stops first, the
+    leases expire and the URLs are scanned again.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or SCAN_RECORDS_BATCH_SIZE
+        self._records = {}   # (url, scan_type) -> row, ผลล่าสุดทับผลเก่า
+        self._statuses = {}  # url -> DANGER/SAFE
+        self._checked = set()
+        self._claims = []    # id ของ urls_to_check ที่ scan เสร็จแล้ว
+        self._rescans = {}  # URL ที่ต้อง scan ใหม่เพราะบาง provider ไม่พร้อม -> จำนวนครั้งที่ scan ใหม่ไปแล้ว
+        self._writing_claims = []  # id ของ flush ที่กำลังเขียนอยู่
+        self._lock = None
+        self._flush_task = None
+
+    def complete(self, claim_ids):
+        """Queues urls_to_check rows for deletion after the next write of their results."""
+        self._claims.extend(claim_ids)
+
+    def claimed(self):
+        """ids of urls_to_check rows whose results are buffered or being written, still leased."""
+        return self._claims + self._writing_claims
+
+    def add(self, url, results, status=None, checked=True, scan_id=None, rescan=False, attempts=0):
+        if rescan:
+            self._rescans[url] = max(self._rescans.get(url, 0), attempts)
+        # scan_records ใช้ URL แบบ canonical ส่วน urls ต้องใช้ target_url ตามที่ผู้ใช้ใส่มา
+        record_url = canonicalize_url(url)
+        for scan_type, result_str in results.items():
+            self._records[(record_url, scan_type)] = {"url": record_url, "scan_type": scan_type, "result": result_str, "scan_id": scan_id}
+        if status and self._statuses.get(url) != "DANGER":
+            self._statuses[url] = status
+        if checked:
+            self._checked.add(url)
+        if len(self._records) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            # worker ไม่ต้องรอการเขียน ผลที่เพิ่มระหว่างนี้จะไปกับ flush ครั้งถัดไป
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self._write()
+
+    async def _write(self):
+        records, statuses, checked = self._records, self._statuses, self._checked
+        claims, rescans = self._claims, self._rescans
+        self._records, self._statuses, self._checked, self._claims, self._rescans = {}, {}, set(), [], {}
+        self._writing_claims = claims
+        try:
+            await self._write_batch(records, statuses, checked, claims, rescans)
+        finally:
+            self._writing_claims = []
+
+    async def _write_batch(self, records, statuses, checked, claims, rescans):
+        if not await self._write_results(records, statuses, checked, rescans):
+            # ไม่ลบ row ของ urls_to_check ที่ผลยังเขียนไม่สำเร็จ ใส่ทุกอย่างกลับเข้า buffer ให้ flush ครั้งถัดไปเขียนใหม่
+            self._restore(records, statuses, checked, claims, rescans)
+            print(f"ScanResultWriter.flush(), {len(records)} scan results kept for the next flush.")
+            return
+
+        # ลบออกจากคิวหลังเขียนผลแล้วเท่านั้น ถ้า process ล้มก่อนหน้านี้ lease จะหมดอายุและถูก scan ใหม่
+        if claims:
+            with db_write_latency.time(operation="complete_claims"):
+                if not await complete_claims(claims):
+                    self._claims.extend(claims)
+
+    async def _write_results(self, records, statuses, checked, rescans):
+        """Writes one batch; True only if every write succeeded. Every statement can be repeated safely."""
+        if records:
+            try:
+                with db_write_latency.time(operation="upsert_scan_records"):
+                    await aupsert_scan_records(async_engine_shortener, scan_records.__table__, list(records.values()))
+            except Exception as e:
+                print(f"ScanResultWriter.flush(), Database error: {e}")
+                return False
+
+        if verdict_cache.queued():
+            # verdict ที่เขียนไม่สำเร็จทำให้เสียแค่ cache hit
+            with db_write_latency.time(operation="verdict_cache"):
+                await verdict_cache.aflush()
+
+        urls_by_status = {}
+        for url, status in statuses.items():
+            urls_by_status.setdefault(status, []).append(url)
+        for status, urls in urls_by_status.items():
+            with db_write_latency.time(operation="update_urls_status"):
+                if not await update_urls_status(urls, status):
+                    return False
+
+        if checked:
+            with db_write_latency.time(operation="mark_urls_as_checked"):
+                if not await mark_urls_as_checked(list(checked)):
+                    return False
+
+        if rescans:
+            with db_write_latency.time(operation="schedule_rescans"):
+                if not await schedule_rescans(rescans):
+                    return False
+        return True
+
+    def _restore(self, records, statuses, checked, claims, rescans):
+        """Puts a batch that could not be written back in front of what was added since."""
+        self._records = {**records, **self._records}
+        for url, status in statuses.items():
+            if self._statuses.get(url) is None or status == "DANGER":
+                self._statuses[url] = status
+        self._checked |= checked
+        self._claims = claims + self._claims
+        self._rescans = {**rescans, **self._rescans}
+
+scan_result_writer = ScanResultWriter()
+
+class ScanPipeline:
+    """Streams URLs through a bounded queue to long-lived check_url workers.
+
+    Producers await put(), which blocks while the queue is full, so the
+    database readers are throttled by how fast the workers drain the queue
+    instead of by fixed sleeps. A URL already queued or in flight is not
+    queued a second time.
+    """
+
+    def __init__(self, session, workers=None, queue_size=None):
+        self.session = session
+        self.workers = workers or SCANNER_WORKERS
+        self.queue = asyncio.Queue(maxsize=queue_size or SCANNER_QUEUE_SIZE)
+        self.pending = set()
+        self.claims = {}  # url -> id ของ urls_to_check ที่ต้องลบเมื่อ scan เสร็จ
+        self.attempts = {}  # url -> จำนวนครั้งที่ scan ใหม่ไปแล้ว (จาก row ของ schedule_rescans)
+        self.scanned = 0
+        self._tasks = []
+
+    def start(self):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        self._tasks.append(asyncio.create_task(self._flusher()))
+        self._tasks.append(asyncio.create_task(self._lease_renewer()))
+
+    @property
+    def free_slots(self):
+        return self.queue.maxsize - self.queue.qsize()
+
+    async def put(self, urls, claims=None, attempts=None):
+        """
+        Queues URLs. claims maps a URL to urls_to_check ids completed after
+        its scan; attempts maps a URL to the rescans it has had so far.
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        for url in urls:
+            if claims and url in claims:
+                self.claims.setdefault(url, []).extend(claims[url])
+            if attempts and url in attempts:
+                self.attempts[url] = max(self.attempts.get(url, 0), attempts[url])
+            if url in self.pending:
+                continue
+            self.pending.add(url)
+            await self.queue.put(url)  # รอถ้าคิวเต็ม
+            pipeline_queue_size.set(self.queue.qsize())
+
+    async def join(self):
+        await self.queue.join()
+        await scan_result_writer.flush()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await scan_result_writer.flush()
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(SCAN_RECORDS_FLUSH_SECONDS)
+            await scan_result_writer.flush()
+
+    async def _lease_renewer(self):
+        # URL อาจรอในคิวหลัง rate limiter ของ VirusTotal นานกว่า lease จึงต่ออายุให้ ไม่ให้ scanner อื่น claim ไป scan ซ้ำ
+        while True:
+            await asyncio.sleep(URLS_TO_CHECK_LEASE_SECONDS / 3)
+            ids = [row_id for ids in list(self.claims.values()) for row_id in ids] + scan_result_writer.claimed()
+            if ids:
+                with db_write_latency.time(operation="renew_claims"):
+                    await renew_claims(ids)
+
+    async def _worker(self, worker_id):
+        while True:
+            url = await self.queue.get()
+            pipeline_queue_size.set(self.queue.qsize())
+            try:
+                await check_url(url, self.session, attempts=self.attempts.pop(url, 0))
+                scan_result_writer.complete(self.claims.pop(url, []))
+                self.scanned += 1
+                urls_scanned.inc()
+                urls_scanned_rate.mark()
+            except Exception as e:
+                # ไม่ลบ row ออกจาก urls_to_check เมื่อ lease หมดอายุจะถูก scan ใหม่
+                self.claims.pop(url, None)
+                self.attempts.pop(url, None)
+                print(f"ScanPipeline worker {worker_id}, Error checking {url}: {e}")
+            finally:
+                self.pending.discard(url)
+                self.queue.task_done()
+
+async def start_metrics():
+    """
+    Starts the /metrics endpoint; the scanner keeps running if the port
+    cannot be bound. With --workers N, shard i listens on METRICS_PORT + i.
+    """
+    port = METRICS_PORT + SCANNER_SHARD
+    try:
+        return await start_metrics_server(metrics_registry, METRICS_HOST, port)
+    except OSError as e:
+        print(f"start_metrics(), Cannot serve metrics on {METRICS_HOST}:{port}: {e}")
+        return None
 
 # ฟังก์ชันหลักในการรับ URL และตรวจสอบ
-async def main(urls, batch_size=10):
+async def main(urls, workers=None):
     if isinstance(urls, str):  # Check if urls is a string
         urls = [urls]  # Convert the single string to a list
+    init_databases()
+    provider_registry.preload(name for tier in check_plan for name in tier)
     async with aiohttp.ClientSession() as session:  # Create session here
-        for i in range(0, len(urls), batch_size):
-            batch = urls[i:i + batch_size]  # Get a batch of URLs
-            tasks = [check_url(url, session) for url in batch]
-            await asyncio.gather(*tasks)
-
-            # Delay after each batch
-            await asyncio.sleep(SLEEP_SECONDS)  # Adjust delay time as needed
-        mark_urls_as_checked(urls)
+        pipeline = ScanPipeline(session, workers=workers)
+        pipeline.start()
+        poller_task = asyncio.create_task(virustotal_poller.run(session))
+        metrics_runner = await start_metrics() if METRICS_PORT else None
+        try:
+            await pipeline.put(urls)
+            await pipeline.join()
+            await virustotal_poller.join()
+        finally:
+            await pipeline.stop()
+            poller_task.cancel()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            await close_databases()
+    print_cache_stats()
+    print_check_plan_stats()
+    print_circuit_stats()
 
 # ฟังก์ชันหลักในการเรียกใช้ main
 def run_main(urls):
@@ -626,48 +1943,100 @@ def run_main(urls):
 
 # ตัวอย่างการเรียกใช้งาน
 if __name__ == "__main__":
-    # อ่าน URL จากฐานข้อมูล ทั้งหมด
-    # urls_to_check = get_urls_from_database()
-
     # อ่านเฉพาะ record ที่ยังไม่ได้ scan
     # urls_to_check = get_new_urls_from_database()
     # run_main(urls_to_check)
 
+    parser = argparse.ArgumentParser(description="Scans shortened URLs against blacklists and reputation services.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of scanner processes; each one scans the URLs of its own shard")
+    args = parser.parse_args()
+
     # เริ่มการตรวจสอบ URL ใหม่และตรวจสอบเป็นระยะ
-    # สร้าง Trigger ใน Database สำหรับตรวจสอบ URL ใหม่
-    if DATABASE_PATH.startswith("sqlite"):
-        create_database_trigger("sqlite")
-    elif DATABASE_PATH.startswith("postgresql"):
-        create_database_trigger("postgresql")
+    # สร้าง Trigger ใน Database สำหรับตรวจสอบ URL ใหม่ (ครั้งเดียว ไม่ใช่ในทุก shard)
+    is_shard = SCANNER_SHARDS > 1
+    is_leader = SCANNER_SHARD == 0  # shard 0 ทำงานที่ต้องทำครั้งเดียว: OpenPhish, Web Risk mirror, ล้าง cache
+    init_databases()
+    if not is_shard:
+        if DATABASE_PATH.startswith("sqlite"):
+            create_database_trigger("sqlite")
+        elif DATABASE_PATH.startswith("postgresql"):
+            create_database_trigger("postgresql")
+
+    if args.workers > 1 and not is_shard:
+        supervise(os.path.abspath(__file__), args.workers)
+        sys.exit(0)
 
     async def main_task():
         try:
-            print("Performing initial blacklist update...")
-            try:
-                async with aiohttp.ClientSession() as session:
-                    await update_openphish_blacklist(session)
-            except Exception as e:
-                print(f"Failed to perform initial blacklist update: {e}")
-                print("Continuing with URL checking tasks...")
+            if is_leader:
+                purged = verdict_cache.purge_expired()
+                print(f"Purged {purged} expired entries from the verdict cache.")
+
+                print("Performing initial blacklist update...")
+                try:
+                    async with aiohttp.ClientSession() as session:
+                        await update_openphish_blacklist(session)
+                except Exception as e:
+                    print(f"Failed to perform initial blacklist update: {e}")
+                    print("Continuing with URL checking tasks...")
+            # โหลด provider ที่อยู่ใน CHECK_PLAN (blacklist, PhishTank CSV, client ของ Web Risk) ใน background
+            provider_registry.preload(name for tier in check_plan for name in tier)
 
             # เริ่มการตรวจสอบ URL ใหม่และตรวจสอบเป็นระยะ
-            async def check_urls_task():
+            async def check_urls_task(pipeline):
+                # รอการแจ้งเตือนว่ามี URL ใหม่ (LISTEN/NOTIFY หรือ PRAGMA data_version) แทนการ SELECT ทุก SLEEP_SECONDS
+                notifier = create_notifier(engine_shortener, URLS_TO_CHECK_CHANNEL, SQLITE_DATA_VERSION_POLL_SECONDS)
+                try:
+                    await notifier.start()
+                except Exception as e:
+                    print(f"check_urls_task(), Cannot start new URL notifications, falling back to polling: {e}")
+                    notifier = PollingNotifier()
+                idle_seconds = URLS_TO_CHECK_IDLE_SECONDS if notifier.push else SLEEP_SECONDS
                 while True:
                     try:
-                        urls_to_check = get_urls_from_database()
-                        if urls_to_check:
-                            await main(urls_to_check)
+                        # claim เท่าที่คิวยังว่าง row ที่รอในคิวนานถูกต่อ lease โดย ScanPipeline
+                        attempts = {}
+                        claims = await claim_urls(limit=max(1, min(URLS_TO_CHECK_CLAIM_SIZE, pipeline.free_slots)), attempts=attempts)
+                        if claims:
+                            # put() จะรอเมื่อคิวเต็ม จึงอ่านรอบถัดไปได้ทันทีโดยไม่ต้อง sleep
+                            await pipeline.put(list(claims), claims=claims, attempts=attempts)
+                            continue
                     except Exception as e:
                         print(f"Error in check_urls_task: {e}")
-                    await asyncio.sleep(SLEEP_SECONDS)  # รอ 2 วินาทีก่อนตรวจสอบรอบถัดไป (ปรับได้ตามต้องการ)
+                    await notifier.wait(idle_seconds)  # คิวในฐานข้อมูลว่าง รอจนมี URL ใหม่
 
-            loop = asyncio.get_event_loop()
-
-            loop.create_task(periodic_full_check(interval_hours=INTERVAL_HOURS))  # สร้าง task ตรวจสอบทุก 2 ชั่วโมง
-            loop.create_task(check_urls_task())  # เริ่ม Task ตรวจสอบ URL ใหม่
-            loop.create_task(periodic_openphish_update(interval_hours=12))
-
-            await asyncio.Event().wait()  # รอ event loop ทำงาน
+            async with aiohttp.ClientSession() as session:
+                pipeline = ScanPipeline(session)
+                pipeline.start()
+                if METRICS_PORT:
+                    await start_metrics()
+
+                loop = asyncio.get_event_loop()
+
+                loop.create_task(periodic_full_check(pipeline, interval_hours=INTERVAL_HOURS))  # สร้าง task ตรวจสอบทุก 2 ชั่วโมง
+                loop.create_task(check_urls_task(pipeline))  # เริ่ม Task ตรวจสอบ URL ใหม่
+                loop.create_task(periodic_rescan(pipeline))  # scan URL ที่เสี่ยงที่สุดซ้ำภายใน budget
+                loop.create_task(virustotal_poller.run(session))  # ตรวจสถานะ analysis ของ VirusTotal ที่ค้างอยู่
+                if not THREAT_SET_DIR and any("Phishtank" in tier for tier in check_plan):
+                    loop.create_task(periodic_phishtank_reload())  # ทุก shard มี index ของตัวเอง
+                if is_leader:
+                    loop.create_task(periodic_openphish_update(interval_hours=12))
+                    if THREAT_SET_DIR:
+                        loop.create_task(periodic_threat_set_rebuild())
+                    if WEBRISK_MODE == "mirror":
+                        loop.create_task(periodic_webrisk_mirror_update())
+                    if URLHAUS_MODE == "mirror":
+                        loop.create_task(periodic_urlhaus_mirror_update())
+                else:
+                    if not THREAT_SET_DIR:  # ThreatSet โหลดไฟล์ใหม่ที่ shard 0 สร้างเอง
+                        loop.create_task(periodic_blacklist_refresh())
+                    if WEBRISK_MODE == "mirror":
+                        loop.create_task(periodic_webrisk_mirror_reload())
+                    if URLHAUS_MODE == "mirror":
+                        loop.create_task(periodic_urlhaus_mirror_reload())
+
+                await asyncio.Event().wait()  # รอ event loop ทำงาน
         except Exception as e:
             print(f"main_task(), Unexpected error: {e}")
 
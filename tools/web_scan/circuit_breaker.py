@@ -0,0 +1,162 @@
+# tools/web_scan/circuit_breaker.py
+import asyncio
+import collections
+import time
+
+import aiohttp
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class ProviderUnavailable(Exception):
+    """The provider failed (network error, timeout, 5xx/429) rather than giving an answer."""
+
+
+class CircuitOpenError(ProviderUnavailable):
+    """The provider's circuit is open, so no request was sent."""
+
+
+def is_outage(exc):
+    """
+    True if exc means the provider could not answer: a transport error,
+    a timeout, or an HTTP 429/5xx (`status` of aiohttp, `code` of
+    google.api_core). A 4xx or a malformed response is an answer.
+    """
+    if isinstance(exc, (ProviderUnavailable, asyncio.TimeoutError, TimeoutError, ConnectionError,
+                        aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return True
+    status = getattr(exc, "status", None)
+    if not isinstance(status, int):
+        status = getattr(exc, "code", None)
+    return isinstance(status, int) and (status == 429 or 500 <= status < 600)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker and adaptive timeout for one external provider.
+
+    Closed: requests go through; `failure_threshold` consecutive failures
+    open the circuit. Open: requests fail at once with CircuitOpenError for
+    `reset_seconds`. Half-open: up to `half_open_calls` probe requests go
+    through; a success closes the circuit, a failure opens it again.
+
+    timeout() is `multiplier` times the `percentile` of the last `window`
+    successful latencies, clamped to [min_timeout, max_timeout]; until
+    `min_samples` latencies are known it is max_timeout.
+
+    Usage (inside the rate limiter, so limiter waits are not measured):
+        async with limiter, breaker.guard():
+            async with session.get(..., timeout=aiohttp.ClientTimeout(total=breaker.timeout())) as response:
+                ...
+
+    Only outages (see is_outage) count as failures; they are re-raised as
+    ProviderUnavailable. Any other exception, such as a 4xx or a response
+    that cannot be parsed, leaves the circuit as it is and is re-raised
+    unchanged for the caller to treat as INCONCLUSIVE.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=60, half_open_calls=1,
+                 percentile=0.99, multiplier=3, min_timeout=2, max_timeout=30,
+                 window=200, min_samples=20):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_calls = half_open_calls
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self.state = CLOSED
+        self.failures = 0         # จำนวนครั้งที่ล้มเหลวติดกัน
+        self.opened_at = 0.0
+        self.probes = 0           # probe ที่กำลังทำงานในสถานะ half-open
+        self.rejected = 0         # จำนวน request ที่ไม่ถูกส่งเพราะ circuit เปิดอยู่
+        self.opened = 0           # จำนวนครั้งที่ circuit เปิด
+
+    def available(self):
+        """True if a request would be let through now. Does not change the state."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return self.probes < self.half_open_calls
+
+    def timeout(self):
+        if len(self.latencies) < self.min_samples:
+            return self.max_timeout
+        latencies = sorted(self.latencies)
+        value = latencies[int(self.percentile * (len(latencies) - 1))] * self.multiplier
+        return min(self.max_timeout, max(self.min_timeout, value))
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.failures = 0
+        if self.state != CLOSED:
+            print(f"CircuitBreaker {self.name}, Closed.")
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            print(f"CircuitBreaker {self.name}, Opened after {self.failures} failures, retrying in {self.reset_seconds}s.")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.opened += 1
+
+    def guard(self):
+        return _Guard(self)
+
+    def _enter(self):
+        """Returns True if the request is a half-open probe; raises CircuitOpenError if it must not be sent."""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = HALF_OPEN
+            self.probes = 0
+        if self.state == OPEN or (self.state == HALF_OPEN and self.probes >= self.half_open_calls):
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        if self.state == HALF_OPEN:
+            self.probes += 1
+            return True
+        return False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "timeout": self.timeout(),
+        }
+
+
+class _Guard:
+    """One request through a CircuitBreaker; measures its latency and records the outcome."""
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.probe = False
+        self.started = 0.0
+
+    async def __aenter__(self):
+        self.probe = self.breaker._enter()
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        breaker = self.breaker
+        if self.probe:
+            breaker.probes = max(0, breaker.probes - 1)
+        if exc_type is None:
+            breaker.record_success(time.monotonic() - self.started)
+            return False
+        if issubclass(exc_type, asyncio.CancelledError):
+            return False  # ถูกยกเลิกจากภายนอก ไม่ใช่ความผิดของ provider
+        if not is_outage(exc):
+            return False  # provider ตอบแล้ว (เช่น 4xx หรือ JSON ผิดรูปแบบ) ไม่นับเป็นความล้มเหลว
+        breaker.record_failure()
+        if isinstance(exc, ProviderUnavailable):
+            return False
+        raise ProviderUnavailable(f"{breaker.name}: {exc!r}") from exc
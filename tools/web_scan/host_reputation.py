@@ -0,0 +1,113 @@
+# tools/web_scan/host_reputation.py
+import asyncio
+import collections
+import time
+import urllib.parse
+
+from canonical import canonicalize_url
+
+
+def host_of(url):
+    """(scheme, canonical host) of a URL, or None if it has no host."""
+    parts = urllib.parse.urlsplit(canonicalize_url(url))
+    if not parts.hostname:
+        return None
+    return parts.scheme, parts.hostname
+
+
+class HostReputation:
+    """
+    Answers DANGER for a URL from verdicts the scanner already holds about
+    its host, so a campaign of many paths on one domain does not pay for
+    the remote providers on every URL.
+
+    A host is dangerous when the providers found `min_danger` other URLs on
+    it DANGER, or when a local provider (blacklist, PhishTank, URLhaus
+    mirror) lists the host's root URL, and no URL on it was found SAFE by
+    every provider. A single clean URL means the host is shared (a hosting
+    platform, a URL shortener) and its URLs are checked one by one. Nothing
+    is ever sent to a remote provider on behalf of a host.
+
+    Host entries expire `ttl` seconds after they were created; at most
+    `max_hosts` are kept, least recently used first out.
+    """
+
+    def __init__(self, min_danger=2, ttl=3600, max_hosts=100000):
+        self.min_danger = min_danger
+        self.ttl = ttl
+        self.max_hosts = max_hosts
+        self._hosts = collections.OrderedDict()  # host -> _Host
+        self.answered = 0  # จำนวน URL ที่ตอบ DANGER จากผลระดับ host โดยไม่เรียก provider ภายนอก
+
+    @property
+    def enabled(self):
+        return self.min_danger > 0
+
+    def _entry(self, host):
+        now = time.monotonic()
+        entry = self._hosts.get(host)
+        if entry is None or entry.expires_at <= now:
+            entry = _Host(now + self.ttl)
+            self._hosts[host] = entry
+            if len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        self._hosts.move_to_end(host)
+        return entry
+
+    def record(self, url, dangerous, safe):
+        """Remembers the providers' verdict on a URL: `dangerous` if any said DANGER, `safe` if all said SAFE."""
+        host = host_of(url)
+        if not self.enabled or host is None or not (dangerous or safe):
+            return
+        entry = self._entry(host)
+        if safe:
+            entry.safe = True
+        elif len(entry.danger) < self.min_danger:
+            entry.danger.add(canonicalize_url(url))
+
+    async def dangerous(self, url, root_check):
+        """
+        True if the host of `url` is known to be dangerous. `root_check(root_url)`
+        must only consult local data; it runs once per host and TTL, and
+        concurrent callers share it.
+        """
+        host = host_of(url)
+        if not self.enabled or host is None:
+            return False
+        entry = self._entry(host)
+        if entry.safe:
+            return False
+        url = canonicalize_url(url)
+        if len(entry.danger - {url}) >= self.min_danger:
+            self.answered += 1
+            return True
+        if entry.root_listed is None:
+            scheme, hostname = host
+            entry.root_listed = asyncio.ensure_future(root_check(f"{scheme}://{hostname}/"))
+        # shield: การยกเลิกของ URL หนึ่งต้องไม่ยกเลิกการตรวจที่ URL อื่นรออยู่
+        if await asyncio.shield(entry.root_listed) and not entry.safe:
+            self.answered += 1
+            return True
+        return False
+
+    def stats(self):
+        dangerous = sum(
+            1 for entry in self._hosts.values()
+            if not entry.safe and (len(entry.danger) >= self.min_danger or _listed(entry))
+        )
+        return {"hosts": len(self._hosts), "dangerous_hosts": dangerous, "answered": self.answered}
+
+
+class _Host:
+    __slots__ = ("danger", "safe", "root_listed", "expires_at")
+
+    def __init__(self, expires_at):
+        self.danger = set()       # URL แบบ canonical ที่ provider ตอบ DANGER (เก็บไม่เกิน min_danger)
+        self.safe = False         # มี URL ที่ทุก provider ตอบ SAFE แล้ว
+        self.root_listed = None   # task ของ root_check() ที่ใช้ร่วมกัน
+        self.expires_at = expires_at
+
+
+def _listed(entry):
+    task = entry.root_listed
+    return task is not None and task.done() and not task.cancelled() and task.exception() is None and bool(task.result())
@@ -17,6 +17,7 @@ HYBRID_ANALYSIS_URL = os.getenv("HYBRID_ANALYSIS_URL")
 DATABASE_PATH = os.getenv("DATABASE_PATH")
 SCAN_RECORDS_DATABASE_PATH = os.getenv("SCAN_RECORDS_DATABASE_PATH")
 SLEEP_SECONDS = int(os.getenv("SLEEP_SECONDS", "2"))
+HYBRID_SCAN_TYPE = "hybrid-analysis"  # scan_type ของ row ใน scan_records ที่ hybrid scan เขียน (check_urls.py ใช้ชื่อ provider)
 
 # Create database sessions
 urls_session, _ = create_db_session(DATABASE_PATH)
@@ -143,6 +144,7 @@ def check_and_update_pending_scan(url):
         # Query for existing scan records with "In queue for scanning" status
         existing_record = scan_records_session.query(ScanRecord).filter(
             ScanRecord.url == url,
+            ScanRecord.scan_type == HYBRID_SCAN_TYPE,
             ScanRecord.status == 'In queue for scanning'
         ).first()
         
@@ -320,7 +322,11 @@ def save_scan_results_to_database(results, url, scan_type, status):
         # Convert timestamp to a proper datetime object
         timestamp = datetime.now(timezone.utc)
 
-        existing_record = scan_records_session.query(ScanRecord).filter(ScanRecord.url == url).first()
+        # scan_records เก็บหนึ่ง row ต่อ url และ scan_type ห้ามเขียนทับ row ของ scanner อื่น
+        existing_record = scan_records_session.query(ScanRecord).filter(
+            ScanRecord.url == url,
+            ScanRecord.scan_type == scan_type
+        ).first()
         if existing_record:
             existing_record.timestamp = timestamp
             existing_record.status = status
@@ -362,6 +368,7 @@ async def check_pending_scans():
         try:
             # Get all pending scans from the database
             pending_scans = scan_records_session.query(ScanRecord).filter(
+                ScanRecord.scan_type == HYBRID_SCAN_TYPE,
                 ScanRecord.status == 'In queue for scanning'
             ).all()
 
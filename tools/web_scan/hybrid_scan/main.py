@@ -1,23 +1,27 @@
 import asyncio
 import json
 import os
+import sys
 import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from urllib.parse import urlparse
 
 from dotenv import load_dotenv
 from flask import (Flask, Response, abort, jsonify, redirect, render_template,
                    request, stream_with_context, url_for)
 from sqlalchemy.exc import SQLAlchemyError
 
-from hybrid_analysis import (check_hybrid_analysis_url, check_pending_scans,
-                             check_quick_scan_status,
+from hybrid_analysis import (HYBRID_SCAN_TYPE, check_hybrid_analysis_url,
+                             check_pending_scans, check_quick_scan_status,
                              get_hybrid_analysis_summary,
                              get_new_urls_from_database, reload_config,
                              save_scan_results_to_database, update_database)
 from models import ScanRecord, scan_records_session, urls_session
 
+# canonical.py อยู่ใน web_scan (โฟลเดอร์แม่ของ hybrid_scan)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from canonical import canonicalize_url
+
 app = Flask(__name__)
 
 # Create a global executor
@@ -36,27 +40,57 @@ scan_status = {}
 # Global event loop
 loop = None
 
-def normalize_url(url: str, trailing_slash: bool = False) -> str:
+def normalize_url(url: str) -> str:
     """
-    Normalizes a URL by optionally adding or removing trailing slashes.
+    Normalizes a URL to the canonical form that check_urls.py writes to
+    scan_records, so both scanners find each other's records.
 
     Args:
         url (str): The URL to normalize.
-        trailing_slash (bool): Whether to ensure a trailing slash (True) or remove it (False).
 
     Returns:
-        str: The normalized URL.
+        str: The canonical URL.
     """
-    # Strip leading and trailing whitespace from the URL
-    url = url.strip()
-
-    parsed_url = urlparse(url)
-    path = parsed_url.path.rstrip("/")  # Remove all trailing slashes from the path
-
-    if trailing_slash:
-        path += "/"  # Add a single trailing slash if requested
+    return canonicalize_url(url)
 
-    return parsed_url._replace(path=path).geturl()
+def rekey_scan_records():
+    """
+    Moves the hybrid-analysis rows of scan_records stored under the old
+    normalize_url() key (path with its trailing slashes removed) to the
+    canonical key, keeping the newest row when several map to the same key.
+    Safe to run more than once. A URL whose path ended in "/" (other than the
+    root) was stored without it, so its old row cannot be told apart from the
+    URL without the slash and stays under that key.
+    """
+    try:
+        records = (
+            scan_records_session.query(ScanRecord)
+            .filter(ScanRecord.scan_type == HYBRID_SCAN_TYPE)
+            .order_by(ScanRecord.timestamp.desc(), ScanRecord.id.desc())
+            .all()
+        )
+        kept = {}
+        duplicates = []
+        for record in records:
+            key = normalize_url(record.url)
+            if key in kept:
+                duplicates.append(record)
+            else:
+                kept[key] = record
+        # ลบ row ที่ซ้ำก่อน เพื่อไม่ให้ชน unique index (url, scan_type) ตอนเปลี่ยน key
+        for record in duplicates:
+            scan_records_session.delete(record)
+        scan_records_session.flush()
+        moved = 0
+        for key, record in kept.items():
+            if record.url != key:
+                record.url = key
+                moved += 1
+        scan_records_session.commit()
+        print(f"rekey_scan_records(), {moved} records re-keyed, {len(duplicates)} older duplicates removed.")
+    except SQLAlchemyError as e:
+        scan_records_session.rollback()
+        print(f"rekey_scan_records(), Database error: {str(e)}")
 
 @app.route("/")
 def index():
@@ -85,7 +119,7 @@ def scan_status_sse():
         while True:
             for url, status in scan_status.items():
                 # Find the scan record from the database
-                scan_record = scan_records_session.query(ScanRecord).filter_by(url=url).first()
+                scan_record = scan_records_session.query(ScanRecord).filter_by(url=url, scan_type=HYBRID_SCAN_TYPE).first()
                 if scan_record:
                     data = {
                         'url': scan_record.url,
@@ -231,11 +265,14 @@ async def check_url(url):
     """
     global scan_status
     scan_status[url] = "Checking in database"
-    url = normalize_url(url, trailing_slash=False)
+    url = normalize_url(url)
 
     try:
         # Start a new session for this operation
-        existing_scan = scan_records_session.query(ScanRecord).filter(ScanRecord.url == url).first()
+        existing_scan = scan_records_session.query(ScanRecord).filter(
+            ScanRecord.url == url,
+            ScanRecord.scan_type == HYBRID_SCAN_TYPE
+        ).first()
 
         if existing_scan:
             scan_id = existing_scan.scan_id
@@ -285,7 +322,7 @@ async def check_url(url):
                 sha256 = response.get('sha256')
 
                 # Store the scan_id and sha256 in the database with an initial status
-                save_scan_results_to_database(response, url, 'hybrid-analysis', "In queue for scanning")
+                save_scan_results_to_database(response, url, HYBRID_SCAN_TYPE, "In queue for scanning")
                 scan_status[url] = "In queue for scanning"
                 print(f"Submitted URL for scanning: {url}")
             else:
@@ -357,6 +394,9 @@ if __name__ == "__main__":
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
+    # row ที่บันทึกด้วย key แบบเก่า (ตัด / ท้าย path) ย้ายไปใช้ canonical key
+    rekey_scan_records()
+
     # Schedule the background task
     loop.create_task(check_pending_scans())
 
@@ -0,0 +1,78 @@
+# tools/web_scan/phishtank_index.py
+import csv
+import os
+import threading
+
+from canonical import canonicalize_url, canonicalize_urls
+
+
+class PhishTankIndex:
+    """
+    Hash index of the PhishTank CSV (verified_online.csv).
+
+    Rows are stored in a dict keyed by canonical URL, so a lookup is O(1)
+    instead of a scan over the whole feed. Lookups only read the dict:
+    load() and reload_if_changed() parse the file and are blocking, so the
+    scanner runs them off the event loop. A new dict is built aside and
+    swapped in with one assignment, so readers see either the old or the
+    new feed, never a partial one, and the scanner never needs a restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._mtime is not None
+
+    def get(self, url):
+        """Returns the PhishTank row (dict) for the URL, or None if it is not listed."""
+        return self._index.get(canonicalize_url(url))
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def __len__(self):
+        return len(self._index)
+
+    def load(self):
+        """Reads the whole file. Raises if it cannot be read."""
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            self._index = self._load()
+            self._mtime = mtime
+        return len(self._index)
+
+    def reload_if_changed(self):
+        """
+        Rebuilds the index if the file's mtime changed since the last load.
+        Returns True if it did. A file that is missing or cannot be parsed
+        keeps the previous feed.
+        """
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False  # ไฟล์หายระหว่างดาวน์โหลดใหม่ ใช้ข้อมูลชุดเดิมไปก่อน
+            if mtime == self._mtime:
+                return False
+            try:
+                self._index = self._load()
+            except (OSError, csv.Error, UnicodeDecodeError) as e:
+                print(f"PhishTankIndex, Cannot reload {self.path}, keeping the previous feed: {e}")
+                return False
+            self._mtime = mtime
+            return True
+
+    def _load(self):
+        index = {}
+        with open(self.path, newline="", encoding="utf-8") as f:
+            rows = [row for row in csv.DictReader(f) if row.get("url")]
+        for url, row in zip(canonicalize_urls((row["url"] for row in rows), cache=False), rows):
+            index.setdefault(url, row)
+        if not index:
+            print(f"PhishTankIndex, The file {self.path} is empty.")
+        return index
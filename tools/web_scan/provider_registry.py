@@ -0,0 +1,61 @@
+# tools/web_scan/provider_registry.py
+import asyncio
+import threading
+import time
+
+
+class ProviderRegistry:
+    """
+    Client libraries and data of the providers, built on first use.
+
+    Each provider is registered with a factory that imports its client
+    library and loads its data, which can take seconds (a large CSV, the
+    whole blacklist). Nothing runs at registration: get() calls the factory
+    once under a per-provider lock and keeps the value, aget() does the same
+    in a thread so the event loop keeps running, and preload() starts the
+    enabled providers loading in the background at startup so the first URLs
+    rarely have to wait. A factory that raises is retried on the next use.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._locks = {}
+        self._values = {}
+        self.load_seconds = {}
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+        self._locks[name] = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    def loaded(self, name):
+        return name in self._values
+
+    def get(self, name):
+        """Returns the provider's value, calling its factory if this is the first use. Blocking."""
+        if name in self._values:
+            return self._values[name]
+        with self._locks[name]:
+            if name not in self._values:
+                started = time.perf_counter()
+                self._values[name] = self._factories[name]()
+                self.load_seconds[name] = time.perf_counter() - started
+        return self._values[name]
+
+    async def aget(self, name):
+        if name in self._values:
+            return self._values[name]
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, name)
+
+    def preload(self, names):
+        """Starts loading the registered providers among `names` in background tasks and returns the tasks."""
+        return [asyncio.ensure_future(self._preload(name)) for name in dict.fromkeys(names) if name in self._factories]
+
+    async def _preload(self, name):
+        try:
+            await self.aget(name)
+            print(f"ProviderRegistry, Loaded {name} in {self.load_seconds[name]:.2f}s.")
+        except Exception as e:
+            print(f"ProviderRegistry, Cannot load {name}, retrying on first use: {e}")
@@ -0,0 +1,118 @@
+# tools/web_scan/rate_limiter.py
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """
+    Async token bucket with a concurrency cap for one external provider.
+
+    Every request takes one token; tokens refill at `rate` per second up to
+    `burst`. At most `concurrency` requests hold the limiter at the same
+    time. A rate of 0 or less disables the token bucket.
+
+    Usage:
+        async with limiter:
+            async with session.get(...) as response:
+                ...
+    """
+
+    def __init__(self, rate, burst=1, concurrency=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def acquire(self):
+        await self.take_token()
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def take_token(self):
+        if self.rate <= 0:
+            return
+        # ถือ lock ระหว่างรอ เพื่อให้ผู้ที่รอก่อนได้ token ก่อน
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter whose token bucket is shared by several processes.
+
+    The bucket lives in a small SQLite file; each token is taken in one
+    BEGIN IMMEDIATE transaction, so processes of `check_urls.py --workers N`
+    together stay within one provider budget. The concurrency cap stays
+    per process. Wall-clock time is used because the file is shared.
+
+    BEGIN IMMEDIATE may wait up to 30 s for another process's lock, so
+    tokens are taken on a single thread of this limiter, never on the event
+    loop; the one thread also keeps the connection's transactions in order
+    when a waiting take_token() is cancelled.
+    """
+
+    def __init__(self, path, name, rate, burst=1, concurrency=None):
+        super().__init__(rate, burst, concurrency)
+        self.name = name
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"rate-limit-{name}")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS token_buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)",
+            (name, float(self.burst), time.time())
+        )
+
+    def _try_take(self):
+        """Takes one token if available. Returns 0, or the seconds to wait before trying again."""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated = conn.execute("SELECT tokens, updated FROM token_buckets WHERE name = ?", (self.name,)).fetchone()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute("UPDATE token_buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, self.name))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def take_token(self):
+        if self.rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                wait = await loop.run_in_executor(self._executor, self._try_take)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
@@ -0,0 +1,72 @@
+# tools/web_scan/rescan_scheduler.py
+import datetime
+import heapq
+import math
+
+# น้ำหนักตามผลครั้งก่อน: URL ที่ยังไม่มีผลชัดเจนควรตรวจก่อน, URL ที่เป็น DANGER อยู่แล้วถูกบล็อกอยู่แล้ว
+DEFAULT_STATUS_WEIGHTS = {
+    "DANGER": 0.25,
+    "SAFE": 1.0,
+    None: 2.0,  # ไม่เคยมีผล หรือผลไม่ชัดเจน
+}
+
+
+def rescan_priority(clicks, age_hours, status, status_weights=None):
+    """
+    Higher is more urgent: grows with the log of clicks (a link with 10x the
+    clicks counts about one step more), linearly with hours since the last
+    scan, and is scaled by the weight of the previous result.
+    """
+    weights = status_weights or DEFAULT_STATUS_WEIGHTS
+    weight = weights.get(status, weights.get(None, 1.0))
+    return (1 + math.log10(1 + max(clicks or 0, 0))) * age_hours * weight
+
+
+class RescanScheduler:
+    """
+    Picks the URLs to rescan in the next round.
+
+    Candidates are (url, clicks, status, last_scan) rows, where last_scan is
+    the newest scan_records.timestamp of the URL or None if it was never
+    scanned. URLs scanned less than `min_age_hours` ago are skipped, and a
+    bounded min-heap keeps the `budget` most urgent ones, so memory stays
+    O(budget) however many rows are read.
+    """
+
+    def __init__(self, budget, min_age_hours=24, max_age_hours=24 * 30, status_weights=None):
+        self.budget = budget
+        self.min_age_hours = min_age_hours
+        self.max_age_hours = max_age_hours  # URL ที่ไม่เคย scan นับอายุเท่านี้
+        self.status_weights = status_weights
+
+    def select(self, candidates, now=None):
+        """Returns up to `budget` URLs, most urgent first."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        heap = []
+        for candidate in candidates:
+            self._offer(heap, candidate, now)
+        return [url for _, url in sorted(heap, reverse=True)]
+
+    async def aselect(self, candidates, now=None):
+        """select() over an async iterable of candidates."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        heap = []
+        async for candidate in candidates:
+            self._offer(heap, candidate, now)
+        return [url for _, url in sorted(heap, reverse=True)]
+
+    def _offer(self, heap, candidate, now):
+        url, clicks, status, last_scan = candidate
+        if last_scan is None:
+            age_hours = self.max_age_hours
+        else:
+            if last_scan.tzinfo is None:
+                last_scan = last_scan.replace(tzinfo=datetime.timezone.utc)  # SQLite เก็บเวลา UTC แบบไม่มี timezone
+            age_hours = min((now - last_scan).total_seconds() / 3600, self.max_age_hours)
+            if age_hours < self.min_age_hours:
+                return
+        entry = (rescan_priority(clicks, age_hours, status, self.status_weights), url)
+        if len(heap) < self.budget:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
@@ -0,0 +1,87 @@
+# tools/web_scan/scan_store.py
+from sqlalchemy import func, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+# จำนวน row ต่อหนึ่ง INSERT (SQLite รุ่นเก่าจำกัด bound parameter ไว้ที่ 999)
+UPSERT_CHUNK_SIZE = 150
+
+SCAN_RECORDS_UNIQUE_INDEX = "uq_scan_records_url_scan_type"
+
+
+def _insert(dialect_name):
+    if dialect_name == "postgresql":
+        return postgresql.insert
+    if dialect_name == "sqlite":
+        return sqlite.insert
+    raise ValueError(f"upsert_scan_records() does not support {dialect_name}")
+
+
+def _on_conflict_update(stmt, table, with_scan_id):
+    update = {"result": stmt.excluded.result, "timestamp": func.now()}
+    if with_scan_id:
+        update["scan_id"] = func.coalesce(stmt.excluded.scan_id, table.c.scan_id)
+    return stmt.on_conflict_do_update(index_elements=["url", "scan_type"], set_=update)
+
+
+def upsert_scan_records(engine, table, rows, chunk_size=UPSERT_CHUNK_SIZE):
+    """
+    Writes scan results with INSERT ... ON CONFLICT (url, scan_type) DO UPDATE.
+
+    rows is a list of dicts with the same keys (url, scan_type, result and
+    optionally scan_id). All chunks are written in one transaction. A NULL
+    scan_id never overwrites a stored one.
+    """
+    if not rows:
+        return 0
+    insert = _insert(engine.dialect.name)
+    with engine.begin() as conn:
+        for i in range(0, len(rows), chunk_size):
+            conn.execute(_on_conflict_update(insert(table).values(rows[i:i + chunk_size]), table, "scan_id" in rows[0]))
+    return len(rows)
+
+
+async def aupsert_scan_records(engine, table, rows):
+    """
+    upsert_scan_records() through an AsyncEngine (asyncpg, aiosqlite).
+
+    Sends one statement with many parameter sets instead of multi-row
+    VALUES: the statement is compiled once and cached, where compiling a
+    500-row VALUES list costs tens of milliseconds of event loop time.
+    """
+    if not rows:
+        return 0
+    stmt = _on_conflict_update(_insert(engine.dialect.name)(table), table, "scan_id" in rows[0])
+    async with engine.begin() as conn:
+        await conn.execute(stmt, rows)
+    return len(rows)
+
+
+def ensure_scan_records_unique_index(engine):
+    """
+    Adds the (url, scan_type) unique index to a scan_records table created
+    before it existed, keeping only the newest row of each duplicate pair.
+    """
+    if any(index["name"] == SCAN_RECORDS_UNIQUE_INDEX for index in inspect(engine).get_indexes("scan_records")):
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            DELETE FROM scan_records
+            WHERE id NOT IN (SELECT MAX(id) FROM scan_records GROUP BY url, scan_type)
+        """))
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {SCAN_RECORDS_UNIQUE_INDEX} ON scan_records (url, scan_type)"
+        ))
+
+
+def ensure_columns(engine, table_name, columns):
+    """
+    Adds columns missing from a table created by an older version of the
+    model. columns maps column name to its DDL type, e.g. {"claimed_at": "FLOAT"}.
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns(table_name)}
+    missing = {name: ddl_type for name, ddl_type in columns.items() if name not in existing}
+    if not missing:
+        return
+    with engine.begin() as conn:
+        for name, ddl_type in missing.items():
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl_type}"))
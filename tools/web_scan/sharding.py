@@ -0,0 +1,73 @@
+# tools/web_scan/sharding.py
+import hashlib
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from canonical import canonicalize_url
+
+
+def shard_of(url, shards):
+    """Stable shard number of a URL: the same canonical URL always maps to the same shard, in every process."""
+    if shards <= 1:
+        return 0
+    digest = hashlib.blake2b(canonicalize_url(url).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def supervise(script, workers, restart_delay=5, stop_timeout=30):
+    """
+    Runs `workers` copies of `script`, one per shard, and restarts any that
+    exits with an error. Each child gets SCANNER_SHARD, SCANNER_SHARDS and a
+    shared SCANNER_RATE_LIMIT_DB in its environment. Returns when all
+    children have exited cleanly or on Ctrl+C / SIGTERM, which is passed on;
+    children still running `stop_timeout` seconds later are killed.
+    """
+    rate_limit_dir = tempfile.mkdtemp(prefix="scanner-")
+    rate_limit_db = os.path.join(rate_limit_dir, "rate_limits.db")
+
+    def start(shard):
+        env = dict(os.environ, SCANNER_SHARD=str(shard), SCANNER_SHARDS=str(workers), SCANNER_RATE_LIMIT_DB=rate_limit_db)
+        print(f"supervise(), Starting scanner shard {shard}/{workers}")
+        return subprocess.Popen([sys.executable, script], env=env)
+
+    children = {shard: start(shard) for shard in range(workers)}
+
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    try:
+        while children:
+            time.sleep(1)
+            for shard, child in list(children.items()):
+                code = child.poll()
+                if code is None:
+                    continue
+                if code == 0:
+                    del children[shard]
+                    continue
+                print(f"supervise(), Scanner shard {shard} exited with {code}, restarting in {restart_delay}s")
+                time.sleep(restart_delay)
+                children[shard] = start(shard)
+    except KeyboardInterrupt:
+        for child in children.values():
+            if child.poll() is None:
+                child.send_signal(signal.SIGINT)
+        for shard, child in children.items():
+            try:
+                child.wait(stop_timeout)
+            except subprocess.TimeoutExpired:
+                print(f"supervise(), Scanner shard {shard} did not stop in {stop_timeout}s, killing it")  # เช่น thread ของ Web Risk ที่ยังค้างอยู่
+                child.kill()
+                child.wait()
+    finally:
+        try:
+            for name in os.listdir(rate_limit_dir):
+                os.remove(os.path.join(rate_limit_dir, name))
+            os.rmdir(rate_limit_dir)
+        except OSError:
+            pass
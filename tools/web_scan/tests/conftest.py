@@ -0,0 +1,62 @@
+# tools/web_scan/tests/conftest.py
+"""
+Shared fixtures: check_urls imported once against temporary SQLite databases.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+WEB_SCAN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, WEB_SCAN_DIR)
+
+
+@pytest.fixture(scope="session")
+def check_urls(tmp_path_factory):
+    # check_urls อ่าน setting และสร้าง engine ตอน import จึงต้องกำหนด environment ก่อน import ครั้งแรก
+    data_dir = tmp_path_factory.mktemp("web_scan")
+    os.environ.update(
+        DATABASE_PATH=f"sqlite:///{data_dir}/shortener.db",
+        BLACKLIST_DATABASE_PATH=f"sqlite:///{data_dir}/blacklist.db",
+        METRICS_PORT="0",
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        import check_urls
+    check_urls.init_databases()
+    return check_urls
+
+
+@pytest.fixture
+def scanner(check_urls, monkeypatch):
+    """check_urls with empty tables and no provider reached over the network."""
+    with check_urls.engine_shortener.begin() as conn:
+        for table in (check_urls.URLsToCheck, check_urls.scan_records, check_urls.URL):
+            conn.execute(table.__table__.delete())
+    monkeypatch.setattr(check_urls.verdict_cache, "caches", lambda provider: False)
+    monkeypatch.setattr(check_urls, "host_reputation", check_urls.HostReputation(min_danger=check_urls.HOST_REPUTATION_MIN_DANGER))
+    for name in ("check_blacklist", "check_phishtank", "check_google_web_risk", "check_virustotal", "check_urlhaus"):
+        monkeypatch.setattr(check_urls, name, _unexpected(name))
+    yield check_urls
+
+
+def _unexpected(name):
+    async def check(*args):
+        raise AssertionError(f"{name} was not stubbed by the test")
+    return check
+
+
+@pytest.fixture
+def run(check_urls):
+    """Runs a coroutine in a new event loop and closes the async engines' connections before the loop ends."""
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await check_urls.close_databases()
+        with contextlib.redirect_stdout(io.StringIO()):
+            return asyncio.run(main())
+    return run
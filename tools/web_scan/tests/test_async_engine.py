@@ -0,0 +1,30 @@
+# tools/web_scan/tests/test_async_engine.py
+"""
+create_async_database_engine on SQLite files and in-memory databases.
+
+    python -m pytest tools/web_scan/tests
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+
+@pytest.mark.parametrize("database_url, pool", [
+    ("sqlite:///:memory:", "StaticPool"),
+    ("sqlite://", "StaticPool"),
+    ("sqlite:///file:scan?mode=memory&uri=true", "StaticPool"),
+    ("sqlite:///{tmp_path}/shortener.db", "AsyncAdaptedQueuePool"),
+])
+def test_sqlite_engine(check_urls, tmp_path, database_url, pool):
+    # StaticPool ไม่รับ pool_size/max_overflow จึงต้องไม่ส่งไปให้ฐานข้อมูลในหน่วยความจำ
+    engine = check_urls.create_async_database_engine(database_url.format(tmp_path=tmp_path), pool_size=1, max_overflow=1)
+    assert type(engine.pool).__name__ == pool
+
+    async def select_one():
+        try:
+            async with engine.connect() as conn:
+                return (await conn.execute(text("SELECT 1"))).scalar()
+        finally:
+            await engine.dispose()
+    assert asyncio.run(select_one()) == 1
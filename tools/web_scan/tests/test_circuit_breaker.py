@@ -0,0 +1,142 @@
+# tools/web_scan/tests/test_circuit_breaker.py
+"""
+CircuitBreaker: state changes, which errors open the circuit, and the adaptive timeout.
+
+    python -m pytest tools/web_scan/tests
+"""
+import asyncio
+import json
+import os
+import sys
+
+import aiohttp
+import pytest
+
+WEB_SCAN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, WEB_SCAN_DIR)
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, ProviderUnavailable, is_outage
+
+
+class ApiError(Exception):
+    """Stands in for a google.api_core exception, which carries the HTTP status as `code`."""
+
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def response_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status, message="stand-in")
+
+
+def fail(breaker, exc):
+    async def request():
+        async with breaker.guard():
+            raise exc
+    return asyncio.run(request())
+
+
+@pytest.mark.parametrize("exc", [
+    response_error(404), response_error(403), ApiError(400), ApiError(403),
+    KeyError("data"), json.JSONDecodeError("Expecting value", "", 0),
+])
+def test_answer_does_not_open_circuit(exc):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    for _ in range(5):
+        # ส่งต่อ exception เดิมให้ผู้เรียกตอบ INCONCLUSIVE ไม่ห่อเป็น ProviderUnavailable
+        with pytest.raises(type(exc)) as raised:
+            fail(breaker, exc)
+        assert not isinstance(raised.value, ProviderUnavailable)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    assert breaker.opened == 0
+
+
+@pytest.mark.parametrize("exc", [
+    response_error(503), response_error(429), ApiError(429), ApiError(504),
+    asyncio.TimeoutError(), aiohttp.ServerDisconnectedError(), ConnectionResetError(),
+    ProviderUnavailable("status 500"),
+])
+def test_outage_opens_circuit(exc):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    assert is_outage(exc)
+    for _ in range(2):
+        with pytest.raises(ProviderUnavailable):
+            fail(breaker, exc)
+    assert breaker.state == OPEN
+    assert breaker.opened == 1
+
+
+def succeed(breaker):
+    async def request():
+        async with breaker.guard():
+            pass
+    asyncio.run(request())
+
+
+def reset_elapsed(breaker):
+    breaker.opened_at -= breaker.reset_seconds  # เหมือนเวลาผ่านไป reset_seconds โดยไม่ต้อง sleep
+
+
+def test_closed_open_half_open_closed():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=60)
+    for _ in range(2):
+        with pytest.raises(ProviderUnavailable):
+            fail(breaker, asyncio.TimeoutError())
+    assert breaker.state == CLOSED
+    succeed(breaker)  # สำเร็จแล้วนับความล้มเหลวติดกันใหม่
+    assert breaker.failures == 0
+
+    for _ in range(3):
+        with pytest.raises(ProviderUnavailable):
+            fail(breaker, asyncio.TimeoutError())
+    assert breaker.state == OPEN
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError):
+        succeed(breaker)
+    assert breaker.rejected == 1
+
+    reset_elapsed(breaker)
+    assert breaker.available()
+    succeed(breaker)  # probe ของ half-open สำเร็จ
+    assert breaker.state == CLOSED
+    assert breaker.opened == 1
+
+
+def test_failed_probe_opens_again():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=60)
+    with pytest.raises(ProviderUnavailable):
+        fail(breaker, response_error(503))
+    reset_elapsed(breaker)
+
+    async def probes():
+        started = asyncio.Event()
+
+        async def probe():
+            async with breaker.guard():
+                started.set()
+                await asyncio.sleep(0.01)
+                raise ProviderUnavailable("status 503")
+        task = asyncio.ensure_future(probe())
+        await started.wait()
+        assert breaker.state == HALF_OPEN
+        # ระหว่าง half-open ส่งได้แค่ half_open_calls probe
+        with pytest.raises(CircuitOpenError):
+            async with breaker.guard():
+                pass
+        with pytest.raises(ProviderUnavailable):
+            await task
+    asyncio.run(probes())
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+
+
+def test_timeout_follows_latency():
+    breaker = CircuitBreaker("test", percentile=0.5, multiplier=3, min_timeout=2, max_timeout=30, min_samples=5)
+    assert breaker.timeout() == 30  # ยังมีตัวอย่างไม่พอ
+    for latency in (1, 1, 1, 2, 2):
+        breaker.record_success(latency)
+    assert breaker.timeout() == 3
+    for latency in (0.1,) * 10:
+        breaker.record_success(latency)
+    assert breaker.timeout() == 2  # ไม่ต่ำกว่า min_timeout
@@ -0,0 +1,50 @@
+# tools/web_scan/tests/test_expressions.py
+"""
+expressions_for() against ExpressionGenerator(url).Expressions(), which it
+must match URL for URL.
+
+    python -m pytest tools/web_scan/tests
+"""
+import os
+import sys
+
+import pytest
+
+WEB_SCAN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, WEB_SCAN_DIR)
+from canonical import ExpressionGenerator, UrlParseError, expressions_for
+
+URLS = [
+    "http://a.b.c/1/2.html?param=1",
+    "http://a.b.c.d.e.f.g/1.html",
+    "http://1.2.3.4/1/",
+    "http://example.co.uk/",
+    "HTTP://WWW.Example.COM/%7Euser/../index.html#top",
+    "http://www.example.com/a/b/c/d/e/f/g/h?x=1&y=2",
+    "https://login.example.com:8443/path//to/./page",
+    "http://example.com/%25%32%35",
+    "http://ตัวอย่าง.test/หน้า",
+    "example.com/no-scheme",
+    "ftp://example.com/file",
+    "http://localhost/",
+    "http://[::1/",
+    "",
+]
+
+
+def generator_expressions(url):
+    try:
+        return [expression.Value() for expression in ExpressionGenerator(url).Expressions()]
+    except (UrlParseError, ValueError):
+        return []
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_matches_expression_generator(url):
+    assert dict(expressions_for([url])) == {url: generator_expressions(url)}
+
+
+def test_batch_with_shared_hosts():
+    # host expressions ถูกคำนวณครั้งเดียวต่อ host และใช้ซ้ำ ผลต้องเหมือนตรวจทีละ URL
+    urls = URLS + [f"http://a.b.c/page/{i}?q={i}" for i in range(20)] + URLS
+    assert [expressions for _, expressions in expressions_for(urls)] == [generator_expressions(url) for url in urls]
@@ -0,0 +1,93 @@
+# tools/web_scan/tests/test_host_reputation.py
+"""
+HostReputation: URLs on a host already found dangerous skip the remote providers.
+
+    python -m pytest tools/web_scan/tests
+"""
+import collections
+
+import pytest
+
+from host_reputation import HostReputation
+
+REMOTE = ("check_urlhaus", "check_google_web_risk", "check_virustotal")
+LOCAL = ("check_blacklist", "check_phishtank")
+
+
+@pytest.fixture
+def calls(scanner):
+    """Counts provider calls; Web Risk says DANGER for evil.test, everything else SAFE."""
+    calls = collections.Counter()
+
+    def stub(name):
+        async def check(url, *args):
+            calls[name] += 1
+            return name == "check_google_web_risk" and "evil.test" in url
+        return check
+    for name in REMOTE + LOCAL:
+        setattr(scanner, name, stub(name))
+    return calls
+
+
+def scan_all(scanner, run, urls):
+    async def main():
+        for url in urls:
+            await scanner.check_url(url, None)
+        await scanner.scan_result_writer.flush()
+    run(main())
+
+
+def remote_calls(calls):
+    return sum(calls[name] for name in REMOTE)
+
+
+def scan_results(scanner, url):
+    with scanner.engine_shortener.connect() as conn:
+        rows = conn.execute(
+            scanner.scan_records.__table__.select().where(scanner.scan_records.url == url)
+        ).mappings().all()
+    return {row["scan_type"]: row["result"] for row in rows}
+
+
+CAMPAIGN = [f"http://evil.test/login/{i}" for i in range(10)]
+
+
+def test_campaign_costs_fewer_remote_calls(scanner, run, calls, monkeypatch):
+    monkeypatch.setattr(scanner, "host_reputation", HostReputation(min_danger=0))  # ปิด
+    scan_all(scanner, run, CAMPAIGN)
+    without = remote_calls(calls)
+    assert calls["check_google_web_risk"] == len(CAMPAIGN)
+
+    calls.clear()
+    monkeypatch.setattr(scanner, "host_reputation", HostReputation(min_danger=2))
+    scan_all(scanner, run, CAMPAIGN)
+    # สอง URL แรกเรียก provider ภายนอกตามปกติ URL ที่เหลือตอบจากผลระดับ host
+    assert calls["check_google_web_risk"] == 2
+    assert remote_calls(calls) < without / 4
+    assert calls["check_blacklist"] >= len(CAMPAIGN)  # provider ในเครื่องยังตรวจ path ของทุก URL
+    assert scanner.host_reputation.answered == len(CAMPAIGN) - 2
+    assert scan_results(scanner, CAMPAIGN[-1])["Host reputation"] == "DANGER"
+
+
+def test_host_with_a_safe_url_is_checked_per_url(scanner, run, calls):
+    # URL ที่ปลอดภัยบน host เดียวกันแปลว่าเป็น host ที่ใช้ร่วมกัน ไม่ใช้ผลระดับ host
+    scan_all(scanner, run, ["http://shared.test/home"])
+    scan_all(scanner, run, [f"http://shared.test/evil.test/{i}" for i in range(5)])
+    assert calls["check_google_web_risk"] == 6
+    assert scanner.host_reputation.answered == 0
+
+
+def test_root_listed_locally(scanner, run, calls):
+    async def blacklist(url):
+        calls["check_blacklist"] += 1
+        return url == "http://listed.test/"
+    scanner.check_blacklist = blacklist
+
+    scan_all(scanner, run, ["http://listed.test/a", "http://listed.test/b"])
+    assert remote_calls(calls) == 0
+    assert scan_results(scanner, "http://listed.test/a")["Host reputation"] == "DANGER"
+
+
+def test_other_hosts_are_not_affected(scanner, run, calls):
+    scan_all(scanner, run, CAMPAIGN[:3] + ["http://good.test/evil.test"])
+    assert "Host reputation" not in scan_results(scanner, "http://good.test/evil.test")
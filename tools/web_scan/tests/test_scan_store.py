@@ -0,0 +1,44 @@
+# tools/web_scan/tests/test_scan_store.py
+"""
+upsert_scan_records()/aupsert_scan_records(): one scan_records row per (url, scan_type).
+
+    python -m pytest tools/web_scan/tests
+"""
+from scan_store import aupsert_scan_records, upsert_scan_records
+
+
+def stored(scanner):
+    with scanner.engine_shortener.connect() as conn:
+        rows = conn.execute(scanner.scan_records.__table__.select()).mappings().all()
+    return sorted((row["url"], row["scan_type"], row["result"], row["scan_id"]) for row in rows)
+
+
+def test_upsert_keeps_one_row_per_url_and_scan_type(scanner):
+    table = scanner.scan_records.__table__
+    upsert_scan_records(scanner.engine_shortener, table, [
+        {"url": "http://a.test/", "scan_type": "VirusTotal", "result": "SAFE", "scan_id": "analysis-1"},
+        {"url": "http://a.test/", "scan_type": "URLhaus", "result": "SAFE", "scan_id": None},
+    ])
+    upsert_scan_records(scanner.engine_shortener, table, [
+        {"url": "http://a.test/", "scan_type": "VirusTotal", "result": "DANGER", "scan_id": None},
+        {"url": "http://b.test/", "scan_type": "VirusTotal", "result": "SAFE", "scan_id": None},
+    ])
+    assert stored(scanner) == [
+        ("http://a.test/", "URLhaus", "SAFE", None),
+        # scan_id ที่เป็น NULL ไม่เขียนทับ scan_id เดิม
+        ("http://a.test/", "VirusTotal", "DANGER", "analysis-1"),
+        ("http://b.test/", "VirusTotal", "SAFE", None),
+    ]
+
+
+def test_async_upsert_matches_sync_upsert(scanner, run):
+    table = scanner.scan_records.__table__
+    rows = [{"url": f"http://site{i}.test/", "scan_type": "Google Web Risk", "result": "SAFE", "scan_id": None} for i in range(3)]
+    run(aupsert_scan_records(scanner.async_engine_shortener, table, rows))
+    run(aupsert_scan_records(scanner.async_engine_shortener, table, [dict(rows[0], result="DANGER")]))
+    assert stored(scanner) == [
+        ("http://site0.test/", "Google Web Risk", "DANGER", None),
+        ("http://site1.test/", "Google Web Risk", "SAFE", None),
+        ("http://site2.test/", "Google Web Risk", "SAFE", None),
+    ]
+
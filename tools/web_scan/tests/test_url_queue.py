@@ -0,0 +1,155 @@
+# tools/web_scan/tests/test_url_queue.py
+"""
+urls_to_check as a work queue on SQLite: leases, shards, and rescans of
+URLs whose providers are unavailable.
+
+    python -m pytest tools/web_scan/tests
+"""
+import time
+
+from circuit_breaker import ProviderUnavailable
+from sharding import shard_of
+
+URL = "http://example.test/page"
+
+
+def stub_providers(scanner, **results):
+    """Every provider answers SAFE unless given a result; an exception is raised."""
+    for name in ("check_blacklist", "check_phishtank", "check_google_web_risk", "check_virustotal", "check_urlhaus"):
+        result = results.get(name, False)
+
+        async def check(*args, result=result):
+            if isinstance(result, Exception):
+                raise result
+            return result
+        setattr(scanner, name, check)
+
+
+def queued_rows(scanner):
+    with scanner.engine_shortener.connect() as conn:
+        return conn.execute(scanner.URLsToCheck.__table__.select()).mappings().all()
+
+
+def scan_results(scanner):
+    with scanner.engine_shortener.connect() as conn:
+        rows = conn.execute(scanner.scan_records.__table__.select()).mappings().all()
+    return {row["scan_type"]: row["result"] for row in rows}
+
+
+def scan(scanner, run, attempts):
+    async def main():
+        await scanner.check_url(URL, None, attempts=attempts)
+        await scanner.scan_result_writer.flush()
+    run(main())
+
+
+def test_unavailable_provider_is_rescanned_with_attempt_count(scanner, run, monkeypatch):
+    monkeypatch.setattr(scanner, "RESCAN_MAX_ATTEMPTS", 3)
+    stub_providers(scanner, check_google_web_risk=ProviderUnavailable("status 503"))
+
+    scan(scanner, run, attempts=0)
+    rows = queued_rows(scanner)
+    assert [(row["url"], row["claim_token"], row["attempts"]) for row in rows] == [(URL, "rescan", 1)]
+    assert "Google Web Risk" not in scan_results(scanner)
+
+    # row ของ rescan ถูก claim ได้เมื่อ lease หมดอายุ และบอกจำนวนครั้งที่ scan ใหม่ไปแล้ว
+    attempts = {}
+    claims = run(scanner.claim_urls(lease_seconds=-scanner.RESCAN_DELAY_SECONDS - 1, attempts=attempts))
+    assert claims == {URL: [rows[0]["id"]]}
+    assert attempts == {URL: 1}
+
+
+def test_rescans_stop_at_the_cap(scanner, run, monkeypatch):
+    monkeypatch.setattr(scanner, "RESCAN_MAX_ATTEMPTS", 3)
+    stub_providers(scanner, check_google_web_risk=ProviderUnavailable("status 503"))
+
+    scan(scanner, run, attempts=3)
+    assert queued_rows(scanner) == []
+    assert scan_results(scanner)["Google Web Risk"] == "INCONCLUSIVE"
+
+
+def test_answer_other_than_outage_is_not_rescanned(scanner, run):
+    # 4xx หรือผลที่อ่านไม่ได้ ได้ INCONCLUSIVE ทันที ไม่นัด scan ใหม่
+    stub_providers(scanner, check_google_web_risk=None)
+
+    scan(scanner, run, attempts=0)
+    assert queued_rows(scanner) == []
+    assert scan_results(scanner)["Google Web Risk"] == "INCONCLUSIVE"
+
+
+def queue(scanner, urls):
+    with scanner.engine_shortener.begin() as conn:
+        conn.execute(scanner.URLsToCheck.__table__.insert(), [{"url": url} for url in urls])
+
+
+def leases(scanner):
+    return {row["id"]: (row["claim_token"], row["claimed_at"]) for row in queued_rows(scanner)}
+
+
+def test_claim_takes_each_row_once(scanner, run):
+    urls = [f"http://site{i}.test/" for i in range(5)]
+    queue(scanner, urls)
+
+    first = run(scanner.claim_urls(limit=3))
+    second = run(scanner.claim_urls(limit=3))
+    assert list(first) == urls[:3]
+    assert list(second) == urls[3:]
+    assert run(scanner.claim_urls(limit=3)) == {}
+    assert {token for token, _ in leases(scanner).values()} == {scanner.CLAIM_TOKEN}
+
+
+def test_lease_expires_and_is_claimed_by_another_scanner(scanner, run, monkeypatch):
+    queue(scanner, ["http://a.test/"])
+    claims = run(scanner.claim_urls())
+    assert claims
+
+    monkeypatch.setattr(scanner, "CLAIM_TOKEN", "other-scanner")
+    assert run(scanner.claim_urls(lease_seconds=60)) == {}  # lease ยังไม่หมดอายุ
+
+    # process แรกล้มไป lease หมดอายุแล้ว scanner อื่น claim ไป scan ใหม่ได้
+    time.sleep(0.01)
+    assert run(scanner.claim_urls(lease_seconds=0.001)) == claims
+    assert [token for token, _ in leases(scanner).values()] == ["other-scanner"]
+
+
+def test_renew_only_extends_own_leases(scanner, run, monkeypatch):
+    queue(scanner, ["http://a.test/", "http://b.test/"])
+    own = run(scanner.claim_urls(limit=1))
+    monkeypatch.setattr(scanner, "CLAIM_TOKEN", "other-scanner")
+    other = run(scanner.claim_urls(limit=1))
+    before = leases(scanner)
+
+    time.sleep(0.01)
+    assert run(scanner.renew_claims(own["http://a.test/"] + other["http://b.test/"]))
+    after = leases(scanner)
+    assert after[other["http://b.test/"][0]][1] > before[other["http://b.test/"][0]][1]
+    assert after[own["http://a.test/"][0]] == before[own["http://a.test/"][0]]  # row ของ scanner อื่นไม่ถูกต่อ
+
+
+def test_complete_deletes_claimed_rows(scanner, run):
+    queue(scanner, ["http://a.test/", "http://b.test/"])
+    claims = run(scanner.claim_urls(limit=1))
+    assert run(scanner.complete_claims(claims["http://a.test/"]))
+    assert [row["url"] for row in queued_rows(scanner)] == ["http://b.test/"]
+
+
+def test_shard_claims_only_its_own_urls(scanner, run, monkeypatch):
+    urls = [f"http://site{i}.test/page" for i in range(40)]
+    queue(scanner, urls)
+    monkeypatch.setattr(scanner, "SCANNER_SHARDS", 3)
+    monkeypatch.setattr(scanner, "SCANNER_SHARD", 1)
+
+    claims = run(scanner.claim_urls(limit=100))
+    expected = [url for url in urls if shard_of(url, 3) == 1]
+    assert 0 < len(expected) < len(urls)
+    assert sorted(claims) == sorted(expected)
+    # assign_shards() กำหนด shard ให้ทุก row ที่ trigger เพิ่มเข้ามา รวมถึง row ของ shard อื่น
+    assert all((row["shard"], row["shard_count"]) == (shard_of(row["url"], 3), 3) for row in queued_rows(scanner))
+
+
+def test_shard_of_is_stable_and_canonical():
+    assert shard_of("http://a.test/x", 1) == 0
+    assert {shard_of("http://a.test/x", 8) for _ in range(3)} == {shard_of("http://a.test/x", 8)}
+    # URL ที่เขียนต่างกันแต่ canonical เดียวกันอยู่ใน shard เดียวกัน
+    assert shard_of("HTTP://A.TEST/x#frag", 8) == shard_of("http://a.test/x", 8)
+    assert len({shard_of(f"http://site{i}.test/", 4) for i in range(100)}) == 4
@@ -0,0 +1,91 @@
+# tools/web_scan/tests/test_virustotal_pending.py
+"""
+A URL whose VirusTotal analysis is still pending stays unchecked until the
+poller writes the verdict, so a restart scans it again instead of losing it.
+
+    python -m pytest tools/web_scan/tests
+"""
+import pytest
+
+URL = "http://example.test/download"
+ANALYSIS_ID = "u-0123456789-1700000000"
+
+
+@pytest.fixture
+def poller(scanner, monkeypatch):
+    poller = scanner.VirusTotalPoller(max_attempts=2)
+    monkeypatch.setattr(scanner, "virustotal_poller", poller)
+    return poller
+
+
+def add_short_url(scanner):
+    with scanner.engine_shortener.begin() as conn:
+        conn.execute(scanner.URL.__table__.insert(), [
+            {"key": "k1", "secret_key": "s1", "target_url": URL, "is_checked": False, "is_active": True, "clicks": 0}
+        ])
+
+
+def short_url(scanner):
+    with scanner.engine_shortener.connect() as conn:
+        return conn.execute(scanner.URL.__table__.select()).mappings().one()
+
+
+def stub_providers(scanner, poller):
+    async def safe(*args):
+        return False
+
+    async def submit(url, session):
+        poller.add(ANALYSIS_ID, url)
+        return scanner.PENDING
+    for name in ("check_blacklist", "check_phishtank", "check_google_web_risk", "check_urlhaus"):
+        setattr(scanner, name, safe)
+    scanner.check_virustotal = submit
+
+
+def scan(scanner, run):
+    async def main():
+        await scanner.check_url(URL, None)
+        await scanner.scan_result_writer.flush()
+        return await scanner.get_new_urls_from_database()
+    return run(main())
+
+
+def test_pending_url_stays_unchecked_until_completed(scanner, run, poller):
+    add_short_url(scanner)
+    stub_providers(scanner, poller)
+
+    # process ล้มตอนนี้ URL ยังอยู่ในรายการที่ periodic_full_check จะ scan ใหม่
+    assert scan(scanner, run) == [URL]
+    assert poller.is_pending(URL)
+    assert not short_url(scanner)["is_checked"]
+
+    async def complete():
+        scanner.save_virustotal_result(URL, False, ANALYSIS_ID, safe=True)
+        await scanner.scan_result_writer.flush()
+    run(complete())
+    row = short_url(scanner)
+    assert row["is_checked"]
+    assert row["status"] == "SAFE"
+
+
+def test_given_up_analysis_is_recorded_as_inconclusive(scanner, run, poller):
+    add_short_url(scanner)
+    stub_providers(scanner, poller)
+    scan(scanner, run)
+
+    async def fetch(session, analysis_id):
+        return {"data": {"attributes": {"status": "queued"}}}
+    poller._fetch = fetch
+
+    async def sweep():
+        for _ in range(poller.max_attempts):
+            await poller.poll(None)
+        await scanner.scan_result_writer.flush()
+    run(sweep())
+    assert not poller.pending
+    assert short_url(scanner)["is_checked"]
+    with scanner.engine_shortener.connect() as conn:
+        result = conn.execute(
+            scanner.scan_records.__table__.select().where(scanner.scan_records.scan_type == "VirusTotal")
+        ).mappings().one()
+    assert (result["result"], result["scan_id"]) == ("INCONCLUSIVE", ANALYSIS_ID)
@@ -0,0 +1,98 @@
+# tools/web_scan/tests/test_webrisk_mirror.py
+"""
+WebRiskMirror against the Update API stand-in of benchmarks/webrisk_stand_in.py,
+through the real WebRiskServiceClient (REST transport).
+
+    python -m pytest tools/web_scan/tests
+"""
+import os
+import sys
+
+import pytest
+
+WEB_SCAN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, WEB_SCAN_DIR)
+sys.path.insert(0, os.path.join(WEB_SCAN_DIR, 'benchmarks'))
+from webrisk_mirror import WebRiskMirror
+from webrisk_stand_in import WebRiskStandIn
+
+
+@pytest.fixture
+def stand_in():
+    server = WebRiskStandIn()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mirror_path(tmp_path):
+    return str(tmp_path / "webrisk_mirror.json")
+
+
+def test_reset_then_incremental_diff(stand_in, mirror_path):
+    stand_in.publish("MALWARE", ["evil.test/", "bad.test/download/"])
+    stand_in.publish("SOCIAL_ENGINEERING", ["phish.test/login"])
+    mirror = WebRiskMirror(stand_in.client(), path=mirror_path)
+    assert not mirror.ready
+
+    assert mirror.update() == 3
+    assert stand_in.responses == [("MALWARE", "RESET"), ("SOCIAL_ENGINEERING", "RESET")]
+    assert mirror.ready
+    assert mirror.next_update > 0
+    assert mirror.lookup("http://evil.test/any/page?x=1") is True
+    assert mirror.lookup("http://bad.test/download/") is True
+    assert mirror.lookup("http://phish.test/login") is True
+    assert mirror.lookup("http://good.test/") is False
+
+    stand_in.publish("MALWARE", ["evil.test/", "new.test/"])
+    assert mirror.update() == 3
+    assert stand_in.responses[2:] == [("MALWARE", "DIFF"), ("SOCIAL_ENGINEERING", "DIFF")]
+    assert mirror.lookup("http://new.test/") is True
+    assert mirror.lookup("http://bad.test/download/") is False
+    assert mirror.lookup("http://evil.test/") is True
+
+    # shard อื่นอ่านไฟล์ที่ update() บันทึกไว้ และขอ diff ต่อจาก version เดียวกัน
+    reloaded = WebRiskMirror(stand_in.client(), path=mirror_path)
+    assert reloaded.ready
+    assert reloaded.lookup("http://new.test/") is True
+    assert reloaded.lookup("http://bad.test/download/") is False
+    reloaded.update()
+    assert stand_in.responses[4:] == [("MALWARE", "DIFF"), ("SOCIAL_ENGINEERING", "DIFF")]
+
+
+def test_checksum_mismatch_drops_the_list_and_resets(stand_in, mirror_path):
+    stand_in.publish("MALWARE", ["evil.test/"])
+    mirror = WebRiskMirror(stand_in.client(), threat_types=("MALWARE", ), path=mirror_path)
+    mirror.update()
+    assert mirror.lookup("http://evil.test/") is True
+
+    stand_in.publish("MALWARE", ["evil.test/", "new.test/"])
+    stand_in.corrupt_next_checksum("MALWARE")
+    assert mirror.update() == 0
+    assert not mirror.ready
+    assert mirror.lookup("http://evil.test/") is False
+
+    # รอบถัดไปไม่มี version token จึงได้ RESET และ list ที่ถูกต้อง
+    assert mirror.update() == 2
+    assert stand_in.responses == [("MALWARE", "RESET"), ("MALWARE", "DIFF"), ("MALWARE", "RESET")]
+    assert mirror.ready
+    assert mirror.lookup("http://new.test/") is True
+    assert mirror.lookup("http://evil.test/") is True
+
+
+def test_search_hashes_confirms_only_listed_full_hashes(stand_in, mirror_path):
+    stand_in.publish("MALWARE", ["evil.test/"])
+    mirror = WebRiskMirror(stand_in.client(), threat_types=("MALWARE", ), path=mirror_path)
+    mirror.update()
+
+    assert mirror.match_prefixes("http://good.test/") == []
+    assert stand_in.requests["searchHashes"] == 0
+    hits = mirror.match_prefixes("http://evil.test/page")
+    assert len(hits) == 1
+    assert mirror.confirm(hits) is True
+    assert mirror.confirm(hits) is True
+    assert stand_in.requests["searchHashes"] == 1  # ผลของ prefix เดิมถูก cache จนหมดอายุ
+
+    prefix, _ = hits[0]
+    assert mirror.confirm([(prefix, b"\0" * 32)]) is False
@@ -0,0 +1,192 @@
+# tools/web_scan/threat_set.py
+import array
+import bisect
+import csv
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import case, column, func, select, table
+
+from canonical import canonicalize_url, canonicalize_urls, expressions_for
+
+# header: magic, ความกว้างของ hash (byte), สำรอง, จำนวน hash ตามด้วย hash แบบ uint64 little-endian ที่เรียงแล้ว
+MAGIC = b"URLTSET1"
+HEADER = struct.Struct("<8sIIQ")
+HASH_WIDTH = 8
+
+
+def expression_hash(expression):
+    """First HASH_WIDTH bytes of the SHA-256 of a lookup expression, as an int."""
+    return int.from_bytes(hashlib.sha256(expression.encode("utf-8")).digest()[:HASH_WIDTH], "big")
+
+
+def canonical_expression(canonical_url):
+    """'host/path?query' of a canonical URL: the scheme is not part of a lookup expression."""
+    return canonical_url.split("://", 1)[-1]
+
+
+def url_hash(url):
+    return expression_hash(canonical_expression(canonicalize_url(url)))
+
+
+def write_threat_set(path, urls):
+    """
+    Writes the sorted, de-duplicated hashes of `urls` to `path` and returns
+    their number. The file is written next to `path` and then replaces it,
+    so processes that have the old file mapped keep reading the old list.
+    Building holds every hash in a Python set: plan on ~70 bytes per URL
+    while it runs, and 8 bytes per URL in the file.
+    """
+    unique = set()
+    urls = iter(urls)
+    # แปลงทีละชุด ไม่สร้าง list ของ URL ทั้งหมดในหน่วยความจำ
+    while chunk := list(itertools.islice(urls, 10000)):
+        unique.update(expression_hash(canonical_expression(url)) for url in canonicalize_urls(chunk, cache=False))
+    hashes = array.array("Q", sorted(unique))
+    del unique
+    if sys.byteorder != "little":
+        hashes.byteswap()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, HASH_WIDTH, 0, len(hashes)))
+            hashes.tofile(f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(hashes)
+
+
+def read_blacklist(engine):
+    """Active URLs of the blacklist database (table url of url_blacklist/app.py)."""
+    url, status = column("url"), column("status")
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=10000).execute(
+            select(url).select_from(table("url")).where(status == True)
+        )
+        for (value,) in result:
+            if value:
+                yield value
+
+
+def blacklist_watermark(engine):
+    """
+    (max id, row count, sum of the ids of active rows) of the blacklist
+    database. Inserts and deletes change the first two, status toggles the
+    third, so an unchanged watermark means the file need not be rebuilt.
+    """
+    row_id, status = column("id"), column("status")
+    with engine.connect() as connection:
+        return tuple(connection.execute(
+            select(func.max(row_id), func.count(), func.sum(case((status == True, row_id), else_=0))).select_from(table("url"))
+        ).one())
+
+
+def read_phishtank_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("url"):
+                yield row["url"]
+
+
+def read_url_lines(path):
+    """One URL per line, as in the OpenPhish feed."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+class _LittleEndianHashes:
+    """uint64 sequence over the mapped file for big-endian machines, where memoryview.cast("Q") would byte-swap."""
+
+    def __init__(self, buffer, count):
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return struct.unpack_from("<Q", self._buffer, HEADER.size + i * HASH_WIDTH)[0]
+
+
+class ThreatSet:
+    """
+    Read-only set of URLs backed by a file written with write_threat_set().
+
+    The file is mmap'd, not loaded: every scanner process (and any web app)
+    that opens it shares the same page-cached copy, 8 bytes per URL, and a
+    lookup is a binary search over the mapping without building a Python
+    object per entry. The file's identity is checked at most every
+    `check_interval` seconds; when it has been replaced the new file is
+    mapped and swapped in with one assignment.
+    """
+
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self._hashes = None
+        self._identity = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._open()
+
+    def __contains__(self, url):
+        return self.contains_hash(url_hash(url))
+
+    def __len__(self):
+        self._maybe_reload()
+        return len(self._hashes)
+
+    def contains_hash(self, value):
+        self._maybe_reload()
+        hashes = self._hashes
+        i = bisect.bisect_left(hashes, value)
+        return i < len(hashes) and hashes[i] == value
+
+    def match_expressions(self, url):
+        """Listed lookup expressions of the URL (host and path prefixes, as in Safe Browsing)."""
+        _, expressions = next(expressions_for([url]))
+        return [expression for expression in expressions if self.contains_hash(expression_hash(expression))]
+
+    def _open(self):
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, width, _, count = HEADER.unpack_from(mapping)
+        if magic != MAGIC or width != HASH_WIDTH or len(mapping) != HEADER.size + count * HASH_WIDTH:
+            mapping.close()
+            raise ValueError(f"ThreatSet, {self.path} is not a threat set file.")
+        if sys.byteorder == "little":
+            hashes = memoryview(mapping)[HEADER.size:].cast("Q")
+        else:
+            hashes = _LittleEndianHashes(mapping, count)
+        # mapping เดิมถูกปิดเองเมื่อไม่มี lookup ใดอ้างถึงแล้ว
+        self._hashes = hashes
+        self._identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+                if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self._identity:
+                    self._open()
+            except (OSError, ValueError) as e:
+                print(f"ThreatSet, Cannot reload {self.path}, keeping the previous list: {e}")
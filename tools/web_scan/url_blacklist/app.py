@@ -12,11 +12,16 @@ import csv
 import json
 from io import StringIO, BytesIO
 import os
+import sys
 from sqlalchemy.exc import IntegrityError
 from dateutil.parser import parse as parse_date
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
+# canonical.py อยู่ใน web_scan (โฟลเดอร์แม่ของ url_blacklist) ใช้รูปแบบ URL เดียวกับ check_urls.py
+sys.path.insert(0, os.path.join(current_dir, '..'))
+from canonical import canonicalize_url
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{current_dir}/blacklist.db'    # 
@@ -88,7 +93,7 @@ def index():
 @app.route('/addd', methods=['POST'])
 @login_required
 def addd_url():
-    url = request.form['url']
+    url = canonicalize_url(request.form['url'])
     category = request.form['category']
     reason = request.form['reason']
     source = request.form['source']
@@ -108,7 +113,7 @@ def addd_url():
 def add_url():
     form = AddURLForm()
     if form.validate_on_submit():
-        url = form.url.data
+        url = canonicalize_url(form.url.data)
         category = form.category.data
         reason = form.reason.data
         source = form.source.data
@@ -203,10 +208,11 @@ def import_data():
             csv_reader = csv.DictReader(stream)
             
             for row in csv_reader:
-                existing_url = URL.query.filter_by(url=row['url']).first()
+                canonical_url = canonicalize_url(row['url'])
+                existing_url = URL.query.filter_by(url=canonical_url).first()
                 if existing_url:
                     continue
-                url = URL(url=row['url'], category=row['category'], 
+                url = URL(url=canonical_url, category=row['category'], 
                           date_added=parse_date(row['date_added']).date(), 
                           reason=row['reason'], source=row['source'], status=row['status'] in ['1', 'True'])
                 db.session.add(url)
@@ -219,10 +225,11 @@ def import_data():
             data = json.load(file)
             total_rows = len(data)
             for index, item in enumerate(data):
-                existing_url = URL.query.filter_by(url=item['url']).first()
+                canonical_url = canonicalize_url(item['url'])
+                existing_url = URL.query.filter_by(url=canonical_url).first()
                 if existing_url:
                     continue
-                url = URL(url=item['url'], category=item['category'], 
+                url = URL(url=canonical_url, category=item['category'], 
                           date_added=parse_date(item['date_added']).date(), 
                           reason=item['reason'], source=item['source'], status=item['status'])
                 db.session.add(url)
@@ -0,0 +1,130 @@
+# tools/web_scan/url_notifier.py
+import asyncio
+import sqlite3
+
+
+class PollingNotifier:
+    """
+    Fallback notifier: wait() simply sleeps for the timeout, which is what
+    check_urls_task did before push-based wakeups existed.
+    """
+
+    push = False  # True เมื่อ wait() ถูกปลุกด้วยการแจ้งเตือนจริง ไม่ใช่แค่ timeout
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    async def start(self):
+        pass
+
+    def notify(self):
+        self._event.set()
+
+    async def wait(self, timeout):
+        """Returns early if new rows may have arrived since the previous wait()."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+    def close(self):
+        pass
+
+
+class PostgresNotifier(PollingNotifier):
+    """
+    LISTENs on a channel that the insert_url_to_check() trigger notifies.
+    The notifications carry no payload; each one only means "claim again".
+
+    Uses a dedicated psycopg2 connection in autocommit mode whose socket is
+    watched by the event loop, so nothing is queried while no link is created.
+    """
+
+    push = True
+
+    def __init__(self, engine, channel):
+        super().__init__()
+        self.engine = engine
+        self.channel = channel
+        self._conn = None
+
+    async def start(self):
+        raw = self.engine.raw_connection()
+        raw.detach()  # ไม่คืน connection นี้ให้ pool เพราะต้อง LISTEN ตลอด
+        self._conn = raw.driver_connection
+        self._conn.autocommit = True
+        from psycopg2.extensions import quote_ident  # create_notifier() ใช้ class นี้เฉพาะกับ psycopg2
+        with self._conn.cursor() as cursor:
+            # pg_notify() ใช้ชื่อช่องตรงตัว จึงต้อง quote ไม่ให้ LISTEN แปลงเป็นตัวพิมพ์เล็ก
+            cursor.execute(f"LISTEN {quote_ident(self.channel, self._conn)};")
+        asyncio.get_running_loop().add_reader(self._conn.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        self._conn.poll()
+        if self._conn.notifies:
+            self._conn.notifies.clear()
+            self.notify()
+
+    def close(self):
+        if self._conn is not None:
+            asyncio.get_event_loop().remove_reader(self._conn.fileno())
+            self._conn.close()
+            self._conn = None
+
+
+class SQLiteDataVersionNotifier(PollingNotifier):
+    """
+    Watches PRAGMA data_version, which changes whenever another connection
+    commits to the database file. Reading it costs no table access, so it
+    can be polled far more often than SELECTing urls_to_check. The PRAGMA
+    still takes the file's shared lock, so it runs in a thread.
+
+    The scanner's own commits (results, lease renewals, completed claims)
+    come from other connections too, so they also wake wait(). Each such
+    wakeup costs one claim_urls() that finds nothing, at most one per
+    poll_seconds, and only while the queue is empty. Telling them apart from
+    the trigger's inserts would need a table read on every poll.
+    """
+
+    push = True
+
+    def __init__(self, database_file, poll_seconds=0.2):
+        super().__init__()
+        self.database_file = database_file
+        self.poll_seconds = poll_seconds
+        self._conn = None
+        self._task = None
+
+    async def start(self):
+        self._conn = await asyncio.to_thread(sqlite3.connect, self.database_file, check_same_thread=False)
+        self._task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        last_version = None
+        while True:
+            version = await asyncio.to_thread(self._data_version)
+            if version != last_version:
+                last_version = version
+                self.notify()
+            await asyncio.sleep(self.poll_seconds)
+
+    def _data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def create_notifier(engine, channel, poll_seconds=0.2):
+    """Picks LISTEN/NOTIFY on PostgreSQL (psycopg2), data_version on SQLite, plain polling otherwise."""
+    if engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2":
+        return PostgresNotifier(engine, channel)
+    if engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        return SQLiteDataVersionNotifier(engine.url.database, poll_seconds)
+    return PollingNotifier()
@@ -0,0 +1,129 @@
+# tools/web_scan/urlhaus_mirror.py
+import asyncio
+import csv
+import email.utils
+import os
+import threading
+
+import aiohttp
+
+from canonical import canonicalize_url, canonicalize_urls
+
+# คอลัมน์ของ csv_online / csv_recent (บรรทัด header อยู่ในคอมเมนต์ "# id,dateadded,...")
+DEFAULT_COLUMNS = ["id", "dateadded", "url", "url_status", "last_online", "threat", "tags", "urlhaus_link", "reporter"]
+
+
+def parse_urlhaus_csv(lines):
+    """
+    Streams a URLhaus CSV dump (csv_online or csv_recent) into a dict of
+    canonical URL -> (threat, tags, urlhaus_link). Comment lines start
+    with '#'; the last one naming the columns is used as the header.
+    """
+    columns = DEFAULT_COLUMNS
+    urls, entries = [], []
+    for line in lines:
+        if line.startswith("#"):
+            header = line.lstrip("#").strip().replace(" ", "")
+            if header.startswith("id,"):
+                columns = header.split(",")
+            continue
+        if not line.strip():
+            continue
+        row = dict(zip(columns, next(csv.reader([line]))))
+        url = row.get("url")
+        if not url:
+            continue
+        urls.append(url)
+        entries.append((row.get("threat"), row.get("tags"), row.get("urlhaus_link")))
+    return dict(zip(canonicalize_urls(urls, cache=False), entries))
+
+
+class URLhausMirror:
+    """
+    Local copy of a URLhaus CSV dump, so check_urlhaus() is a dict lookup
+    instead of one API request per URL.
+
+    update() downloads the dump with a conditional GET and streams it to a
+    temporary file next to `path`, which then replaces `path`; load() parses
+    that file into a new index and swaps it in with one assignment, so
+    lookups see either the old or the new list. Other processes pick up a
+    newer file with load_if_changed().
+    """
+
+    def __init__(self, path, feed_url, auth_key=None, timeout=120):
+        self.path = path
+        self.feed_url = feed_url
+        self.auth_key = auth_key
+        self.timeout = timeout
+        self._index = None
+        self._mtime = None
+        self._etag = None
+        self._last_modified = None
+        self._lock = threading.Lock()
+        self.load_if_changed()
+
+    @property
+    def ready(self):
+        return self._index is not None
+
+    def __len__(self):
+        return len(self._index or ())
+
+    def get(self, url):
+        """Returns (threat, tags, urlhaus_link) if URLhaus lists the URL, otherwise None."""
+        return (self._index or {}).get(canonicalize_url(url))
+
+    def load(self):
+        """Parses the file at `path`. Blocking: run it off the event loop."""
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, newline="", encoding="utf-8", errors="replace") as f:
+                index = parse_urlhaus_csv(f)
+            self._mtime = mtime
+            if not index and self._index:
+                # dump ว่างมักเป็นความผิดพลาดฝั่งผู้ให้บริการ ใช้รายการเดิมไปก่อน
+                print(f"URLhausMirror, {self.path} has no URLs, keeping the previous list.")
+                return len(self._index)
+            self._index = index
+        return len(index)
+
+    def load_if_changed(self):
+        """Loads the file if it exists and changed since the last load. Returns True if it did."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self.load()
+        return True
+
+    async def update(self, session):
+        """
+        Downloads the dump if it changed and loads it in a thread. Returns
+        the number of URLs, or None if the server answered 304.
+        """
+        headers = {}
+        if self.auth_key:
+            headers["Auth-Key"] = self.auth_key
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        elif self._mtime is not None:
+            headers["If-Modified-Since"] = email.utils.formatdate(self._mtime / 1e9, usegmt=True)  # ไฟล์จากการรันครั้งก่อน
+
+        download_path = f"{self.path}.download"
+        async with session.get(self.feed_url, headers=headers, timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+            if response.status == 304:
+                return None
+            response.raise_for_status()
+            # เขียนลงไฟล์ทีละ chunk ไม่เก็บทั้ง dump ไว้ในหน่วยความจำ
+            with open(download_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    f.write(chunk)
+            self._etag = response.headers.get("ETag")
+            self._last_modified = response.headers.get("Last-Modified")
+
+        os.replace(download_path, self.path)
+        return await asyncio.get_running_loop().run_in_executor(None, self.load)
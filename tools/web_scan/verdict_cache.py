@@ -0,0 +1,221 @@
+# tools/web_scan/verdict_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, Float, String, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from canonical import canonicalize_url
+
+Base = declarative_base()
+
+# ค่าที่ aget() คืนเมื่อไม่พบใน cache (None เป็นผลลัพธ์ที่ถูกต้อง = INCONCLUSIVE)
+MISS = object()
+
+# จำนวน URL ต่อหนึ่ง query ของ aget() (SQLite รุ่นเก่าจำกัด bound parameter ไว้ที่ 999)
+BATCH_SIZE = 200
+
+# TTL (วินาที) ตามผลลัพธ์ ใช้เมื่อ provider ไม่ได้กำหนดค่าเอง, 0 = ไม่ cache
+DEFAULT_TTLS = {
+    "DANGER": 7 * 24 * 3600,
+    "SAFE": 6 * 3600,
+    "INCONCLUSIVE": 0,
+}
+
+
+class VerdictCacheEntry(Base):
+    __tablename__ = "verdict_cache"
+    url = Column(String, primary_key=True)          # canonical URL
+    provider = Column(String, primary_key=True)     # เช่น VirusTotal, URLhaus
+    result = Column(String)                         # DANGER, SAFE, INCONCLUSIVE
+    expires_at = Column(Float, index=True)          # epoch seconds
+
+
+def result_to_str(result):
+    if result is True:
+        return "DANGER"
+    if result is False:
+        return "SAFE"
+    return "INCONCLUSIVE"
+
+
+def str_to_result(result_str):
+    if result_str == "DANGER":
+        return True
+    if result_str == "SAFE":
+        return False
+    return None
+
+
+class VerdictCache:
+    """
+    Two-tier cache of provider verdicts keyed by (canonical URL, provider).
+
+    The first tier is an in-process LRU; misses fall through to the
+    verdict_cache table so cached verdicts survive restarts. TTLs are chosen
+    per provider and per result, e.g. DANGER is kept longer than SAFE.
+
+    aget(), queue() and aflush() reach the table through `async_engine`,
+    so they never block the event loop. Misses
+    requested in the same event loop iteration are read with one query,
+    and queued verdicts are written with one upsert per aflush().
+    """
+
+    def __init__(self, engine, max_entries=10000, ttls=None, async_engine=None):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+        self.async_engine = async_engine
+        self.AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False) if async_engine is not None else None
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self._lru = OrderedDict()
+        self._loading = {}   # key -> future ของ aget() ที่รอ query ถัดไป
+        self._load_task = None
+        self._queued = {}    # key -> row ที่ queue() รอเขียนลงตาราง
+        self.hits = {}
+        self.misses = {}
+
+    def create_table(self):
+        """Creates the verdict_cache table if it does not exist."""
+        Base.metadata.create_all(self.engine)
+
+    def ttl_for(self, provider, result_str):
+        provider_ttls = self.ttls.get(provider, {})
+        return provider_ttls.get(result_str, DEFAULT_TTLS.get(result_str, 0))
+
+    def caches(self, provider):
+        """False when every TTL of the provider is 0, so lookups can be skipped."""
+        return any(self.ttl_for(provider, result_str) > 0 for result_str in DEFAULT_TTLS)
+
+    async def aget(self, url, provider):
+        """Returns the cached True/False/None verdict, or MISS."""
+        key = (canonicalize_url(url), provider)
+        cached = self._get_memory(key)
+        if cached is MISS:
+            future = self._loading.get(key)
+            if future is None:
+                future = self._loading[key] = asyncio.get_running_loop().create_future()
+                if self._load_task is None:
+                    self._load_task = asyncio.get_running_loop().create_task(self._load())
+            # ผู้รอ key เดียวกันใช้ future ร่วมกัน การยกเลิกผู้รอคนหนึ่งต้องไม่ยกเลิกคนอื่น
+            cached = await asyncio.shield(future)
+        self._count(self.misses if cached is MISS else self.hits, provider)
+        return cached
+
+    def queue(self, url, provider, result):
+        """Caches the verdict; the row is written to the table by the next aflush()."""
+        entry = self._entry(url, provider, result)
+        if entry is not None:
+            self._queued[(entry.url, entry.provider)] = {
+                "url": entry.url, "provider": entry.provider, "result": entry.result, "expires_at": entry.expires_at
+            }
+
+    def queued(self):
+        return len(self._queued)
+
+    async def aflush(self):
+        """Writes the verdicts queued since the last aflush(). Returns their number."""
+        rows, self._queued = list(self._queued.values()), {}
+        if not rows:
+            return 0
+        insert = postgresql.insert if self.async_engine.dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(VerdictCacheEntry.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["url", "provider"],
+            set_={"result": stmt.excluded.result, "expires_at": stmt.excluded.expires_at}
+        )
+        try:
+            async with self.AsyncSession() as session, session.begin():
+                await session.execute(stmt, rows)
+        except Exception as e:
+            print(f"VerdictCache.aflush(), Database error: {e}")
+            return 0
+        return len(rows)
+
+    def purge_expired(self):
+        """Deletes expired rows from the persistent tier."""
+        with self.Session() as session:
+            try:
+                deleted = session.query(VerdictCacheEntry).filter(VerdictCacheEntry.expires_at <= time.time()).delete()
+                session.commit()
+                return deleted
+            except Exception as e:
+                session.rollback()
+                print(f"VerdictCache.purge_expired(), Database error: {e}")
+                return 0
+
+    def stats(self):
+        """Returns hit/miss counters per provider."""
+        stats = {}
+        for provider in set(self.hits) | set(self.misses):
+            hits = self.hits.get(provider, 0)
+            misses = self.misses.get(provider, 0)
+            stats[provider] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            }
+        return stats
+
+    async def _load(self):
+        """Reads the keys aget() is waiting for, a batch per query, until none are left."""
+        try:
+            while self._loading:
+                await asyncio.sleep(0)  # key ที่ถูกขอในรอบเดียวกันของ event loop ไปใน query เดียวกัน
+                batch, self._loading = self._loading, {}
+                records = {}
+                try:
+                    urls = list({url for url, _ in batch})
+                    async with self.AsyncSession() as session:
+                        for i in range(0, len(urls), BATCH_SIZE):
+                            rows = await session.scalars(
+                                select(VerdictCacheEntry).where(VerdictCacheEntry.url.in_(urls[i:i + BATCH_SIZE]))
+                            )
+                            records.update(((record.url, record.provider), record) for record in rows)
+                except Exception as e:
+                    print(f"VerdictCache.aget(), Database error: {e}")
+                for key, future in batch.items():
+                    if not future.done():
+                        future.set_result(self._get_record(key, records.get(key)))
+        finally:
+            self._load_task = None
+
+    def _get_memory(self, key):
+        entry = self._lru.get(key)
+        if entry is not None:
+            result_str, expires_at = entry
+            if expires_at > time.time():
+                self._lru.move_to_end(key)
+                return str_to_result(result_str)
+            del self._lru[key]
+        return MISS
+
+    def _get_record(self, key, record):
+        if record is not None and record.expires_at > time.time():
+            self._remember(key, record.result, record.expires_at)
+            return str_to_result(record.result)
+        return MISS
+
+    def _entry(self, url, provider, result):
+        """Remembers the verdict in the LRU and returns the row to store, or None if it is not cached."""
+        result_str = result_to_str(result)
+        ttl = self.ttl_for(provider, result_str)
+        if ttl <= 0:
+            return None
+        key = (canonicalize_url(url), provider)
+        expires_at = time.time() + ttl
+        self._remember(key, result_str, expires_at)
+        return VerdictCacheEntry(url=key[0], provider=provider, result=result_str, expires_at=expires_at)
+
+    def _remember(self, key, result_str, expires_at):
+        self._lru[key] = (result_str, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    @staticmethod
+    def _count(counter, provider):
+        counter[provider] = counter.get(provider, 0) + 1
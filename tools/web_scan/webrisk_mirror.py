@@ -0,0 +1,175 @@
+# tools/web_scan/webrisk_mirror.py
+import hashlib
+import json
+import os
+import threading
+import time
+
+from google.cloud import webrisk_v1
+
+from canonical import ExpressionGenerator, UrlParseError
+
+RESET = webrisk_v1.ComputeThreatListDiffResponse.ResponseType.RESET
+
+
+class WebRiskMirror:
+    """
+    Local mirror of the Google Web Risk threat lists (Update API).
+
+    update() pulls threat-list diffs with compute_threat_list_diff() and
+    keeps the sorted hash prefixes of every list on disk. match_prefixes()
+    hashes the lookup expressions of a URL and checks them against the local
+    prefixes, so most URLs are cleared without a network call. Only prefix
+    hits are confirmed with search_hashes(), whose full-hash answers are
+    cached until their expire time.
+
+    `client` is anything with compute_threat_list_diff() and search_hashes()
+    (a WebRiskServiceClient, or a stand-in serving canned prefix lists).
+    """
+
+    def __init__(self, client, threat_types=("MALWARE", "SOCIAL_ENGINEERING"), path=None, max_diff_entries=0):
+        self.client = client
+        self.threat_types = list(threat_types)
+        self.path = path
+        self.max_diff_entries = max_diff_entries
+        self._lists = {}            # threat_type -> sorted list ของ prefix (bytes)
+        self._tokens = {}           # threat_type -> version token (bytes)
+        self._prefixes = set()      # prefix ทั้งหมดจากทุก list สำหรับ lookup
+        self._prefix_sizes = ()
+        self._full_hashes = {}      # prefix -> (expire_ts, {full_hash: [threat types]})
+        self._lock = threading.Lock()
+        self.next_update = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    @property
+    def ready(self):
+        return bool(self._tokens)
+
+    def update(self):
+        """Applies one diff per threat list. Blocking: run it off the event loop."""
+        next_updates = []
+        for threat_type in self.threat_types:
+            response = self.client.compute_threat_list_diff(
+                threat_type=threat_type,
+                version_token=self._tokens.get(threat_type, b""),
+                constraints={"max_diff_entries": self.max_diff_entries, "supported_compressions": ["RAW"]},
+            )
+            prefixes = [] if response.response_type == RESET else list(self._lists.get(threat_type, []))
+
+            # ลบตาม index ของ list เดิม (ที่เรียงแล้ว) ก่อน แล้วจึงเพิ่ม prefix ใหม่
+            removals = set(response.removals.raw_indices.indices)
+            if removals:
+                prefixes = [prefix for i, prefix in enumerate(prefixes) if i not in removals]
+            for raw in response.additions.raw_hashes:
+                size = raw.prefix_size
+                data = raw.raw_hashes
+                prefixes.extend(data[i:i + size] for i in range(0, len(data), size))
+            prefixes.sort()
+
+            if hashlib.sha256(b"".join(prefixes)).digest() != response.checksum.sha256:
+                # checksum ไม่ตรง: ทิ้ง list นี้แล้วขอ RESET ในรอบถัดไป
+                print(f"WebRiskMirror.update(), Checksum mismatch for {threat_type}, list will be reset.")
+                self._lists.pop(threat_type, None)
+                self._tokens.pop(threat_type, None)
+                continue
+
+            self._lists[threat_type] = prefixes
+            self._tokens[threat_type] = response.new_version_token
+            if response.recommended_next_diff:
+                next_updates.append(response.recommended_next_diff.timestamp())
+
+        self._rebuild_index()
+        self.next_update = min(next_updates) if next_updates else 0
+        if self.path:
+            self.save()
+        return sum(len(prefixes) for prefixes in self._lists.values())
+
+    def match_prefixes(self, url):
+        """
+        Returns [(prefix, full_hash)] for every lookup expression of the URL
+        whose hash prefix is in the local lists. An empty list means the URL
+        is not on any list. Raises UrlParseError if the URL cannot be parsed.
+        """
+        hits = []
+        prefixes = self._prefixes
+        for expression in ExpressionGenerator(url).Expressions():
+            full_hash = hashlib.sha256(expression.Value().encode("utf-8")).digest()
+            for size in self._prefix_sizes:
+                if full_hash[:size] in prefixes:
+                    hits.append((full_hash[:size], full_hash))
+                    break
+        return hits
+
+    def confirm(self, hits):
+        """
+        Confirms prefix hits with search_hashes(). Returns True if any full
+        hash is listed. Blocking: run it off the event loop.
+        """
+        now = time.time()
+        for prefix, full_hash in hits:
+            cached = self._full_hashes.get(prefix)
+            if cached is None or cached[0] <= now:
+                response = self.client.search_hashes(hash_prefix=prefix, threat_types=self.threat_types)
+                expire_ts = response.negative_expire_time.timestamp() if response.negative_expire_time else now + 300
+                listed = {}
+                for threat in response.threats:
+                    listed[threat.hash_] = list(threat.threat_types)
+                    if threat.expire_time:
+                        expire_ts = min(expire_ts, threat.expire_time.timestamp())
+                cached = (expire_ts, listed)
+                with self._lock:
+                    self._full_hashes[prefix] = cached
+            if full_hash in cached[1]:
+                return True
+        return False
+
+    def lookup(self, url):
+        """Blocking convenience wrapper: True if listed, False if not, None if unparsable."""
+        try:
+            hits = self.match_prefixes(url)
+        except UrlParseError:
+            return None
+        return self.confirm(hits) if hits else False
+
+    def save(self):
+        data = {}
+        for threat_type, prefixes in self._lists.items():
+            by_size = {}
+            for prefix in prefixes:
+                by_size.setdefault(len(prefix), []).append(prefix)
+            data[threat_type] = {
+                "version_token": self._tokens[threat_type].hex(),
+                "prefixes": {str(size): b"".join(group).hex() for size, group in by_size.items()},
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"WebRiskMirror.load(), Cannot read {self.path}: {e}")
+            return
+        for threat_type, entry in data.items():
+            prefixes = []
+            for size, raw in entry["prefixes"].items():
+                size = int(size)
+                raw = bytes.fromhex(raw)
+                prefixes.extend(raw[i:i + size] for i in range(0, len(raw), size))
+            prefixes.sort()
+            self._lists[threat_type] = prefixes
+            self._tokens[threat_type] = bytes.fromhex(entry["version_token"])
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        prefixes = set()
+        for threat_list in self._lists.values():
+            prefixes.update(threat_list)
+        # สลับทั้ง set ในครั้งเดียว lookup ที่กำลังทำงานจึงเห็นข้อมูลชุดเก่าหรือชุดใหม่เท่านั้น
+        self._prefix_sizes = tuple(sorted({len(prefix) for prefix in prefixes}))
+        self._prefixes = prefixes
+        self._full_hashes = {}